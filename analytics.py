@@ -0,0 +1,251 @@
+"""
+Spending trends computed over column arrays.
+
+Nothing here walks `read_expenses` output row by row. For a date range two
+compact column sets are loaded in one read snapshot:
+
+* the `daily_totals` rollup (day, category, total, count), whose size
+  depends on the length of the range and not on the number of expenses;
+* a histogram of expense amounts (amount, count), from which percentiles
+  are read without materialising every amount.
+
+The kernels work on whole columns, with NumPy when it is installed and the
+standard library's `array` module otherwise. Both produce the same results.
+"""
+
+import bisect
+import datetime
+import itertools
+import math
+import sqlite3
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional
+    np = None
+
+import archive
+from db_cache import cached
+from db_connection import get_connection
+
+
+ROLLING_WINDOWS = (7, 30)
+PERCENTILES = (50, 75, 90, 95, 99)
+DEFAULT_RANGE_DAYS = 365
+
+
+def _column(values):
+    """
+    Pack an iterable of integers into a column.
+    """
+    if np is not None:
+        return np.fromiter(values, dtype=np.int64)
+    return array("q", values)
+
+
+def _bincount(indexes, weights, size):
+    """
+    Sum `weights` into `size` bins selected by `indexes`.
+    """
+    if np is not None:
+        return np.bincount(indexes, weights=weights, minlength=size).astype(np.int64)
+    bins = array("q", bytes(8 * size))
+    for index, weight in zip(indexes, weights):
+        bins[index] += weight
+    return bins
+
+
+def _cumsum(values):
+    """
+    Return the prefix sums of `values`, starting with 0.
+    """
+    if np is not None:
+        return np.concatenate((np.zeros(1, dtype=np.int64), np.cumsum(values, dtype=np.int64)))
+    return array("q", itertools.accumulate(values, initial=0))
+
+
+def _rolling_means(sums, window):
+    """
+    Trailing means over `window` values, from the prefix sums of the values.
+
+    Entry i is the mean of values i .. i + window - 1.
+    """
+    if np is not None:
+        return (sums[window:] - sums[:-window]) / window
+    return [(sums[i + window] - sums[i]) / window for i in range(len(sums) - window)]
+
+
+def _percentiles(values, counts, percentiles):
+    """
+    Nearest-rank percentiles of a histogram sorted by value.
+    """
+    cumulative = _cumsum(counts)[1:]
+    total = int(cumulative[-1]) if len(cumulative) else 0
+    if not total:
+        return {f"p{p}": None for p in percentiles}
+    ranks = [max(1, math.ceil(p * total / 100)) for p in percentiles]
+    if np is not None:
+        positions = np.searchsorted(cumulative, ranks)
+    else:
+        positions = [bisect.bisect_left(cumulative, rank) for rank in ranks]
+    return {f"p{p}": int(values[position]) for p, position in zip(percentiles, positions)}
+
+
+def _select(column, mask):
+    """
+    Return the entries of `column` whose `mask` entry is true.
+    """
+    if np is not None:
+        return column[mask]
+    return array("q", itertools.compress(column, mask))
+
+
+def _month_start(day, months_back=0):
+    index = day.year * 12 + day.month - 1 - months_back
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def _load_columns(db_name, load_start, start, end):
+    """
+    Load the rollup and the amount histogram for a range in one snapshot.
+
+    Rollup days are returned as offsets from `load_start`. The histogram
+    only covers [start, end], archived expenses included; the rollup
+    already counts them.
+    """
+    conn = get_connection(db_name)
+    with conn:
+        conn.execute("BEGIN")  # One snapshot for both queries
+        daily = conn.execute("""
+            SELECT CAST(julianday(date) - julianday(?) AS INTEGER), category, total_cents, count
+            FROM daily_totals
+            WHERE date >= ? AND date <= ?
+        """, (load_start.isoformat(), load_start.isoformat(), end.isoformat())).fetchall()
+        histogram = conn.execute("""
+            SELECT amount_cents, COUNT(*)
+            FROM expenses INDEXED BY idx_expenses_amount_cents_date_added
+            WHERE date_added >= ? AND date_added <= ? AND amount_cents IS NOT NULL
+            GROUP BY amount_cents
+            ORDER BY amount_cents
+        """, (start.isoformat(), end.isoformat())).fetchall()
+        years = archive.archived_years(conn, start, end + datetime.timedelta(days=1))
+    if years:
+        counts = archive.amount_histogram(years, start, end)
+        counts.update(dict(histogram))
+        histogram = sorted(counts.items())
+    return daily, histogram
+
+
+@cached
+def spending_trends(db_name="expenses.db", start_date=None, end_date=None, today=None):
+    """
+    Compute spending trends for the days from `start_date` to `end_date`.
+
+    Args:
+        db_name (str): Name of the database file.
+        start_date (datetime.date): First day of the range (default is
+            `DEFAULT_RANGE_DAYS` days before the end).
+        end_date (datetime.date): Last day of the range (default is `today`).
+        today (datetime.date): Reference day (default is today). The month
+            containing the end of the range is projected to its last day.
+
+    Returns:
+        dict: Totals in cents per category (largest first), per month with
+        the change from the previous month, per day with rolling 7 and
+        30 day averages, amount percentiles, and the projected month-end
+        spend.
+
+    Raises:
+        ValueError: If the range is empty.
+    """
+    end = end_date or today
+    start = start_date or end - datetime.timedelta(days=DEFAULT_RANGE_DAYS - 1)
+    if start > end:
+        raise ValueError("The start date must not be after the end date.")
+
+    # Load enough history for full rolling windows and the first month's delta
+    load_start = min(start - datetime.timedelta(days=max(ROLLING_WINDOWS) - 1), _month_start(start, 1))
+    lead = (start - load_start).days
+    size = (end - load_start).days + 1
+
+    try:
+        daily, histogram = _load_columns(db_name, load_start, start, end)
+    except sqlite3.Error as e:
+        print(f"Error loading analytics: {e}")
+        daily, histogram = [], []
+
+    days, categories, totals, counts = zip(*daily) if daily else ((), (), (), ())
+    names = sorted(set(categories))
+    codes = {name: code for code, name in enumerate(names)}
+    days, totals, counts = _column(days), _column(totals), _column(counts)
+    category_codes = _column(codes[name] for name in categories)
+
+    # Per category, over the requested range only
+    in_range = [day >= lead for day in days] if np is None else days >= lead
+    range_codes = _select(category_codes, in_range)
+    category_totals = _bincount(range_codes, _select(totals, in_range), len(names))
+    category_counts = _bincount(range_codes, _select(counts, in_range), len(names))
+    total_cents = int(sum(category_totals))
+    by_category = sorted((
+        {
+            "category": name,
+            "total_cents": int(category_totals[code]),
+            "count": int(category_counts[code]),
+            "share": round(int(category_totals[code]) / total_cents, 4) if total_cents else 0.0,
+        }
+        for code, name in enumerate(names)
+    ), key=lambda entry: (-entry["total_cents"], entry["category"]))
+
+    # Dense per-day series; any range total is a difference of two prefix sums
+    daily_cents = _bincount(days, totals, size)
+    sums = _cumsum(daily_cents)
+    rolling = {window: _rolling_means(sums[lead - window + 1:], window) for window in ROLLING_WINDOWS}
+    by_day = [
+        {
+            "date": (start + datetime.timedelta(days=i)).isoformat(),
+            "total_cents": int(daily_cents[lead + i]),
+            **{f"avg_{window}d_cents": round(float(rolling[window][i]), 2) for window in ROLLING_WINDOWS},
+        }
+        for i in range(size - lead)
+    ]
+
+    def offset(day):
+        return min(max((day - load_start).days, 0), size)
+
+    by_month = []
+    month = _month_start(start)
+    previous = int(sums[offset(month)] - sums[offset(_month_start(month, 1))])
+    while month <= end:
+        following = _month_start(month, -1)
+        month_total = int(sums[offset(following)] - sums[offset(month)])
+        by_month.append({
+            "month": month.strftime("%Y-%m"),
+            "total_cents": month_total,
+            "change_cents": month_total - previous,
+            "change_ratio": round((month_total - previous) / previous, 4) if previous else None,
+        })
+        month, previous = following, month_total
+
+    month_to_date = by_month[-1]["total_cents"]
+    days_left = (_month_start(end, -1) - end).days - 1
+    average = rolling[max(ROLLING_WINDOWS)][-1]
+    projection = {
+        "month": by_month[-1]["month"],
+        "spent_cents": month_to_date,
+        "days_left": days_left,
+        "projected_cents": month_to_date + round(float(average) * days_left),
+    }
+
+    amounts, amount_counts = zip(*histogram) if histogram else ((), ())
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "total_cents": total_cents,
+        "count": int(sum(category_counts)),
+        "categories": by_category,
+        "months": by_month,
+        "days": by_day,
+        "percentiles_cents": _percentiles(_column(amounts), _column(amount_counts), PERCENTILES),
+        "projection": projection,
+    }
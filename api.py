@@ -0,0 +1,368 @@
+"""
+JSON API for expenses, mounted under /api.
+
+Every GET response carries a strong ETag built from the persistent change
+counter of the expenses table (`get_data_version`). A poll whose
+`If-None-Match` still matches is answered with 304 Not Modified after a
+single-row read, without running the query or serialising anything.
+Responses are gzip- or deflate-compressed when they are large enough and
+the client accepts it.
+"""
+
+import functools
+import sqlite3
+from datetime import date
+
+from flask import Blueprint, abort, current_app, jsonify, request, url_for
+from werkzeug.exceptions import HTTPException
+
+from analytics import spending_trends
+from archive import ArchivedExpenseError
+from db_snapshot import read_db_name
+from db_storage import (
+    iter_expenses, get_expense, insert_expense, update_expense, delete_expense,
+    get_dashboard_summary, get_data_version, make_cursor, search_expenses, get_changes, sync_expenses,
+)
+from http_utils import (
+    parse_expense_filters, negotiate_encoding, compress_response, request_db_name, USER_HEADER,
+)
+
+
+api = Blueprint("api", __name__, url_prefix="/api")
+
+# Page size of GET /api/expenses
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Changes per page of GET /api/changes, and per batch of POST /api/sync
+DEFAULT_CHANGES_LIMIT = 1000
+MAX_CHANGES_LIMIT = 10000
+MAX_SYNC_CHANGES = 1000
+
+
+def _db_name():
+    return request_db_name(request, current_app.config)
+
+
+def _read_db_name():
+    return read_db_name(_db_name())
+
+
+def expense_json(expense):
+    """
+    Convert an Expense to its JSON representation.
+    """
+    return {
+        "id": expense.id,
+        "name": expense.name,
+        "category": expense.category,
+        "amount": expense.amount,
+        "amount_cents": expense.amount_cents,
+        "date_added": expense.date_added.isoformat() if expense.date_added else None,
+        "recurring": expense.recurring,
+        "recurring_schedule": expense.recurring_schedule,
+        "template_id": expense.template_id,
+    }
+
+
+def change_json(change):
+    """
+    Convert an ExpenseChange to the expense's JSON plus its `seq`, or a tombstone.
+    """
+    if change.expense is None:
+        return {"seq": change.seq, "id": change.id, "deleted": True}
+    return {"seq": change.seq, **expense_json(change.expense)}
+
+
+def conditional(read):
+    """
+    Serve a GET view's JSON with an ETag and answer matching polls with 304.
+
+    The ETag combines the data version, the current date (summaries and
+    default ranges depend on it) and the negotiated content coding, so
+    each distinct representation of a URL gets its own strong validator.
+
+    Args:
+        read (Callable[[], str]): Returns the database name the view reads,
+            `_read_db_name` or `_db_name`, so the version is that of the
+            data served: a snapshot's or the database's own.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            encoding = negotiate_encoding(request)
+            version = get_data_version(read())
+            etag = None
+            if version is not None:
+                etag = f"{version}-{date.today().isoformat()}-{encoding or 'identity'}"
+
+            if etag is not None and request.if_none_match.contains(etag):
+                response = current_app.response_class(status=304)
+                response.vary.add("Accept-Encoding")
+            else:
+                response = compress_response(jsonify(view(*args, **kwargs)), encoding)
+            if etag is not None:
+                response.set_etag(etag)
+            response.headers["Cache-Control"] = "no-cache"  # Always revalidate
+            if current_app.config.get("SHARD_ROUTER") is not None:
+                # Users' versions count independently; keep shared caches from mixing them up
+                response.vary.add(USER_HEADER)
+                response.headers["Cache-Control"] = "private, no-cache"
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def _json_body():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        abort(400, description="Expected a JSON object.")
+    return payload
+
+
+@api.errorhandler(HTTPException)
+def json_error(error):
+    """
+    Report errors as JSON instead of the default HTML pages.
+    """
+    response = jsonify({"error": error.description})
+    response.status_code = error.code
+    return response
+
+
+@api.errorhandler(sqlite3.Error)
+def database_error(error):
+    """
+    Report database failures as JSON too: 503 if the database was busy, 500 otherwise.
+    """
+    current_app.logger.error("Database error in %s %s: %s", request.method, request.path, error)
+    busy = getattr(error, "sqlite_errorcode", None) in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    response = jsonify({"error": "The database is busy, try again." if busy else "Database error."})
+    response.status_code = 503 if busy else 500
+    return response
+
+
+def _written_expense_json(expense_id):
+    """
+    Return the JSON of an expense just written, or only its id if it could
+    not be read back (deleted in the meantime, or the read failed).
+    """
+    expense = get_expense(expense_id, _db_name())
+    return expense_json(expense) if expense is not None else {"id": expense_id}
+
+
+@api.route("/expenses")
+@conditional(read=_read_db_name)
+def list_expenses():
+    """
+    List expenses, newest first by default.
+
+    Accepts the list filters (start, end, category, recurring, min_amount,
+    max_amount, sort) plus `limit` and an `after` cursor. The response's
+    `next` cursor is null on the last page.
+    """
+    try:
+        filters = parse_expense_filters(request.args)
+        limit = min(max(request.args.get("limit", DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+        expenses = list(iter_expenses(_read_db_name(), after=request.args.get("after") or None,
+                                      limit=limit + 1, **filters))
+    except ValueError as e:
+        abort(400, description=str(e))
+
+    next_cursor = make_cursor(expenses[limit - 1], filters["sort"]) if len(expenses) > limit else None
+    return {"expenses": [expense_json(expense) for expense in expenses[:limit]], "next": next_cursor}
+
+
+@api.route("/search")
+@conditional(read=_db_name)
+def search():
+    """
+    Full-text search over names and categories, best match first.
+
+    Takes the search text as `q`, the list filters (except sort), `limit`
+    and an `after` cursor. The response's `next` cursor is null on the
+    last page.
+    """
+    try:
+        filters = parse_expense_filters(request.args)
+        limit = min(max(request.args.get("limit", DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+        del filters["sort"]
+        results = search_expenses(filters.pop("search", ""), _db_name(), limit=limit,
+                                  after=request.args.get("after") or None, **filters)
+    except ValueError as e:
+        abort(400, description=str(e))
+    return {"expenses": [expense_json(expense) for expense in results.expenses], "next": results.next}
+
+
+@api.route("/expenses/<int:expense_id>")
+@conditional(read=_db_name)
+def get_expense_json(expense_id):
+    expense = get_expense(expense_id, _db_name())
+    if expense is None:
+        abort(404)
+    return expense_json(expense)
+
+
+@api.route("/expenses", methods=["POST"])
+def create_expense():
+    """
+    Create an expense from a JSON object with the fields of `write_expense`.
+    """
+    write_queue = current_app.config.get("WRITE_QUEUE")
+    try:
+        if write_queue is not None:
+            expense_id = write_queue.write(_json_body(), _db_name())
+        else:
+            expense_id = insert_expense(_json_body(), _db_name())
+    except ValueError as e:
+        abort(400, description=str(e))
+    response = jsonify(_written_expense_json(expense_id))
+    response.status_code = 201
+    response.headers["Location"] = url_for("api.get_expense_json", expense_id=expense_id)
+    return response
+
+
+@api.route("/expenses/<int:expense_id>", methods=["PUT"])
+def update_expense_json(expense_id):
+    """
+    Replace an expense with a JSON object with the fields of `write_expense`.
+    """
+    try:
+        updated = update_expense(expense_id, _json_body(), _db_name())
+    except ValueError as e:
+        abort(400, description=str(e))
+    except ArchivedExpenseError as e:
+        abort(409, description=str(e))
+    if not updated:
+        abort(404)
+    return jsonify(_written_expense_json(expense_id))
+
+
+@api.route("/expenses/<int:expense_id>", methods=["DELETE"])
+def delete_expense_json(expense_id):
+    try:
+        deleted = delete_expense(expense_id, _db_name())
+    except ArchivedExpenseError as e:
+        abort(409, description=str(e))
+    if not deleted:
+        abort(404)
+    return "", 204
+
+
+@api.route("/summary")
+@conditional(read=_read_db_name)
+def summary():
+    """
+    The dashboard totals (in cents), per-category totals and recent expenses.
+    """
+    summary = get_dashboard_summary(_read_db_name())
+    return {
+        "today": summary.today.isoformat(),
+        "daily_cents": summary.daily_cents,
+        "weekly_cents": summary.weekly_cents,
+        "monthly_cents": summary.monthly_cents,
+        "categories": [totals._asdict() for totals in summary.categories],
+        "recent_expenses": [expense_json(expense) for expense in summary.recent_expenses],
+    }
+
+
+@api.route("/changes")
+@conditional(read=_db_name)
+def changes():
+    """
+    The expenses changed since the `since` cursor, oldest change first.
+
+    Each change is the expense's current JSON with its `seq`, or a
+    tombstone {"seq", "id", "deleted": true}. Without `since` every
+    expense is returned, a page of `limit` at a time. Pass the response's
+    `cursor` as `since` next time; `has_more` asks for another page now.
+    """
+    try:
+        since = int(request.args.get("since") or 0)
+    except ValueError:
+        abort(400, description="Invalid cursor.")
+    limit = min(max(request.args.get("limit", DEFAULT_CHANGES_LIMIT, type=int), 1), MAX_CHANGES_LIMIT)
+    result = get_changes(_db_name(), since=since, limit=limit)
+    if result is None:
+        abort(503, description="The change log is unavailable.")
+    return {
+        "changes": [change_json(change) for change in result.changes],
+        "cursor": str(result.cursor),
+        "has_more": result.has_more,
+    }
+
+
+def _sync_change(position, item):
+    """
+    Convert one change of a POST /api/sync body to the tuple of `sync_expenses`.
+    """
+    if not isinstance(item, dict):
+        abort(400, description=f"Change {position}: expected a JSON object.")
+    expense_id, base, expense = item.get("id"), item.get("base"), item.get("expense")
+    if expense_id is None:
+        if expense is None:
+            abort(400, description=f"Change {position}: an expense is required to create one.")
+        return None, None, expense
+    try:
+        expense_id, base = int(expense_id), int(base)
+    except (TypeError, ValueError):
+        abort(400, description=f"Change {position}: an integer `id` and the `base` cursor are required.")
+    if item.get("deleted"):
+        return expense_id, base, None
+    if expense is None:
+        abort(400, description=f"Change {position}: expected an expense or `deleted`.")
+    return expense_id, base, expense
+
+
+@api.route("/sync", methods=["POST"])
+def sync():
+    """
+    Apply a batch of changes made offline, all in one transaction.
+
+    The body is {"changes": [...]}, each change one of
+    {"expense": {...}} to create, {"id", "base", "expense": {...}} to
+    replace and {"id", "base", "deleted": true} to delete an expense;
+    `base` is the `seq` the client last saw for it. A change to an
+    expense modified since is a conflict: it is skipped and the result
+    carries the server's version (null if deleted). Results come in the
+    order of the changes. Applied changes show up in GET /api/changes
+    like any other, under the `seq` reported here.
+    """
+    items = _json_body().get("changes")
+    if not isinstance(items, list):
+        abort(400, description="Expected a list of changes.")
+    if len(items) > MAX_SYNC_CHANGES:
+        abort(413, description=f"At most {MAX_SYNC_CHANGES} changes per batch.")
+    changes = [_sync_change(position, item) for position, item in enumerate(items)]
+
+    response = []
+    for result in sync_expenses(changes, _db_name()):
+        entry = {"status": result.status, "id": result.id}
+        if result.seq is not None:
+            entry["seq"] = result.seq
+        if result.status == "conflict":
+            entry["expense"] = expense_json(result.expense) if result.expense is not None else None
+        if result.error is not None:
+            entry["error"] = result.error
+        response.append(entry)
+    return jsonify({"results": response})
+
+
+@api.route("/analytics")
+@conditional(read=_db_name)
+def analytics():
+    """
+    Spending trends for charts: category, monthly and daily totals with
+    rolling averages, amount percentiles and the month-end projection.
+
+    Optional `start` and `end` query parameters (ISO dates) select the
+    range; it defaults to the year up to today.
+    """
+    try:
+        start = date.fromisoformat(request.args["start"]) if request.args.get("start") else None
+        end = date.fromisoformat(request.args["end"]) if request.args.get("end") else None
+        return spending_trends(_db_name(), start_date=start, end_date=end)
+    except ValueError:
+        abort(400)
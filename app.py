@@ -1,75 +1,342 @@
-from flask import Flask, render_template, request, redirect, url_for
-from db_storage import initialize_db, write_expense, read_expenses, process_recurring_expenses, get_recent_and_future_expenses, get_weekly_expenses_amount, get_monthly_expenses_amount, delete_expense
+from flask import Flask, Response, render_template, stream_template, request, redirect, url_for, abort, jsonify
+from db_storage import initialize_db, insert_expense, write_expenses, iter_expenses, iter_expenses_by_page, process_recurring_expenses, get_dashboard_summary, search_expenses, delete_expense, make_cursor
+from expense import format_cents
+from expense_io import parse_csv, parse_ndjson, to_csv, to_ndjson
+from http_utils import parse_expense_filters, negotiate_encoding, chunked, compressed, request_db_name
+from scheduler import RecurringScheduler, RECURRING_INTERVAL_SECONDS
+from api import api
+from write_queue import WriteQueue, MAX_DELAY_SECONDS
+from shards import ShardRouter
+import db_snapshot
+from db_snapshot import SnapshotManager, SNAPSHOT_MAX_STALENESS_SECONDS, SNAPSHOT_MIN_REFRESH_SECONDS
+import metrics
 from datetime import date
+import concurrent.futures
+import io
+import os
+import sqlite3
 # Initialize Flask app
 app = Flask(__name__)
 
 # Database setup
-DB_NAME = "expenses.db"
+DB_NAME = os.environ.get("EXPENSES_DB", "expenses.db")
+app.config["DB_NAME"] = DB_NAME
+app.register_blueprint(api)
+
+# One database per user (set EXPENSES_SHARD_DIR to enable); requests name their
+# user in the X-User-Id header. DB_NAME then only holds the scheduler bookkeeping.
+shard_router = None
+if os.environ.get("EXPENSES_SHARD_DIR"):
+    shard_router = ShardRouter(os.environ["EXPENSES_SHARD_DIR"])
+app.config["SHARD_ROUTER"] = shard_router
+
+# Request timing; worker processes share their metrics through this directory
+metrics.init_app(app, os.environ.get("EXPENSES_METRICS_DIR", f"{DB_NAME}.metrics"))
+
+# Number of rejected rows reported back by /import
+MAX_IMPORT_ERRORS = 100
+
+# Exports are read from the database and sent to the client in chunks of this size
+EXPORT_PAGE_SIZE = 1000
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+# Page size of the expenses list
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
 initialize_db(DB_NAME)  # Initialize the database
 
+# Materialise recurring expenses in the background (set EXPENSES_SCHEDULER=0 to disable)
+scheduler = None
+if os.environ.get("EXPENSES_SCHEDULER", "1") != "0":
+    scheduler = RecurringScheduler(
+        DB_NAME,
+        interval=float(os.environ.get("EXPENSES_RECURRING_INTERVAL", RECURRING_INTERVAL_SECONDS)),
+        databases=shard_router.db_names if shard_router is not None else None,
+    ).start()
+
+# Group commit for /add_expense and POST /api/expenses (set EXPENSES_WRITE_QUEUE=1 to enable)
+write_queue = None
+if os.environ.get("EXPENSES_WRITE_QUEUE", "0") == "1":
+    write_queue = WriteQueue(
+        DB_NAME,
+        max_delay=float(os.environ.get("EXPENSES_WRITE_QUEUE_DELAY_MS", MAX_DELAY_SECONDS * 1000)) / 1000,
+    )
+app.config["WRITE_QUEUE"] = write_queue
+
+# Serve the dashboard and expense lists from in-memory copies (set EXPENSES_SNAPSHOTS=1 to enable)
+snapshots = None
+if os.environ.get("EXPENSES_SNAPSHOTS", "0") == "1":
+    snapshots = SnapshotManager(
+        max_staleness=float(os.environ.get("EXPENSES_SNAPSHOT_STALENESS_MS",
+                                           SNAPSHOT_MAX_STALENESS_SECONDS * 1000)) / 1000,
+        min_refresh_interval=float(os.environ.get("EXPENSES_SNAPSHOT_REFRESH_MS",
+                                                  SNAPSHOT_MIN_REFRESH_SECONDS * 1000)) / 1000,
+    )
+db_snapshot.init_app(app, snapshots)
+
+
+def _db_name():
+    return request_db_name(request, app.config)
+
+
+def _read_db_name():
+    return db_snapshot.read_db_name(_db_name())
+
+
+@app.template_filter("money")
+def money(cents):
+    """
+    Render integer cents as a decimal amount, e.g. 1250 -> 12.50.
+    """
+    return format_cents(cents or 0)
+
+
 @app.route('/')
 def dashboard():
-    today = date.today()
-    recent_and_future_expenses = get_recent_and_future_expenses()
-    daily_expenses = sum(float(exp['amount']) for exp in recent_and_future_expenses if exp['date_added'] == str(today))
-    weekly_total = get_weekly_expenses_amount()
-    monthly_total = get_monthly_expenses_amount()
+    summary = get_dashboard_summary(_read_db_name(), date.today())
 
     return render_template(
         'index.html',
-        today=today,
-        daily_expenses=daily_expenses,
-        recent_and_future_expenses=recent_and_future_expenses,
-        weekly_total=weekly_total,
-        monthly_expenses=monthly_total,
+        today=summary.today,
+        summary=summary,
     )
 
 
+class ExpensePage:
+    """
+    One page of expenses, consumed lazily while the template renders.
+
+    Iterating yields at most `limit` expenses and records the first and last
+    of them, so the pagination links can be rendered after the table without
+    holding the page in memory.
+    """
+
+    def __init__(self, expenses, limit, sort, link_args, has_prev=False, has_next=False):
+        self._expenses = expenses
+        self.limit = limit
+        self.sort = sort
+        self.link_args = link_args
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.first = self.last = None
+
+    def __iter__(self):
+        for count, expense in enumerate(self._expenses):
+            if count == self.limit:
+                # The extra row only tells us another page exists
+                self.has_next = True
+                break
+            if self.first is None:
+                self.first = expense
+            self.last = expense
+            yield expense
+
+    @property
+    def next_url(self):
+        if self.last is None or not self.has_next:
+            return None
+        return url_for("view_expenses", **self.link_args, after=make_cursor(self.last, self.sort))
+
+    @property
+    def prev_url(self):
+        if self.first is None or not self.has_prev:
+            return None
+        return url_for("view_expenses", **self.link_args, before=make_cursor(self.first, self.sort))
+
+
 @app.route("/view-expenses")
 def view_expenses():
     """
-    Render the View Expenses page with all expenses.
+    Render the View Expenses page, one keyset-paginated page at a time.
+
+    Supports the filters of `parse_expense_filters` plus `after`/`before`
+    cursors and `limit`. The page is streamed: rows are rendered as they
+    are read from the database.
+    """
+    try:
+        filters = parse_expense_filters(request.args)
+        limit = min(max(request.args.get("limit", DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+        after = request.args.get("after") or None
+        before = request.args.get("before") or None
+
+        # Fetch one extra row to learn whether another page exists
+        expenses = iter_expenses(_read_db_name(), after=after, before=before, limit=limit + 1, **filters)
+    except ValueError:
+        abort(400)
+
+    if before:
+        # A backwards page is already materialised, with the extra row first
+        expenses = list(expenses)
+        has_prev, has_next = len(expenses) > limit, True
+        expenses = expenses[-limit:]
+    else:
+        has_prev, has_next = after is not None, False
+
+    # Links keep the current filters and page size
+    link_args = {key: value for key, value in request.args.items() if key not in ("after", "before")}
+    page = ExpensePage(expenses, limit, filters["sort"], link_args, has_prev=has_prev, has_next=has_next)
+    return stream_template("view_expenses.html", expenses=page, filters=request.args)
+
+
+@app.route("/search")
+def search():
+    """
+    Render full-text search results, best match first.
+
+    Takes the search text as `q`, the list filters (except sort), `limit`
+    and an `after` cursor.
+    """
+    try:
+        filters = parse_expense_filters(request.args)
+        limit = min(max(request.args.get("limit", DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+        del filters["sort"]
+        results = search_expenses(filters.pop("search", ""), _db_name(), limit=limit,
+                                  after=request.args.get("after") or None, **filters)
+    except ValueError:
+        abort(400)
+
+    next_url = None
+    if results.next:
+        link_args = {key: value for key, value in request.args.items() if key != "after"}
+        next_url = url_for("search", **link_args, after=results.next)
+    return render_template("search.html", expenses=results.expenses, next_url=next_url,
+                           query=request.args.get("q", ""))
+
+
+def _export(serialize, mimetype, extension):
+    """
+    Stream every expense matching the request's filters through `serialize`.
+
+    The response is gzip- or deflate-compressed when the client accepts it.
+    """
+    try:
+        filters = parse_expense_filters(request.args)
+    except ValueError:
+        abort(400)
+
+    body = chunked(serialize(iter_expenses_by_page(_db_name(), page_size=EXPORT_PAGE_SIZE, **filters)),
+                   EXPORT_CHUNK_BYTES)
+    headers = {
+        "Content-Disposition": f"attachment; filename=expenses.{extension}",
+        "Vary": "Accept-Encoding",
+    }
+    encoding = negotiate_encoding(request)
+    if encoding is not None:
+        body = compressed(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return Response(body, mimetype=mimetype, headers=headers)
+
+
+@app.route("/export.csv")
+def export_csv():
+    """
+    Export the expenses matching the list filters as CSV.
+    """
+    return _export(to_csv, "text/csv", "csv")
+
+
+@app.route("/export.ndjson")
+def export_ndjson():
+    """
+    Export the expenses matching the list filters as newline-delimited JSON.
     """
-    expenses = read_expenses(DB_NAME)
-    return render_template("view_expenses.html", expenses=expenses)
+    return _export(to_ndjson, "application/x-ndjson", "ndjson")
+
 
 @app.route("/add_expense", methods=["POST"])
 def add_expense():
     """
     Handle adding a new expense.
-    """
-    name = request.form.get("name")
-    category = request.form.get("category")
-    amount = request.form.get("amount")
-    recurring = int(request.form.get("recurring", 0))
-    recurring_schedule = request.form.get("recurring_schedule", None)
 
+    An invalid form is answered with 400. With the write queue, the request
+    waits for the group commit; if that takes too long, it is answered with
+    503, though the expense may still be added.
+    """
     # Create an expense object
     expense = {
-        "name": name,
-        "category": category,
-        "amount": amount,
+        "name": request.form.get("name"),
+        "category": request.form.get("category"),
+        "amount": request.form.get("amount"),
         "date_added": request.form.get("date_added", None),  # Default to today
-        "recurring": recurring,
-        "recurring_schedule": recurring_schedule,
+        "recurring": request.form.get("recurring", 0),
+        "recurring_schedule": request.form.get("recurring_schedule", None),
     }
 
-    # Save to the database
-    write_expense(expense, DB_NAME)
+    # Save to the database; with the write queue, wait for the group commit
+    try:
+        if write_queue is None:
+            insert_expense(expense, _db_name())
+        else:
+            write_queue.write(expense, _db_name())
+    except ValueError as e:
+        abort(400, description=str(e))
+    except concurrent.futures.TimeoutError:
+        app.logger.warning("Expense %r was not committed in time", expense["name"])
+        abort(503, description="The expense was not saved in time; check the list before adding it again.")
+    except sqlite3.Error as e:
+        app.logger.error("Error adding expense %r: %s", expense["name"], e)
+        abort(500)
 
     # Redirect to the dashboard
     return redirect(url_for("dashboard"))
 
 
 
+@app.route("/import", methods=["POST"])
+def import_expenses():
+    """
+    Bulk import expenses from a CSV or NDJSON upload.
+
+    The file is either a multipart upload in the `file` field or the raw
+    request body. NDJSON is detected from a `.ndjson`/`.jsonl` file name or
+    an NDJSON content type; anything else is read as CSV with a header row.
+    Rows without a date are dated today.
+
+    Returns:
+        JSON with the number of inserted rows and the rejected rows; with
+        status 400 if the file is not UTF-8, after importing the rows before
+        the first undecodable one.
+    """
+    upload = request.files.get("file")
+    if upload is not None:
+        stream, filename, content_type = upload.stream, upload.filename or "", upload.mimetype
+    else:
+        stream, filename, content_type = request.stream, "", request.mimetype
+
+    is_ndjson = (filename.lower().endswith((".ndjson", ".jsonl"))
+                 or content_type in ("application/x-ndjson", "application/jsonl"))
+    lines = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    parse = parse_ndjson if is_ndjson else parse_csv
+    undecodable = []
+
+    def expenses():
+        # Stop at text that is not UTF-8; the rows before it are still imported
+        position = 0
+        try:
+            for position, expense in enumerate(parse(lines, date.today().isoformat()), start=1):
+                yield expense
+        except UnicodeDecodeError as e:
+            undecodable.append((position + 1, f"The file is not UTF-8 text ({e.reason}); "
+                                              "it was imported up to the row before."))
+
+    inserted, errors = write_expenses(expenses(), _db_name())
+    response = jsonify({
+        "inserted": inserted,
+        "error_count": len(errors) + len(undecodable),
+        "errors": [{"row": row, "error": error} for row, error in (errors + undecodable)[:MAX_IMPORT_ERRORS]],
+    })
+    if undecodable:
+        response.status_code = 400
+    return response
+
+
 @app.route("/delete_expense/<int:expense_id>", methods=["POST"])
 def delete_expense_route(expense_id):
     """
     Route to handle deleting an expense by its ID.
     """
     try:
-        delete_expense(expense_id)  # Call the function from db_storage.py
+        delete_expense(expense_id, _db_name())  # Call the function from db_storage.py
     except Exception as e:
         print(f"Error deleting expense: {e}")
 
@@ -82,10 +349,34 @@ def delete_expense_route(expense_id):
 def process_recurring():
     """
     Endpoint to process recurring expenses.
+
+    Hands the work to the background scheduler instead of running it in the
+    request; it only runs inline when the scheduler is disabled.
     """
-    process_recurring_expenses(DB_NAME)
+    if scheduler is not None:
+        scheduler.run_now()
+    else:
+        process_recurring_expenses(_db_name())
     return redirect(url_for("dashboard"))
 
+
+@app.route("/scheduler-status")
+def scheduler_status():
+    """
+    Report the recurring-expense scheduler's state and its last run.
+    """
+    if scheduler is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **scheduler.status()})
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """
+    Storage, SQL and request metrics of all worker processes, in the Prometheus text format.
+    """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     app.run(debug=True)
 
@@ -0,0 +1,674 @@
+"""
+Columnar cold storage for old years of expenses.
+
+`archive_expenses` moves the expenses dated before a cutoff year out of
+the SQLite table into one file per year, so the hot database, and every
+backup, VACUUM and unindexed scan of it, only carries recent history.
+
+A partition file stores each column as a zlib-compressed `array`, with
+names, categories and schedules dictionary-encoded. Files are immutable:
+archiving more of a year writes a new file. The `archive_partitions`
+table names the current file of each year along with its id, date and
+amount bounds, and is updated in the transaction that deletes the
+archived rows, so readers see every expense exactly once.
+
+`iter_expenses` (and so `read_expenses` and the exports) merges the
+partitions whose dates overlap the requested range into its results in
+sort order, loading a partition only when the merge reaches it. The
+`daily_totals` rollup keeps covering archived expenses, so the dashboard
+totals and analytics only read partitions for the amount percentiles.
+The keys of archived recurring charges stay in `archived_occurrences`,
+so `process_recurring_expenses` never charges them again.
+
+Archived expenses are read-only: `get_expense` and `/api/changes` still
+return them, but changing or deleting one raises `ArchivedExpenseError`
+(409 Conflict in the API). `search_expenses` does not rank them; the
+`search` filter of `iter_expenses` does match them.
+
+Run `python archive.py --before 2024` to archive everything before 2024.
+"""
+
+import argparse
+import datetime
+import functools
+import heapq
+import itertools
+import json
+import os
+import re
+import sqlite3
+import struct
+import sys
+import time
+import unicodedata
+import uuid
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from typing import NamedTuple
+
+from db_cache import query_cache
+from db_connection import get_connection
+from expense import Expense
+from metrics import timed
+
+
+# Decoded partitions kept in memory per process
+PARTITION_CACHE_SIZE = 16
+
+# Replaced partition files are deleted by a later run once they are this old,
+# so requests that looked up the old file just before the switch can finish
+ORPHAN_GRACE_SECONDS = 3600
+
+_MAGIC = b"EXPCOL1\n"
+_HEADER_SIZE = struct.Struct("<I")
+
+# Column -> array typecode, in file order
+_COLUMNS = {
+    "id": "q",
+    "day": "i",  # date_added as a proleptic Gregorian ordinal
+    "amount_cents": "q",
+    "name": "i",  # Index into the names
+    "category": "i",  # Index into the categories
+    "recurring": "b",
+    "recurring_schedule": "b",  # Index into the schedules, -1 for none
+    "template_id": "q",  # 0 for none
+}
+
+# Recurring templates stay in the database, where the scheduler needs them
+_ARCHIVABLE = "recurring = 0 AND date_added IS NOT NULL AND amount_cents IS NOT NULL"
+
+_SELECT_ROWS = """
+    SELECT id, name, category, amount_cents, date_added, recurring, recurring_schedule, template_id
+    FROM expenses
+"""
+
+_ADD_TO_DAILY_TOTALS = """
+    INSERT INTO daily_totals (date, category, total_cents, count) VALUES (?, ?, ?, ?)
+    ON CONFLICT (date, category) DO UPDATE
+    SET total_cents = total_cents + excluded.total_cents, count = count + excluded.count
+"""
+
+_INF = float("inf")
+
+
+class ArchiveError(Exception):
+    """
+    A partition file is missing or unreadable.
+    """
+
+
+class ArchivedExpenseError(Exception):
+    """
+    An archived expense was to be changed or deleted; archived expenses are read-only.
+    """
+
+
+def archive_directory(db_name):
+    """
+    Return the default directory for the partition files of `db_name`.
+    """
+    return f"{os.path.abspath(db_name)}.archive"
+
+
+def _dictionary_encode(values):
+    """
+    Return the distinct `values` in order of appearance and each value's index.
+    """
+    index = {}
+    codes = [index.setdefault(value, len(index)) for value in values]
+    return list(index), codes
+
+
+def write_partition(directory, year, rows):
+    """
+    Write `rows` to a new partition file of `year`.
+
+    Args:
+        directory (str): Where to write the file.
+        year (int): The year the expenses are dated in.
+        rows (list[tuple]): (id, name, category, amount_cents, date_added,
+            recurring, recurring_schedule, template_id) rows, sorted by id.
+
+    Returns:
+        str: The absolute path of the file, synced to disk.
+    """
+    ids, names, categories, amounts, dates, recurring, schedules, templates = zip(*rows)
+    names, name_codes = _dictionary_encode(names)
+    categories, category_codes = _dictionary_encode(categories)
+    schedule_names = sorted({schedule for schedule in schedules if schedule is not None})
+    columns = {
+        "id": ids,
+        "day": [datetime.date.fromisoformat(day).toordinal() for day in dates],
+        "amount_cents": amounts,
+        "name": name_codes,
+        "category": category_codes,
+        "recurring": recurring,
+        "recurring_schedule": [-1 if schedule is None else schedule_names.index(schedule) for schedule in schedules],
+        "template_id": [template_id or 0 for template_id in templates],
+    }
+    dictionaries = {"name": names, "category": categories, "recurring_schedule": schedule_names}
+    blocks = [zlib.compress(json.dumps(dictionaries).encode("utf-8"))]
+    blocks += [zlib.compress(array(typecode, columns[column]).tobytes()) for column, typecode in _COLUMNS.items()]
+    header = json.dumps({
+        "year": year,
+        "rows": len(ids),
+        "byteorder": sys.byteorder,
+        "blocks": [len(block) for block in blocks],
+    }).encode("utf-8")
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(os.path.abspath(directory), f"{year}-{uuid.uuid4().hex[:12]}.expcol")
+    partial = f"{path}.tmp"
+    with open(partial, "wb") as file:
+        file.write(_MAGIC + _HEADER_SIZE.pack(len(header)) + header)
+        for block in blocks:
+            file.write(block)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(partial, path)
+    return path
+
+
+class Partition:
+    """
+    The decoded columns of a partition file.
+
+    Column values are in id order; `order` gives the rows sorted by
+    another column.
+    """
+
+    def __init__(self, path):
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+            if not data.startswith(_MAGIC):
+                raise ValueError("not a partition file")
+            offset = len(_MAGIC) + _HEADER_SIZE.size
+            (size,) = _HEADER_SIZE.unpack_from(data, len(_MAGIC))
+            header = json.loads(data[offset:offset + size])
+            offset += size
+            blocks = []
+            for length in header["blocks"]:
+                blocks.append(zlib.decompress(data[offset:offset + length]))
+                offset += length
+            dictionaries = json.loads(blocks[0])
+            self.columns = {}
+            for (column, typecode), block in zip(_COLUMNS.items(), blocks[1:]):
+                values = array(typecode)
+                values.frombytes(block)
+                if header["byteorder"] != sys.byteorder:
+                    values.byteswap()
+                self.columns[column] = values
+        except (OSError, ValueError, KeyError, struct.error, zlib.error) as e:
+            raise ArchiveError(f"Cannot read archive partition {path}: {e}")
+        self.path = path
+        self.year = header["year"]
+        self.rows = header["rows"]
+        self.names = dictionaries["name"]
+        self.categories = dictionaries["category"]
+        self.schedules = dictionaries["recurring_schedule"]
+        self._orders = {}
+
+    def expense(self, i):
+        """
+        Return row `i` as an Expense.
+        """
+        columns = self.columns
+        schedule = columns["recurring_schedule"][i]
+        return Expense(
+            self.names[columns["name"][i]],
+            self.categories[columns["category"][i]],
+            columns["amount_cents"][i],
+            datetime.date.fromordinal(columns["day"][i]),
+            columns["recurring"][i],
+            self.schedules[schedule] if schedule >= 0 else None,
+            columns["id"][i],
+            columns["template_id"][i] or None,
+        )
+
+    def row(self, i):
+        """
+        Return row `i` in the form taken by `write_partition`.
+        """
+        expense = self.expense(i)
+        return (expense.id, expense.name, expense.category, expense.amount_cents, expense.date_added.isoformat(),
+                expense.recurring, expense.recurring_schedule, expense.template_id)
+
+    def order(self, column):
+        """
+        Return the row indexes sorted by (`column`, id) and their sort keys.
+
+        Args:
+            column (str): 'id', 'date_added' or 'amount_cents'.
+        """
+        if column not in self._orders:
+            ids = self.columns["id"]
+            if column == "id":
+                indexes, keys = range(self.rows), [(expense_id,) for expense_id in ids]
+            else:
+                values = self.columns["day" if column == "date_added" else column]
+                keys = sorted(zip(values, ids, range(self.rows)))
+                indexes = [i for _, _, i in keys]
+                keys = [(value, expense_id) for value, expense_id, _ in keys]
+            self._orders[column] = indexes, keys
+        return self._orders[column]
+
+
+@functools.lru_cache(maxsize=PARTITION_CACHE_SIZE)
+def _load_partition(path):
+    # Files are never modified, so a path identifies its contents
+    return Partition(path)
+
+
+class ArchivedYear(NamedTuple):
+    """
+    A year's entry in `archive_partitions`; `load` reads its file.
+    """
+    year: int
+    path: str
+    rows: int
+    min_id: int
+    max_id: int
+    min_day: int  # Date ordinals
+    max_day: int
+    min_amount_cents: int
+    max_amount_cents: int
+
+    def load(self):
+        return _load_partition(self.path)
+
+    def bound(self, column, descending):
+        """
+        Return the sort key no row of the year sorts ahead of.
+        """
+        if column == "id":
+            return (self.max_id,) if descending else (self.min_id,)
+        low, high = ((self.min_day, self.max_day) if column == "date_added"
+                     else (self.min_amount_cents, self.max_amount_cents))
+        return (high, _INF) if descending else (low, -_INF)
+
+
+def _ordinal(day):
+    return datetime.date.fromisoformat(str(day)).toordinal()
+
+
+_SELECT_YEARS = """
+    SELECT year, path, rows, min_id, max_id, min_date, max_date, min_amount_cents, max_amount_cents
+    FROM archive_partitions
+"""
+
+
+def _archived_year(row):
+    year, path, count, min_id, max_id, min_date, max_date, min_amount, max_amount = row
+    return ArchivedYear(year, path, count, min_id, max_id, _ordinal(min_date), _ordinal(max_date), min_amount,
+                        max_amount)
+
+
+def archived_years(conn, start_date=None, end_date=None):
+    """
+    Return the archived years with expenses dated in [start_date, end_date).
+
+    Call it with the connection (and, for a consistent view, inside the
+    read transaction) that reads the hot expenses.
+
+    Args:
+        conn (sqlite3.Connection): A connection to the expenses database.
+        start_date (str | datetime.date): First day of interest (default: no limit).
+        end_date (str | datetime.date): Day after the last day of interest (default: no limit).
+
+    Returns:
+        list[ArchivedYear]: Oldest year first.
+    """
+    start, end = str(start_date or "0001-01-01"), str(end_date or "9999-12-31")
+    # The year range keeps this a primary key search on every listing
+    rows = conn.execute(_SELECT_YEARS + """
+        WHERE year >= ? AND year <= ? AND max_date >= ? AND min_date < ?
+        ORDER BY year
+    """, (int(start[:4]), int(end[:4]), start, end)).fetchall()
+    return [_archived_year(row) for row in rows]
+
+
+def find_expense(conn, expense_id):
+    """
+    Return the archived expense with `expense_id`, or None if it is not archived.
+
+    Only the years whose id range covers `expense_id` are searched.
+    """
+    rows = conn.execute(_SELECT_YEARS + " WHERE min_id <= ? AND max_id >= ?", (expense_id, expense_id)).fetchall()
+    for row in rows:
+        partition = _archived_year(row).load()
+        ids = partition.columns["id"]
+        i = bisect_left(ids, expense_id)
+        if i < len(ids) and ids[i] == expense_id:
+            return partition.expense(i)
+    return None
+
+
+def _fold(text):
+    """
+    Lower-case `text` and strip its accents, like the full-text index does.
+    """
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def _matcher(start_date=None, end_date=None, category=None, recurring=None, min_amount_cents=None,
+             max_amount_cents=None, search_words=None):
+    """
+    Build a test of partition rows for the listing filters of `iter_expenses`.
+    """
+    tests = []
+    if start_date is not None:
+        start = _ordinal(start_date)
+        tests.append(lambda partition, i: partition.columns["day"][i] >= start)
+    if end_date is not None:
+        end = _ordinal(end_date)
+        tests.append(lambda partition, i: partition.columns["day"][i] < end)
+    if category is not None:
+        tests.append(lambda partition, i: partition.categories[partition.columns["category"][i]] == category)
+    if recurring is not None:
+        tests.append(lambda partition, i: partition.columns["recurring"][i] == int(recurring))
+    if min_amount_cents is not None:
+        tests.append(lambda partition, i: partition.columns["amount_cents"][i] >= min_amount_cents)
+    if max_amount_cents is not None:
+        tests.append(lambda partition, i: partition.columns["amount_cents"][i] <= max_amount_cents)
+    if search_words:
+        words = [_fold(word) for word in search_words]
+
+        def search(partition, i):
+            text = (partition.names[partition.columns["name"][i]] + " "
+                    + partition.categories[partition.columns["category"][i]])
+            tokens = re.findall(r"[^\W_]+", _fold(text))
+            return all(any(token.startswith(word) for token in tokens) for word in words)
+        tests.append(search)
+    return lambda partition, i: all(test(partition, i) for test in tests)
+
+
+def sort_key(column):
+    """
+    Return the function computing the merge key of an Expense for a sort `column`.
+    """
+    if column == "id":
+        return lambda expense: (expense.id,)
+    if column == "date_added":
+        return lambda expense: (expense.date_added.toordinal() if expense.date_added else -_INF, expense.id)
+    return lambda expense: (-_INF if expense.amount_cents is None else expense.amount_cents, expense.id)
+
+
+def cursor_key(column, cursor):
+    """
+    Convert a cursor parsed by `iter_expenses` into a merge key.
+    """
+    if column == "date_added":
+        return _ordinal(cursor[0]), cursor[1]
+    return tuple(cursor)
+
+
+def _iter_year(partition, column, descending, after_key, match):
+    """
+    Yield (key, Expense) for the matching rows of a partition past `after_key`, in sort order.
+    """
+    indexes, keys = partition.order(column)
+    if descending:
+        stop = len(keys) if after_key is None else bisect_left(keys, after_key)
+        positions = range(stop - 1, -1, -1)
+    else:
+        start = 0 if after_key is None else bisect_right(keys, after_key)
+        positions = range(start, len(keys))
+    for position in positions:
+        i = indexes[position]
+        if match(partition, i):
+            yield keys[position], partition.expense(i)
+
+
+class _Descending:
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return self.key > other.key
+
+
+def merge(expenses, years, column, descending=False, after_key=None, **filters):
+    """
+    Merge archived expenses into a sorted stream of hot ones.
+
+    A year's partition waits in the merge under the best key it could
+    hold and is only loaded (and filtered) once that key comes up, so a
+    page of recent expenses reads no partition at all.
+
+    Args:
+        expenses (Iterable[Expense]): Hot expenses, already filtered and sorted.
+        years (list[ArchivedYear]): The archived years to merge in.
+        column (str): The sort column: 'id', 'date_added' or 'amount_cents'.
+        descending (bool): Whether the sort is descending.
+        after_key (tuple): Only archived expenses sorting after this key (see `cursor_key`).
+        **filters: The listing filters of `iter_expenses`, with `search`
+            split into `search_words`.
+
+    Yields:
+        Expense: Hot and archived expenses, in sort order.
+    """
+    wrap = _Descending if descending else tuple
+    key = sort_key(column)
+    match = _matcher(**filters)
+    heap, order = [], itertools.count()
+
+    def push(entries):
+        for entry_key, expense in entries:
+            heapq.heappush(heap, (wrap(entry_key), next(order), expense, entries))
+            return
+
+    push((key(expense), expense) for expense in expenses)
+    for year in years:
+        heapq.heappush(heap, (wrap(year.bound(column, descending)), next(order), None, year))
+    while heap:
+        _, _, expense, source = heapq.heappop(heap)
+        if expense is None:
+            push(_iter_year(source.load(), column, descending, after_key, match))
+            continue
+        yield expense
+        push(source)
+
+
+def amount_histogram(years, start, end):
+    """
+    Count the archived expenses dated in [start, end] per amount.
+
+    Returns:
+        collections.Counter: amount_cents -> number of expenses.
+    """
+    counts = Counter()
+    low, high = start.toordinal(), end.toordinal()
+    for year in years:
+        columns = year.load().columns
+        if low <= year.min_day and year.max_day <= high:
+            counts.update(columns["amount_cents"])
+        else:
+            counts.update(amount for amount, day in zip(columns["amount_cents"], columns["day"]) if low <= day <= high)
+    return counts
+
+
+def occurrence_keys(partition):
+    """
+    Return the (template_id, date_added) keys of the recurring charges in `partition`.
+    """
+    columns = partition.columns
+    return [(template_id, datetime.date.fromordinal(day).isoformat())
+            for template_id, day in zip(columns["template_id"], columns["day"]) if template_id]
+
+
+def add_daily_totals(conn, years):
+    """
+    Add the archived expenses of `years` to the `daily_totals` rollup, in the caller's transaction.
+    """
+    for year in years:
+        partition = year.load()
+        columns = partition.columns
+        totals = {}
+        for day, category, amount in zip(columns["day"], columns["category"], columns["amount_cents"]):
+            total, count = totals.get((day, category), (0, 0))
+            totals[day, category] = (total + amount, count + 1)
+        conn.executemany(_ADD_TO_DAILY_TOTALS, [
+            (datetime.date.fromordinal(day).isoformat(), partition.categories[category], total, count)
+            for (day, category), (total, count) in totals.items()
+        ])
+
+
+def _archive_year(conn, directory, year):
+    """
+    Move the archivable expenses of `year` into a new partition file, in one transaction.
+
+    Returns:
+        int: The number of expenses moved.
+    """
+    where = f"date_added >= ? AND date_added < ? AND {_ARCHIVABLE}"
+    bounds = (f"{year:04d}-01-01", f"{year + 1:04d}-01-01")
+    path = None
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(_SELECT_ROWS + f" WHERE {where} ORDER BY id", bounds).fetchall()
+            if not rows:
+                return 0
+            current = conn.execute("SELECT path FROM archive_partitions WHERE year = ?", (year,)).fetchone()
+            merged = rows
+            if current is not None:
+                partition = _load_partition(current[0])
+                merged = sorted([partition.row(i) for i in range(partition.rows)] + rows)
+            path = write_partition(directory, year, merged)
+
+            # The rollup and the change log keep covering archived expenses
+            rollup = conn.execute(f"""
+                SELECT date_added, category, SUM(amount_cents), COUNT(*)
+                FROM expenses WHERE {where}
+                GROUP BY date_added, category
+            """, bounds).fetchall()
+            changes = conn.execute(f"""
+                SELECT seq, expense_id FROM expense_changes
+                WHERE expense_id IN (SELECT id FROM expenses WHERE {where})
+            """, bounds).fetchall()
+            conn.execute(f"DELETE FROM expenses WHERE {where}", bounds)
+            # Replace the delete triggers' tombstones with the changes as they were, so
+            # synced clients see nothing new and a first sync still gets every expense
+            conn.executemany("DELETE FROM expense_changes WHERE expense_id = ?", [(row[0],) for row in rows])
+            conn.executemany("INSERT INTO expense_changes (seq, expense_id, deleted) VALUES (?, ?, 0)", changes)
+            conn.executemany(_ADD_TO_DAILY_TOTALS, rollup)
+            # Keeps `process_recurring_expenses` from charging archived occurrences again
+            conn.executemany("INSERT OR IGNORE INTO archived_occurrences VALUES (?, ?)",
+                             [(row[7], row[4]) for row in rows if row[7] is not None])
+            conn.execute("""
+                INSERT OR REPLACE INTO archive_partitions
+                    (year, path, rows, min_id, max_id, min_date, max_date, min_amount_cents, max_amount_cents)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (year, path, len(merged), merged[0][0], merged[-1][0], min(row[4] for row in merged),
+                  max(row[4] for row in merged), min(row[3] for row in merged), max(row[3] for row in merged)))
+    except BaseException:
+        if path is not None:
+            os.remove(path)  # Never referenced
+        raise
+    return len(rows)
+
+
+def _remove_orphans(conn, directory):
+    """
+    Delete partition files no longer referenced, once past the grace period.
+    """
+    if not os.path.isdir(directory):
+        return
+    current = {path for (path,) in conn.execute("SELECT path FROM archive_partitions")}
+    cutoff = time.time() - ORPHAN_GRACE_SECONDS
+    for entry in os.scandir(directory):
+        if entry.name.endswith((".expcol", ".expcol.tmp")) and entry.path not in current:
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+
+@timed
+def archive_expenses(db_name="expenses.db", before_year=None, directory=None):
+    """
+    Move the expenses dated before `before_year` into yearly partition files.
+
+    Each year is moved in its own transaction. Recurring templates stay
+    in the database. Running it again archives what was added to those
+    years since, and removes partition files replaced more than
+    `ORPHAN_GRACE_SECONDS` ago.
+
+    Args:
+        db_name (str): The database file name (default is 'expenses.db').
+        before_year (int): The first year to keep in the database (default
+            is the current year). Later years cannot be archived.
+        directory (str): Where to write the files (default is `archive_directory`).
+
+    Returns:
+        dict[int, int]: The number of expenses archived per year.
+
+    Raises:
+        ValueError: If `before_year` is in the future.
+        sqlite3.Error: If a year could not be archived; earlier years stay archived.
+    """
+    today = datetime.date.today()
+    before_year = before_year or today.year
+    if before_year > today.year:
+        raise ValueError("Only past years can be archived.")
+    directory = directory or archive_directory(db_name)
+    conn = get_connection(db_name)
+    years = [year for (year,) in conn.execute(f"""
+        SELECT DISTINCT CAST(substr(date_added, 1, 4) AS INTEGER)
+        FROM expenses
+        WHERE date_added < ? AND {_ARCHIVABLE}
+    """, (f"{before_year:04d}-01-01",))]
+    archived = {}
+    for year in sorted(years):
+        archived[year] = _archive_year(conn, directory, year)
+        query_cache.invalidate(db_name)
+    _remove_orphans(conn, directory)
+    return archived
+
+
+def main(argv=None):
+    from db_storage import initialize_db
+    from shards import ShardRouter
+
+    parser = argparse.ArgumentParser(description="Move old expenses into compressed yearly archive files.")
+    parser.add_argument("--before", type=int, required=True, help="Archive expenses dated before this year.")
+    parser.add_argument("--db", default=os.environ.get("EXPENSES_DB", "expenses.db"),
+                        help="The database to archive (default: $EXPENSES_DB or expenses.db).")
+    parser.add_argument("--shard-dir", default=os.environ.get("EXPENSES_SHARD_DIR"),
+                        help="Archive every user's database in this directory instead.")
+    parser.add_argument("--vacuum", action="store_true",
+                        help="VACUUM each database afterwards, returning the freed space to the file system.")
+    args = parser.parse_args(argv)
+
+    if args.before > datetime.date.today().year:
+        parser.error("only past years can be archived")
+
+    failed = 0
+    db_names = ShardRouter(args.shard_dir).db_names() if args.shard_dir else [args.db]
+    for db_name in db_names:
+        initialize_db(db_name)
+        try:
+            archived = archive_expenses(db_name, args.before)
+            if args.vacuum:
+                get_connection(db_name).execute("VACUUM")
+        except (sqlite3.Error, ArchiveError, OSError) as e:
+            # Keep going: the other databases are independent
+            print(f"Error archiving {db_name}: {e}")
+            failed += 1
+            continue
+        for year, count in sorted(archived.items()):
+            print(f"{db_name}: archived {count} expenses of {year}")
+    if failed:
+        print(f"{failed} of {len(db_names)} databases could not be archived.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""
+Awaitable versions of the `db_storage` functions.
+
+SQLite calls block, so they run on dedicated thread pools instead of the
+event loop: one writer thread, which serialises all writes on a single
+connection (SQLite allows one writer at a time anyway, so more writer
+threads would only queue on the database lock), and `READER_THREADS`
+reader threads, which read concurrently under WAL. Each pool thread keeps
+its own connection to every database it touches (see db_connection), so
+the facade opens at most `READER_THREADS` + 1 connections to a database,
+and at most `MAX_CONNECTIONS_PER_THREAD` per thread across databases,
+however many coroutines await it. Those come on top of the connections of
+any thread that calls `db_storage` directly.
+
+This is for async callers, such as an ASGI front end or scripts driving
+many databases from one event loop; `benchmarks/run.py` measures it
+against the same reads made from threads. The Flask app's views stay
+synchronous: under WSGI an async view runs a new event loop per request on
+a worker thread that is held anyway, which only adds overhead, and it
+cannot stream.
+
+Every function takes the same arguments as its `db_storage` counterpart.
+`make_cursor` and `prepare_expense` do no I/O and are the `db_storage`
+functions themselves. Generators are not offered as such, since a cursor
+must stay on the thread that opened it; use `read_expenses` or the
+`iter_expenses_by_page` async iterator instead of `iter_expenses`.
+"""
+
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import db_storage
+from db_connection import close_connections
+
+
+# Reader threads per process; overridable with the EXPENSES_DB_READERS environment variable
+READER_THREADS = int(os.environ.get("EXPENSES_DB_READERS", 4))
+
+_lock = threading.Lock()
+_pools = {}
+
+
+def _pool(role):
+    """
+    Return this process's 'reader' or 'writer' pool, creating it on first use.
+    """
+    with _lock:
+        pool = _pools.get(role)
+        if pool is None:
+            pool = _pools[role] = ThreadPoolExecutor(max_workers=_workers(role), thread_name_prefix=f"db-{role}")
+        return pool
+
+
+def _workers(role):
+    return 1 if role == "writer" else READER_THREADS
+
+
+def shutdown(wait=True):
+    """
+    Stop the storage threads. They are recreated if the facade is used again.
+
+    With `wait`, every thread first closes its connections, so none keeps a
+    database (or its WAL) open once this returns.
+    """
+    with _lock:
+        pools = list(_pools.items())
+        _pools.clear()
+    for role, pool in pools:
+        if wait:
+            # All threads must be busy at once for each of them to get one of the tasks
+            barrier = threading.Barrier(_workers(role), timeout=5)
+            for _ in range(barrier.parties):
+                pool.submit(lambda: (barrier.wait(), close_connections()))
+        pool.shutdown(wait=wait)
+
+
+def _reset_after_fork():
+    # Pool threads do not survive fork(); a forked worker starts its own pools
+    global _lock
+    _lock = threading.Lock()
+    _pools.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _run_on(role, func):
+    """
+    Wrap a blocking storage function into a coroutine function that runs it on a pool.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_pool(role), functools.partial(func, *args, **kwargs))
+
+    return wrapper
+
+
+# Reads
+read_expenses = _run_on("reader", db_storage.read_expenses)
+get_expense = _run_on("reader", db_storage.get_expense)
+get_data_version = _run_on("reader", db_storage.get_data_version)
+get_job_runs = _run_on("reader", db_storage.get_job_runs)
+get_recent_and_future_expenses = _run_on("reader", db_storage.get_recent_and_future_expenses)
+get_weekly_expenses_amount = _run_on("reader", db_storage.get_weekly_expenses_amount)
+get_monthly_expenses_amount = _run_on("reader", db_storage.get_monthly_expenses_amount)
+get_dashboard_summary = _run_on("reader", db_storage.get_dashboard_summary)
+search_expenses = _run_on("reader", db_storage.search_expenses)
+get_changes = _run_on("reader", db_storage.get_changes)
+
+# Writes
+initialize_db = _run_on("writer", db_storage.initialize_db)
+insert_expense = _run_on("writer", db_storage.insert_expense)
+write_expense = _run_on("writer", db_storage.write_expense)
+write_expenses = _run_on("writer", db_storage.write_expenses)
+insert_prepared_expenses = _run_on("writer", db_storage.insert_prepared_expenses)
+update_expense = _run_on("writer", db_storage.update_expense)
+delete_expense = _run_on("writer", db_storage.delete_expense)
+process_recurring_expenses = _run_on("writer", db_storage.process_recurring_expenses)
+record_job_run = _run_on("writer", db_storage.record_job_run)
+rebuild_daily_totals = _run_on("writer", db_storage.rebuild_daily_totals)
+sync_expenses = _run_on("writer", db_storage.sync_expenses)
+
+# No I/O
+make_cursor = db_storage.make_cursor
+prepare_expense = db_storage.prepare_expense
+
+
+async def iter_expenses_by_page(db_name="expenses.db", page_size=db_storage.READ_BATCH_SIZE, sort="id", **filters):
+    """
+    Asynchronously iterate over every matching expense, one keyset page at a time.
+
+    Each page is read by a reader thread; no cursor or snapshot is held
+    between pages.
+
+    Args:
+        db_name (str): The database file name (default is 'expenses.db').
+        page_size (int): Rows read per query.
+        sort (str): One of `EXPENSE_SORTS` (default is insertion order).
+        **filters: Filters accepted by `iter_expenses`.
+
+    Yields:
+        Expense: The matching expenses.
+    """
+    after = None
+    while True:
+        page = await read_expenses(db_name, sort=sort, after=after, limit=page_size,
+                                   batch_size=page_size, **filters)
+        for expense in page:
+            yield expense
+        if len(page) < page_size:
+            break
+        after = db_storage.make_cursor(page[-1], sort)
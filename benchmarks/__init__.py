@@ -0,0 +1,10 @@
+"""
+Benchmarks for the storage layer and the Flask routes.
+
+    python -m benchmarks.run --sizes 10000 100000 1000000 --output after.json
+    python -m benchmarks.compare before.json after.json
+
+`benchmarks.datagen` builds the synthetic databases, `benchmarks.run`
+times every case at every size and `benchmarks.compare` diffs two result
+files, e.g. from two commits.
+"""
@@ -0,0 +1,59 @@
+"""
+Compare two benchmark result files, e.g. from two commits.
+
+    python -m benchmarks.compare before.json after.json --threshold 10
+
+Cases are matched by size, group and name. Exits with status 1 when a
+case's p50 latency got worse by more than `--threshold` percent.
+"""
+
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path) as file:
+        document = json.load(file)
+    results = {(r["size"], r["group"], r["name"]): r for r in document["results"]}
+    return document["meta"], results
+
+
+def compare(before, after, threshold):
+    """
+    Return (key, before p50, after p50, change in percent, regressed) per common case.
+    """
+    rows = []
+    for key in sorted(before.keys() & after.keys()):
+        old, new = before[key]["p50_ms"], after[key]["p50_ms"]
+        change = (new - old) / old * 100 if old else 0.0
+        rows.append((key, old, new, change, change > threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="Percent slowdown of p50 reported as a regression (default: 10).")
+    args = parser.parse_args(argv)
+
+    before_meta, before = load(args.before)
+    after_meta, after = load(args.after)
+    print(f"before: {before_meta.get('commit')} ({before_meta.get('timestamp')})")
+    print(f"after:  {after_meta.get('commit')} ({after_meta.get('timestamp')})")
+
+    rows = compare(before, after, args.threshold)
+    for (size, group, name), old, new, change, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{size:>10,}  {group:<8} {name:<58} {old:>10.3f} -> {new:>10.3f} ms  {change:+7.1f}%{flag}")
+    for key in sorted(before.keys() ^ after.keys()):
+        print(f"{key[0]:>10,}  {key[1]:<8} {key[2]:<58} only in {'before' if key in before else 'after'}")
+
+    if any(regressed for *_, regressed in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Synthetic expense datasets.
+
+Expenses are spread evenly over the last `years` years. Categories follow
+a Zipf-like distribution (a few categories hold most expenses), amounts
+are log-normal around a per-category median, and a share of the rows are
+recurring templates dated within the last month, so processing recurring
+expenses has a realistic amount of catching up to do.
+"""
+
+import datetime
+import math
+import os
+import random
+
+from db_connection import close_connections
+from db_storage import initialize_db, write_expenses
+
+
+# (category, median amount in cents, expense names), most frequent first
+CATEGORIES = [
+    ("Food", 1200, ["Groceries", "Lunch", "Dinner", "Coffee", "Takeaway"]),
+    ("Transport", 450, ["Bus", "Train", "Taxi", "Fuel", "Parking"]),
+    ("Shopping", 3500, ["Clothes", "Electronics", "Books", "Gifts"]),
+    ("Entertainment", 2000, ["Cinema", "Concert", "Games", "Streaming"]),
+    ("Utilities", 8000, ["Electricity", "Water", "Internet", "Phone"]),
+    ("Health", 4000, ["Pharmacy", "Doctor", "Gym", "Dentist"]),
+    ("Housing", 90000, ["Rent", "Repairs", "Furniture"]),
+    ("Travel", 25000, ["Flights", "Hotel", "Car Rental"]),
+    ("Education", 15000, ["Course", "Tuition", "Supplies"]),
+    ("Insurance", 12000, ["Car Insurance", "Health Insurance"]),
+    ("Gifts", 5000, ["Birthday", "Wedding", "Charity"]),
+    ("Pets", 3000, ["Pet Food", "Vet"]),
+]
+
+RECURRING_SCHEDULES = [("monthly", 0.6), ("weekly", 0.3), ("daily", 0.1)]
+
+
+def generate_expenses(size, seed=0, years=3, skew=1.2, recurring_share=0.005, end_date=None):
+    """
+    Yield `size` synthetic expense dicts, reproducibly for a given seed.
+
+    Args:
+        size (int): Number of expenses.
+        seed (int): Random seed.
+        years (int): Length of the history in years.
+        skew (float): Zipf exponent of the category distribution; 0 spreads
+            expenses evenly over the categories.
+        recurring_share (float): Share of expenses that are recurring templates.
+        end_date (datetime.date): Last day of the history (default is today).
+    """
+    rng = random.Random(seed)
+    end_date = end_date or datetime.date.today()
+    days = years * 365
+    weights = [1 / (rank + 1) ** skew for rank in range(len(CATEGORIES))]
+    schedules, schedule_weights = zip(*RECURRING_SCHEDULES)
+
+    for _ in range(size):
+        category, median, names = rng.choices(CATEGORIES, weights)[0]
+        amount_cents = max(1, round(rng.lognormvariate(math.log(median), 0.6)))
+        expense = {
+            "name": rng.choice(names),
+            "category": category,
+            "amount": f"{amount_cents // 100}.{amount_cents % 100:02d}",
+        }
+        if rng.random() < recurring_share:
+            expense["recurring"] = 1
+            expense["recurring_schedule"] = rng.choices(schedules, schedule_weights)[0]
+            expense["date_added"] = (end_date - datetime.timedelta(days=rng.randrange(31))).isoformat()
+        else:
+            expense["date_added"] = (end_date - datetime.timedelta(days=rng.randrange(days))).isoformat()
+        yield expense
+
+
+def build_database(path, size, **options):
+    """
+    Create a database at `path` holding `size` synthetic expenses.
+
+    The database is built under a temporary name and renamed when complete,
+    so an interrupted build is never mistaken for a finished one.
+
+    Args:
+        path (str): Database file to create; it must not exist yet.
+        size (int): Number of expenses.
+        **options: Passed on to `generate_expenses`.
+
+    Returns:
+        str: `path`.
+    """
+    partial = f"{path}.partial"
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(partial + suffix):
+            os.remove(partial + suffix)
+    initialize_db(partial)
+    inserted, errors = write_expenses(generate_expenses(size, **options), partial)
+    close_connections(partial)  # Checkpoints and removes the WAL
+    if errors:
+        raise RuntimeError(f"Generating {path} failed: {errors[0][1]}")
+    os.replace(partial, path)
+    return path
+
+
+def dataset(directory, size, seed=0, **options):
+    """
+    Return the path of a synthetic database, building it on first use.
+
+    Datasets are cached in `directory` by size, seed and options, because
+    building the larger ones takes minutes.
+    """
+    os.makedirs(directory, exist_ok=True)
+    tag = "".join(f"-{key}{value}" for key, value in sorted(options.items()))
+    path = os.path.join(directory, f"expenses-{size}-seed{seed}{tag}.db")
+    if not os.path.exists(path):
+        build_database(path, size, seed=seed, **options)
+    return path
@@ -0,0 +1,406 @@
+"""
+Time the storage functions and the Flask routes on synthetic databases.
+
+Each case runs `--warmup` times untimed, then `--repeat` times timed, and
+once more for its peak memory: that of the Python heap, from tracemalloc,
+plus that of SQLite's own allocator, which tracemalloc does not see (page
+caches, sort buffers, in-memory snapshot copies), from SQLite's memory
+high-water mark. Cached queries are timed
+cold (the query cache is cleared before each call) unless the case name
+says otherwise. Write cases run on a copy of the dataset, so the cached
+datasets stay pristine.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import ctypes
+import datetime
+import functools
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Callable, NamedTuple, Optional
+
+from benchmarks.datagen import dataset, generate_expenses
+
+
+# Writer threads of the concurrent write cases
+CONCURRENT_WRITERS = 32
+
+# Simultaneous requests of the concurrent read cases
+CONCURRENT_READERS = 32
+
+
+class Case(NamedTuple):
+    group: str
+    name: str
+    func: Callable
+    setup: Optional[Callable] = None  # Untimed; returns the arguments of `func`
+    rows: Optional[int] = None  # Rows handled per call, for rows/s
+    repeat: Optional[int] = None  # Caps --repeat for slow cases
+
+
+def _percentile(sorted_values, p):
+    """
+    Nearest-rank percentile of an ascending list.
+    """
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[rank - 1]
+
+
+@functools.cache
+def _sqlite_memory():
+    """
+    Return SQLite's `sqlite3_memory_used` and `sqlite3_memory_highwater`, or
+    None where the library the sqlite3 module uses does not export them;
+    the module itself does not wrap them.
+    """
+    import _sqlite3
+
+    try:
+        library = ctypes.CDLL(_sqlite3.__file__)
+        used, highwater = library.sqlite3_memory_used, library.sqlite3_memory_highwater
+    except (OSError, AttributeError):
+        return None
+    used.argtypes, used.restype = [], ctypes.c_int64
+    highwater.argtypes, highwater.restype = [ctypes.c_int], ctypes.c_int64
+    return used, highwater
+
+
+def measure(case, repeat, warmup):
+    """
+    Time `case` and return its latency, throughput and peak memory.
+    """
+    def call():
+        args = case.setup() if case.setup else ()
+        start = time.perf_counter()
+        case.func(*args)
+        return time.perf_counter() - start
+
+    repeat = min(repeat, case.repeat or repeat)
+    for _ in range(warmup):
+        call()
+    timings = sorted(call() for _ in range(repeat))
+
+    args = case.setup() if case.setup else ()
+    sqlite_memory = _sqlite_memory()
+    if sqlite_memory:
+        used, highwater = sqlite_memory
+        sqlite_before = used()
+        highwater(1)  # Resets the mark to what is in use now
+    tracemalloc.start()
+    try:
+        case.func(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    sqlite_peak = max(0, highwater(0) - sqlite_before) if sqlite_memory else None
+
+    mean = sum(timings) / len(timings)
+    return {
+        "group": case.group,
+        "name": case.name,
+        "calls": len(timings),
+        "p50_ms": round(_percentile(timings, 50) * 1000, 3),
+        "p95_ms": round(_percentile(timings, 95) * 1000, 3),
+        "mean_ms": round(mean * 1000, 3),
+        "calls_per_sec": round(1 / mean, 1) if mean else None,
+        "rows_per_sec": round(case.rows / mean) if case.rows and mean else None,
+        "peak_kib": round((peak + (sqlite_peak or 0)) / 1024, 1),
+        "sqlite_peak_kib": round(sqlite_peak / 1024, 1) if sqlite_memory else None,
+    }
+
+
+def storage_cases(db_name, size, cleanup):
+    """
+    Return the benchmark cases for the `db_storage` and `analytics` functions.
+
+    The write queue and the snapshots the cases use are stopped by `cleanup`,
+    a `contextlib.ExitStack`, once the cases have run.
+    """
+    import async_db_storage
+    import db_storage
+    from analytics import spending_trends
+    from db_cache import query_cache
+    from db_snapshot import SnapshotManager
+    from write_queue import WriteQueue
+
+    today = datetime.date.today()
+    new_rows = list(generate_expenses(1000, seed=1))
+
+    def cold(*args):
+        query_cache.clear()
+        return args
+
+    def exhaust(iterator):
+        for _ in iterator:
+            pass
+
+    def new_expense_id():
+        return (db_storage.insert_expense(new_rows[0], db_name),)
+
+    def concurrently(write, threads=CONCURRENT_WRITERS, per_thread=20):
+        # Each writer thread adds `per_thread` expenses, one request at a time
+        def writer():
+            for expense in new_rows[:per_thread]:
+                write(expense)
+        workers = [threading.Thread(target=writer) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    def first_page():
+        return db_storage.read_expenses(db_name, sort="date_desc", limit=50)
+
+    def threads_reading():
+        workers = [threading.Thread(target=first_page) for _ in range(CONCURRENT_READERS)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    def coroutines_reading():
+        async def readers():
+            await asyncio.gather(*(async_db_storage.read_expenses(db_name, sort="date_desc", limit=50)
+                                   for _ in range(CONCURRENT_READERS)))
+        asyncio.run(readers())
+
+    def copy_snapshot():
+        snapshots = SnapshotManager()
+        snapshots.acquire(db_name)
+        snapshots.refresh()
+        snapshots.stop()
+
+    write_queue = WriteQueue(db_name)
+    cleanup.callback(write_queue.stop)
+    # Pinned, so it outlives the write cases and still holds the original rows
+    snapshots = SnapshotManager(max_staleness=3600)
+    cleanup.callback(snapshots.stop)
+    snapshots.acquire(db_name)
+    snapshots.refresh()
+    snapshot = snapshots.acquire(db_name)
+
+    return [
+        Case("storage", "read_expenses first page", lambda: db_storage.read_expenses(
+            db_name, sort="date_desc", limit=50)),
+        Case("storage", "read_expenses filtered by category and date, by amount", lambda: db_storage.read_expenses(
+            db_name, category="Transport", start_date=today - datetime.timedelta(days=90),
+            sort="amount_desc", limit=50)),
+        Case("storage", f"read_expenses first page {CONCURRENT_READERS} threads", threads_reading),
+        Case("storage", f"read_expenses first page {CONCURRENT_READERS} async_db_storage tasks",
+             coroutines_reading),
+        Case("storage", "iter_expenses full scan", lambda: exhaust(db_storage.iter_expenses(db_name)),
+             rows=size, repeat=3),
+        Case("storage", "iter_expenses_by_page full scan", lambda: exhaust(db_storage.iter_expenses_by_page(
+            db_name, page_size=1000)), rows=size, repeat=3),
+        Case("storage", "get_expense", lambda: db_storage.get_expense(size // 2, db_name)),
+        Case("storage", "get_dashboard_summary", lambda: db_storage.get_dashboard_summary(db_name, today),
+             setup=cold),
+        Case("storage", "get_dashboard_summary cached", lambda: db_storage.get_dashboard_summary(db_name, today)),
+        Case("storage", "get_dashboard_summary from snapshot", lambda: db_storage.get_dashboard_summary(
+            snapshot, today), setup=cold),
+        Case("storage", "read_expenses first page from snapshot", lambda: db_storage.read_expenses(
+            snapshot, sort="date_desc", limit=50)),
+        Case("storage", "snapshot copy", copy_snapshot, rows=size, repeat=5),
+        Case("storage", "get_recent_and_future_expenses", lambda: db_storage.get_recent_and_future_expenses(
+            db_name, today), setup=cold),
+        Case("storage", "get_weekly_expenses_amount", lambda: db_storage.get_weekly_expenses_amount(
+            db_name, today), setup=cold),
+        Case("storage", "get_monthly_expenses_amount", lambda: db_storage.get_monthly_expenses_amount(
+            db_name, today), setup=cold),
+        Case("storage", "spending_trends one year", lambda: spending_trends(db_name, today=today), setup=cold),
+        Case("storage", "spending_trends all history", lambda: spending_trends(
+            db_name, start_date=today - datetime.timedelta(days=10 * 365), today=today), setup=cold, repeat=5),
+        Case("storage", "search_expenses common word", lambda: db_storage.search_expenses("food", db_name)),
+        Case("storage", "search_expenses rare word prefix", lambda: db_storage.search_expenses("denti", db_name)),
+        Case("storage", "search_expenses with date filter", lambda: db_storage.search_expenses(
+            "lunch", db_name, start_date=today - datetime.timedelta(days=30))),
+        Case("storage", "get_data_version", lambda: db_storage.get_data_version(db_name)),
+        Case("storage", "write_expense", lambda: db_storage.write_expense(new_rows[0], db_name)),
+        Case("storage", "write_expenses 1000 rows", lambda: db_storage.write_expenses(new_rows, db_name),
+             rows=len(new_rows)),
+        Case("storage", f"insert_expense {CONCURRENT_WRITERS} concurrent writers", lambda: concurrently(
+            lambda expense: db_storage.insert_expense(expense, db_name)), rows=CONCURRENT_WRITERS * 20, repeat=5),
+        Case("storage", f"write queue {CONCURRENT_WRITERS} concurrent writers", lambda: concurrently(
+            write_queue.write), rows=CONCURRENT_WRITERS * 20, repeat=5),
+        Case("storage", "update_expense", lambda: db_storage.update_expense(size // 2, new_rows[1], db_name)),
+        Case("storage", "delete_expense", lambda expense_id: db_storage.delete_expense(expense_id, db_name),
+             setup=new_expense_id),
+        # The warmup call catches up; the timed calls measure the steady state
+        Case("storage", "process_recurring_expenses", lambda: db_storage.process_recurring_expenses(db_name)),
+    ]
+
+
+def route_cases(client, db_name):
+    """
+    Return the benchmark cases for the Flask routes, called through the test client.
+    """
+    import db_storage
+    from db_cache import query_cache
+
+    edit = next(generate_expenses(1, seed=2))
+
+    month_ago = (datetime.date.today() - datetime.timedelta(days=30)).isoformat()
+
+    def cold(*args):
+        query_cache.clear()
+        return args
+
+    def get(url, status=200, **kwargs):
+        def request(headers=None):
+            response = client.get(url, headers=headers, **kwargs)
+            response.get_data()  # Consume streamed bodies
+            if response.status_code != status:
+                raise RuntimeError(f"GET {url} returned {response.status_code}")
+        return request
+
+    def current_etag():
+        return ({"If-None-Match": client.get("/api/summary").headers["ETag"]},)
+
+    def ten_edits_later():
+        # A client that synced, then missed ten edits
+        with contextlib.closing(sqlite3.connect(db_name)) as conn:
+            since = conn.execute("SELECT MAX(seq) FROM expense_changes").fetchone()[0]
+        for expense_id in range(1, 11):
+            db_storage.update_expense(expense_id, edit, db_name)
+        return (since,)
+
+    def resync(since):
+        response = client.get(f"/api/changes?since={since}")
+        if len(response.get_json()["changes"]) != 10:
+            raise RuntimeError("GET /api/changes missed an edit")
+    return [
+        Case("routes", "GET /", get("/"), setup=cold),
+        Case("routes", "GET /view-expenses", get("/view-expenses")),
+        Case("routes", "GET /view-expenses filtered by amount", get(
+            "/view-expenses?category=Food&sort=amount_desc&limit=200")),
+        Case("routes", "GET /export.csv last 30 days", get(f"/export.csv?start={month_ago}"), repeat=5),
+        Case("routes", "GET /api/expenses", get("/api/expenses")),
+        Case("routes", "GET /api/search", get("/api/search?q=gro")),
+        Case("routes", "GET /api/summary", get("/api/summary"), setup=cold),
+        Case("routes", "GET /api/changes first page", get("/api/changes")),
+        Case("routes", "GET /api/changes after ten edits", resync, setup=ten_edits_later),
+        Case("routes", "GET /api/summary 304", get("/api/summary", status=304), setup=current_etag),
+        Case("routes", "GET /api/analytics", get("/api/analytics"), setup=lambda: (
+            cold() + ({"Accept-Encoding": "gzip"},))),
+    ]
+
+
+def _metadata(args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    return {
+        "commit": commit,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "numpy": numpy_version,
+        "platform": platform.platform(),
+        "options": vars(args),
+    }
+
+
+def _print_row(size, result):
+    rows = f"{result['rows_per_sec']:>12,} rows/s" if result["rows_per_sec"] else ""
+    print(f"{size:>10,}  {result['name']:<58} p50 {result['p50_ms']:>10.3f} ms  "
+          f"p95 {result['p95_ms']:>10.3f} ms  peak {result['peak_kib']:>10,.1f} KiB  {rows}")
+
+
+def run(args):
+    """
+    Run the selected benchmarks at every size and return the results document.
+    """
+    workdir = tempfile.mkdtemp(prefix="expense-bench-")
+    options = {"years": args.years, "skew": args.skew, "recurring_share": args.recurring_share}
+    results = []
+    try:
+        for size in args.sizes:
+            source = dataset(args.data_dir, size, seed=args.seed, **options)
+            db_name = os.path.join(workdir, f"expenses-{size}.db")
+            shutil.copyfile(source, db_name)
+
+            with contextlib.ExitStack() as cleanup:
+                cleanup.callback(_close)
+                cases = []
+                if "storage" in args.groups:
+                    cases += storage_cases(db_name, size, cleanup)
+                if "routes" in args.groups:
+                    cases += route_cases(_client(db_name), db_name)
+                for case in cases:
+                    if args.only and args.only not in case.name:
+                        continue
+                    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                        # The storage functions report every write on stdout
+                        result = {"size": size, **measure(case, args.repeat, args.warmup)}
+                    results.append(result)
+                    _print_row(size, result)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {"meta": _metadata(args), "results": results}
+
+
+def _client(db_name):
+    """
+    Return a test client of the app, pointed at `db_name`.
+    """
+    os.environ.setdefault("EXPENSES_DB", db_name)
+    os.environ["EXPENSES_SCHEDULER"] = "0"
+    import app as app_module
+
+    app_module.DB_NAME = app_module.app.config["DB_NAME"] = db_name
+    return app_module.app.test_client()
+
+
+def _close():
+    import async_db_storage
+    from db_connection import close_connections
+
+    async_db_storage.shutdown()
+    close_connections()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the expense tracker on synthetic data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000],
+                        help="Dataset sizes in rows (default: 10000 100000).")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed calls per case.")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed calls per case.")
+    parser.add_argument("--groups", nargs="+", choices=["storage", "routes"], default=["storage", "routes"])
+    parser.add_argument("--only", help="Only run cases whose name contains this text.")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "expense-benchmarks"),
+                        help="Where generated datasets are cached.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--years", type=int, default=3, help="Length of the generated history.")
+    parser.add_argument("--skew", type=float, default=1.2, help="Zipf exponent of the category mix.")
+    parser.add_argument("--recurring-share", type=float, default=0.005,
+                        help="Share of rows that are recurring templates.")
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    args = parser.parse_args(argv)
+
+    document = run(args)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(document, file, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+In-process cache for read-mostly storage queries.
+
+Cached results are tagged with a per-database generation number. The
+generation is bumped when this process writes (the storage functions call
+`invalidate`) and when SQLite reports that another connection - another
+thread or another gunicorn worker - committed a change (`PRAGMA
+data_version`). A data version only compares to earlier ones of the same
+connection, so a thread's first look through a new connection goes by the
+persistent change counter of the expenses table instead, and only bumps
+the generation if it moved since another connection last looked. A result
+is served only while its generation is current and its TTL has not
+expired, so readers never see data older than the last write they could
+have observed, and never older than the TTL.
+"""
+
+import datetime
+import functools
+import inspect
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from db_connection import get_connection
+
+
+CACHE_MAX_ENTRIES = 256
+CACHE_TTL_SECONDS = 30.0
+
+
+class QueryCache:
+    """
+    A bounded LRU of query results with TTL and data-version invalidation.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (generation, expires_at, value)
+        self._generations = {}  # db_name -> int
+        self._counters = {}  # db_name -> change counter when a new connection last looked
+        self._seen = threading.local()  # db_name -> (connection, data_version) per thread
+        self.hits = self.misses = self.invalidations = 0
+
+    def invalidate(self, db_name):
+        """
+        Mark every cached result for `db_name` as stale.
+        """
+        with self._lock:
+            self._generations[db_name] = self._generations.get(db_name, 0) + 1
+            self.invalidations += 1
+
+    def forget(self, db_name):
+        """
+        Drop the generation of a database that no longer exists, such as a replaced snapshot.
+
+        Its cached results are left to age out of the LRU.
+        """
+        with self._lock:
+            self._generations.pop(db_name, None)
+            self._counters.pop(db_name, None)
+
+    def peek_generation(self, db_name):
+        """
+        Return the generation of `db_name` as last bumped, without asking SQLite.
+        """
+        return self._generations.get(db_name, 0)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def generation(self, db_name):
+        """
+        Return the current generation of `db_name`, first checking whether
+        another connection committed since this thread last looked.
+        """
+        conn = get_connection(db_name)
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        seen = getattr(self._seen, "versions", None)
+        if seen is None or len(seen) > self.max_entries:
+            # Bounded for snapshots, which get a new name on every refresh
+            seen = self._seen.versions = {}
+        last = seen.get(db_name)
+        if last is None or last[0] is not conn:
+            # Seed the new connection's version; its first value says nothing on its own
+            seen[db_name] = (conn, data_version)
+            self._check_counter(db_name, conn)
+        elif last[1] != data_version:
+            seen[db_name] = (conn, data_version)
+            self.invalidate(db_name)
+        return self._generations.get(db_name, 0)
+
+    def _check_counter(self, db_name, conn):
+        """
+        Invalidate `db_name` unless its change counter is the one the last new connection saw.
+        """
+        try:
+            # Its only row, created with the table
+            counter = conn.execute("SELECT version FROM expenses_version WHERE rowid = 1").fetchone()[0]
+        except (sqlite3.Error, TypeError):
+            counter = None  # Not an expenses database, or not migrated yet
+        with self._lock:
+            if counter is not None and self._counters.get(db_name) == counter:
+                return
+            self._counters[db_name] = counter
+            self._generations[db_name] = self._generations.get(db_name, 0) + 1
+            self.invalidations += 1
+
+    def get_or_compute(self, db_name, key, compute):
+        """
+        Return the cached value for `key`, calling `compute()` on a miss.
+        """
+        try:
+            generation = self.generation(db_name)
+        except sqlite3.Error:
+            return compute()
+
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generation and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        value = compute()
+        with self._lock:
+            self._entries[key] = (generation, now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def stats(self):
+        """
+        Return the hit/miss counters and current size.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+            }
+
+
+query_cache = QueryCache()
+
+
+def cached(func):
+    """
+    Cache a storage function whose first parameter is `db_name`.
+
+    The key is made of the function and all its arguments after defaults
+    are applied. A `today=None` argument is resolved to the current date
+    first, so cached results never outlive the day they were computed for.
+    Callers must treat the returned values as read-only.
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        if "today" in bound.arguments and bound.arguments["today"] is None:
+            bound.arguments["today"] = datetime.date.today()
+        db_name = bound.arguments["db_name"]
+        key = (func.__qualname__,) + tuple(sorted(bound.arguments.items()))
+        return query_cache.get_or_compute(db_name, key, lambda: func(*bound.args, **bound.kwargs))
+
+    return wrapper
@@ -0,0 +1,192 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+
+from metrics import InstrumentedConnection, registry
+
+
+# Tuning applied to every connection handed out by `get_connection`.
+BUSY_TIMEOUT_MS = 5000
+CACHE_SIZE_KIB = 20000
+MMAP_SIZE_BYTES = 256 * 1024 * 1024
+
+# Statement timing for /metrics; set EXPENSES_METRICS=0 to use plain connections
+INSTRUMENT_STATEMENTS = os.environ.get("EXPENSES_METRICS", "1") != "0"
+
+# Open connections kept per thread; overridable with EXPENSES_DB_MAX_CONNECTIONS.
+# Only matters with per-user databases, where a thread may serve thousands of files.
+MAX_CONNECTIONS_PER_THREAD = int(os.environ.get("EXPENSES_DB_MAX_CONNECTIONS", 64))
+
+# Most recent names passed to `retire`. Their connections are closed at once;
+# a thread idle for longer only drops the closed ones through the LRU limit.
+RETIRED_NAMES_KEPT = 1024
+
+_local = threading.local()
+_retired = deque(maxlen=RETIRED_NAMES_KEPT)
+_retired_count = 0
+_retired_lock = threading.Lock()
+
+# Open connections to `file:` URIs (the in-memory snapshots), of every thread,
+# so that `retire` can close them without waiting for their threads
+_shared = {}  # name -> set of connections
+
+
+def _configure(conn):
+    """
+    Apply the pragmas used for all storage connections.
+
+    WAL lets readers keep going while another worker writes, and
+    `synchronous=NORMAL` is durable across application crashes in WAL mode
+    while skipping the fsync on every commit.
+    """
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB}")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE_BYTES}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA foreign_keys=ON")
+
+
+def _connections():
+    """
+    Return the connection registry of the calling thread.
+    """
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = OrderedDict()  # Least recently used first
+    return connections
+
+
+def _in_transaction(conn):
+    try:
+        return conn.in_transaction
+    except sqlite3.ProgrammingError:
+        return False  # Already closed by `retire`
+
+
+def _close(db_name, conn):
+    if db_name.startswith("file:"):
+        with _retired_lock:
+            shared = _shared.get(db_name)
+            if shared is not None:
+                shared.discard(conn)
+                if not shared:
+                    del _shared[db_name]
+    conn.close()
+
+
+def _evict(connections):
+    """
+    Close least recently used connections until there is room for one more.
+
+    A connection in the middle of a transaction is never closed.
+    """
+    for name in list(connections):
+        if len(connections) < MAX_CONNECTIONS_PER_THREAD:
+            break
+        conn = connections[name]
+        if _in_transaction(conn):
+            continue
+        del connections[name]
+        _close(name, conn)
+        registry.inc("sqlite_connections_evicted_total")
+
+
+def _close_retired(connections):
+    """
+    Drop the calling thread's connections to databases retired since it last looked.
+    """
+    with _retired_lock:
+        names, count = list(_retired), _retired_count
+    for name in names:
+        conn = connections.pop(name, None)
+        if conn is not None:
+            conn.close()  # Normally closed by `retire` already
+    _local.retired_seen = count
+
+
+def get_connection(db_name="expenses.db"):
+    """
+    Return the reusable connection for `db_name` owned by the calling thread.
+
+    Connections are created lazily, configured once and then kept open, so
+    a request pays no connect or pragma cost. Each thread keeps at most
+    `MAX_CONNECTIONS_PER_THREAD` open; opening another closes the least
+    recently used idle one.
+
+    Use the connection as a context manager (`with conn:`) to commit or roll
+    back a unit of work; do not close it.
+
+    Args:
+        db_name (str): The database file name (default is 'expenses.db'), or
+            a `file:` URI such as the in-memory snapshots of `db_snapshot`.
+
+    Returns:
+        sqlite3.Connection: The connection for this thread and database.
+    """
+    connections = _connections()
+    if getattr(_local, "retired_seen", 0) != _retired_count:
+        _close_retired(connections)
+    conn = connections.get(db_name)
+    if conn is not None:
+        connections.move_to_end(db_name)
+    else:
+        _evict(connections)
+        factory = InstrumentedConnection if INSTRUMENT_STATEMENTS else sqlite3.Connection
+        shared = db_name.startswith("file:")
+        # Only `retire` uses a connection from another thread, and only once it is idle
+        conn = sqlite3.connect(db_name, factory=factory, uri=shared, check_same_thread=not shared)
+        _configure(conn)
+        if shared:
+            with _retired_lock:
+                _shared.setdefault(db_name, set()).add(conn)
+        connections[db_name] = conn
+    return conn
+
+
+def close_connections(db_name=None):
+    """
+    Close the calling thread's connections.
+
+    Args:
+        db_name (str): Only close the connection to this database. Closes
+            every connection of the thread when omitted.
+    """
+    connections = _connections()
+    names = [db_name] if db_name is not None else list(connections)
+    for name in names:
+        conn = connections.pop(name, None)
+        if conn is not None:
+            _close(name, conn)
+
+
+def retire(db_name):
+    """
+    Close every thread's connection to the `file:` URI `db_name` now.
+
+    For databases that are gone or replaced, like an in-memory snapshot,
+    whose memory is only released once its last connection is closed. The
+    caller must make sure no thread is still using them; each thread drops
+    the closed connection from its registry on its next `get_connection`.
+    """
+    global _retired_count
+    with _retired_lock:
+        _retired.append(db_name)
+        _retired_count += 1
+        connections = _shared.pop(db_name, set())
+    for conn in connections:
+        conn.close()
+
+
+def _reset_after_fork():
+    # SQLite handles must not be used across fork(); a gunicorn worker forked
+    # from a master that already touched the database starts with a clean slate.
+    global _local, _shared
+    _local = threading.local()
+    _shared = {}
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,426 @@
+"""
+Versioned schema migrations for the expenses database.
+
+The schema version is stored in `PRAGMA user_version`. Each entry of
+`MIGRATIONS` upgrades the schema by one version; `migrate` applies the ones
+a database has not seen yet. Migrations must be safe to re-run, so that a
+migration interrupted half way (crash, deploy, Ctrl-C) simply continues
+where it left off the next time the application starts.
+"""
+
+import datetime
+
+import archive
+from expense import RECURRING_SCHEDULES, next_occurrence
+
+
+# Rows touched per transaction by data migrations. Keeps each write lock short
+# so the application can keep serving requests while a large table migrates.
+MIGRATION_BATCH_SIZE = 5000
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _add_column(conn, table, column, definition):
+    """
+    Add a column unless it already exists (e.g. from an interrupted run).
+    """
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        if column not in _columns(conn, table):
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def _backfill(conn, sql, batch_size, where="1"):
+    """
+    Run `sql` over the expenses table in id-ordered batches of `batch_size` rows.
+
+    `sql` receives the batch's id range as two parameters and is committed
+    batch by batch. Resuming starts from the first row still matching `where`.
+    """
+    last_id = conn.execute(
+        f"SELECT COALESCE(MIN(id), 1) - 1 FROM expenses WHERE {where}"
+    ).fetchone()[0]
+    while True:
+        upper = conn.execute("""
+            SELECT MAX(id) FROM (
+                SELECT id FROM expenses WHERE id > ? ORDER BY id LIMIT ?
+            )
+        """, (last_id, batch_size)).fetchone()[0]
+        if upper is None:
+            break
+        with conn:
+            conn.execute(sql, (last_id, upper))
+        last_id = upper
+
+
+def _migrate_amount_to_cents(conn, batch_size):
+    """
+    Version 1: store amounts as INTEGER cents in `amount_cents`.
+
+    The legacy TEXT `amount` column is kept (and still written) so older
+    application versions keep working during a rolling deploy.
+    """
+    _add_column(conn, "expenses", "amount_cents", "INTEGER")
+    _backfill(conn, """
+        UPDATE expenses
+        SET amount_cents = CAST(ROUND(CAST(amount AS REAL) * 100) AS INTEGER)
+        WHERE id > ? AND id <= ? AND amount_cents IS NULL
+    """, batch_size, where="amount_cents IS NULL")
+
+
+def _index_amount_cents(conn, batch_size):
+    """
+    Version 2: index `amount_cents` for amount-sorted and amount-filtered listings.
+    """
+    with conn:
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_expenses_amount_cents
+            ON expenses (amount_cents)
+        """)
+
+
+# Adds NEW's amount to its day and category, or takes OLD's away; shared by the
+# daily_totals triggers. Rows without a date are not rolled up.
+_ADD_TO_DAILY_TOTALS = """
+    INSERT INTO daily_totals (date, category, total_cents, count)
+    SELECT NEW.date_added, NEW.category, COALESCE(NEW.amount_cents, 0), 1
+    WHERE NEW.date_added IS NOT NULL
+    ON CONFLICT (date, category) DO UPDATE
+    SET total_cents = total_cents + excluded.total_cents, count = count + 1;
+"""
+_REMOVE_FROM_DAILY_TOTALS = """
+    UPDATE daily_totals
+    SET total_cents = total_cents - COALESCE(OLD.amount_cents, 0), count = count - 1
+    WHERE date = OLD.date_added AND category = OLD.category;
+    DELETE FROM daily_totals
+    WHERE date = OLD.date_added AND category = OLD.category AND count <= 0;
+"""
+
+
+def rebuild_daily_totals(conn):
+    """
+    Recompute `daily_totals` from the expenses table.
+
+    Runs in the caller's transaction; the write lock should already be held
+    so no expense changes between the delete and the re-aggregation.
+    """
+    conn.execute("DELETE FROM daily_totals")
+    conn.execute("""
+        INSERT INTO daily_totals (date, category, total_cents, count)
+        SELECT date_added, category, COALESCE(SUM(amount_cents), 0), COUNT(*)
+        FROM expenses
+        WHERE date_added IS NOT NULL
+        GROUP BY date_added, category
+    """)
+
+
+def _create_daily_totals(conn, batch_size):
+    """
+    Version 3: per day and category rollup of expenses, kept current by triggers.
+    """
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS daily_totals (
+                date TEXT NOT NULL,
+                category TEXT NOT NULL,
+                total_cents INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (date, category)
+            ) WITHOUT ROWID
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS expenses_daily_totals_insert
+            AFTER INSERT ON expenses
+            BEGIN {_ADD_TO_DAILY_TOTALS} END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS expenses_daily_totals_delete
+            AFTER DELETE ON expenses
+            BEGIN {_REMOVE_FROM_DAILY_TOTALS} END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS expenses_daily_totals_update
+            AFTER UPDATE OF date_added, category, amount_cents ON expenses
+            BEGIN {_REMOVE_FROM_DAILY_TOTALS} {_ADD_TO_DAILY_TOTALS} END
+        """)
+        rebuild_daily_totals(conn)
+
+
+def _add_recurring_next_due(conn, batch_size):
+    """
+    Version 4: recurring templates with an indexed `next_due` date.
+
+    Generated occurrences point back at their template through
+    `template_id`, and a unique index on (template_id, date_added) makes
+    generating the same occurrence twice impossible.
+
+    The previous engine stored generated copies with `recurring = 1` as
+    well, making them indistinguishable from templates. Rows sharing a
+    name, category, amount and schedule are folded into one template (the
+    oldest row); the others become its occurrences. Extra copies charged on
+    the same day are kept as plain one-off expenses.
+    """
+    _add_column(conn, "expenses", "next_due", "TEXT")
+    _add_column(conn, "expenses", "template_id", "INTEGER")
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_expenses_next_due
+            ON expenses (next_due) WHERE recurring = 1
+        """)
+
+        templates, occurrences = {}, set()
+        rows = conn.execute("""
+            SELECT id, name, category, amount_cents, recurring_schedule, date_added
+            FROM expenses
+            WHERE recurring = 1 AND template_id IS NULL
+            ORDER BY id
+        """).fetchall()
+        for expense_id, name, category, amount_cents, schedule, date_added in rows:
+            template = templates.setdefault((name, category, amount_cents, schedule), [expense_id, date_added])
+            if template[0] == expense_id:
+                continue
+            template_id = None if (template[0], date_added) in occurrences else template[0]
+            occurrences.add((template[0], date_added))
+            conn.execute("UPDATE expenses SET recurring = 0, template_id = ? WHERE id = ?",
+                         (template_id, expense_id))
+            template[1] = max(template[1] or "", date_added or "")
+
+        for (_, _, _, schedule), (template_id, last_charged) in templates.items():
+            if schedule not in RECURRING_SCHEDULES or not last_charged:
+                continue
+            last_charged = datetime.date.fromisoformat(last_charged)
+            conn.execute("UPDATE expenses SET next_due = ? WHERE id = ?",
+                         (next_occurrence(last_charged, schedule).isoformat(), template_id))
+
+        conn.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_expenses_occurrence
+            ON expenses (template_id, date_added) WHERE template_id IS NOT NULL
+        """)
+
+
+def _create_job_runs(conn, batch_size):
+    """
+    Version 5: last-run bookkeeping for background jobs, shared by all workers.
+    """
+    with conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS job_runs (
+                name TEXT PRIMARY KEY,
+                last_started_at TEXT,
+                last_finished_at TEXT,
+                last_duration_ms REAL,
+                last_result TEXT,
+                run_count INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+
+
+def _index_amount_cents_by_date(conn, batch_size):
+    """
+    Version 6: index amounts with their date for the analytics amount histogram.
+
+    Grouping by amount reads this index in order, and the date filter is
+    checked from the index entry, so the histogram never touches the table.
+    """
+    with conn:
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_expenses_amount_cents_date_added
+            ON expenses (amount_cents, date_added)
+        """)
+
+
+def _create_expenses_version(conn, batch_size):
+    """
+    Version 7: a persistent change counter for the expenses table.
+
+    Unlike `PRAGMA data_version`, which is local to a connection, the
+    counter is stored in the database, so every worker derives the same
+    HTTP ETags from it.
+    """
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("CREATE TABLE IF NOT EXISTS expenses_version (version INTEGER NOT NULL)")
+        conn.execute("""
+            INSERT INTO expenses_version (version)
+            SELECT 1 WHERE NOT EXISTS (SELECT 1 FROM expenses_version)
+        """)
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS expenses_version_{event.lower()}
+                AFTER {event} ON expenses
+                BEGIN UPDATE expenses_version SET version = version + 1; END
+            """)
+
+
+def _create_expenses_fts(conn, batch_size):
+    """
+    Version 8: full-text index over expense names and categories.
+
+    `expenses_fts` is an external-content FTS5 table: it stores only the
+    index and reads the text back from `expenses`, kept in sync by
+    triggers. Prefix indexes for two to four characters keep short prefix
+    queries, the common case while typing, as cheap as whole-word ones,
+    and bm25 ranks name matches above category matches.
+    """
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS expenses_fts USING fts5(
+                name, category,
+                content='expenses', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+            )
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS expenses_fts_insert
+            AFTER INSERT ON expenses
+            BEGIN
+                INSERT INTO expenses_fts (rowid, name, category) VALUES (new.id, new.name, new.category);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS expenses_fts_delete
+            AFTER DELETE ON expenses
+            BEGIN
+                INSERT INTO expenses_fts (expenses_fts, rowid, name, category)
+                VALUES ('delete', old.id, old.name, old.category);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS expenses_fts_update
+            AFTER UPDATE OF name, category ON expenses
+            BEGIN
+                INSERT INTO expenses_fts (expenses_fts, rowid, name, category)
+                VALUES ('delete', old.id, old.name, old.category);
+                INSERT INTO expenses_fts (rowid, name, category) VALUES (new.id, new.name, new.category);
+            END
+        """)
+        conn.execute("INSERT INTO expenses_fts (expenses_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')")
+        conn.execute("INSERT INTO expenses_fts (expenses_fts) VALUES ('rebuild')")
+
+
+def _create_expense_changes(conn, batch_size):
+    """
+    Version 9: a change log of the expenses table, for incremental sync.
+
+    `expense_changes` has one row per expense that exists or was deleted:
+    the `seq` of its latest change and whether that change deleted it (a
+    tombstone). Triggers move an expense to a new `seq` whenever it is
+    inserted, deleted or has a synced field updated, so the rows after a
+    client's last `seq` are exactly the expenses to send it, each once.
+    Existing expenses are logged in id order, for a client's first sync.
+    """
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS expense_changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                expense_id INTEGER NOT NULL UNIQUE,
+                deleted INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        for event, row, deleted in (("INSERT", "new", 0), ("DELETE", "old", 1),
+                                    ("UPDATE OF name, category, amount_cents, date_added, recurring, "
+                                     "recurring_schedule, template_id", "new", 0)):
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS expense_changes_{event.split()[0].lower()}
+                AFTER {event} ON expenses
+                BEGIN
+                    DELETE FROM expense_changes WHERE expense_id = {row}.id;
+                    INSERT INTO expense_changes (expense_id, deleted) VALUES ({row}.id, {deleted});
+                END
+            """)
+    _backfill(conn, """
+        INSERT OR IGNORE INTO expense_changes (expense_id)
+        SELECT id FROM expenses WHERE id > ? AND id <= ? ORDER BY id
+    """, batch_size, where="id NOT IN (SELECT expense_id FROM expense_changes)")
+
+
+def _create_archive_partitions(conn, batch_size):
+    """
+    Version 10: the manifest of the archived years (see archive.py).
+
+    One row per year moved out of the expenses table: the partition file
+    holding it and the bounds of its ids, dates and amounts, which let
+    readers skip the years a query cannot match without opening them.
+    """
+    with conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS archive_partitions (
+                year INTEGER PRIMARY KEY,
+                path TEXT NOT NULL,
+                rows INTEGER NOT NULL,
+                min_id INTEGER NOT NULL,
+                max_id INTEGER NOT NULL,
+                min_date TEXT NOT NULL,
+                max_date TEXT NOT NULL,
+                min_amount_cents INTEGER NOT NULL,
+                max_amount_cents INTEGER NOT NULL
+            )
+        """)
+
+
+def _create_archived_occurrences(conn, batch_size):
+    """
+    Version 11: the (template_id, date_added) keys of archived recurring charges.
+
+    Archived charges leave the expenses table and with it the unique
+    occurrence index, so `process_recurring_expenses` checks this table
+    too before charging an occurrence again. Filled from the years
+    already archived.
+    """
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS archived_occurrences (
+                template_id INTEGER NOT NULL,
+                date_added TEXT NOT NULL,
+                PRIMARY KEY (template_id, date_added)
+            ) WITHOUT ROWID
+        """)
+        for year in archive.archived_years(conn):
+            conn.executemany("INSERT OR IGNORE INTO archived_occurrences VALUES (?, ?)",
+                             archive.occurrence_keys(year.load()))
+
+
+MIGRATIONS = [
+    _migrate_amount_to_cents,
+    _index_amount_cents,
+    _create_daily_totals,
+    _add_recurring_next_due,
+    _create_job_runs,
+    _index_amount_cents_by_date,
+    _create_expenses_version,
+    _create_expenses_fts,
+    _create_expense_changes,
+    _create_archive_partitions,
+    _create_archived_occurrences,
+]
+
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, batch_size=MIGRATION_BATCH_SIZE):
+    """
+    Bring the schema of `conn` up to the latest version.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the expenses database.
+        batch_size (int): Rows per transaction for data migrations.
+
+    Returns:
+        int: The schema version after migrating.
+    """
+    version = get_schema_version(conn)
+    for target, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        migration(conn, batch_size)
+        conn.execute(f"PRAGMA user_version = {target}")
+        print(f"Database migrated to schema version {target}")
+    return get_schema_version(conn)
@@ -0,0 +1,262 @@
+"""
+In-memory snapshots of the database for the dashboard and expense lists.
+
+With snapshots enabled (`EXPENSES_SNAPSHOTS=1`), each worker process keeps
+a copy of every database it reads in memory and serves
+`get_recent_and_future_expenses`, the summaries and the expense lists from
+it, so those reads neither touch the disk nor compete with writers for
+the WAL. A background thread checks each database's `PRAGMA data_version`
+every half staleness bound and takes a fresh copy after a commit, but no
+sooner than `min_refresh_interval` after the last one: under a steady
+stream of writes, reads go to the database between copies rather than the
+whole database being copied over and over.
+
+A copy lives in SQLite's `memdb` VFS under a name of its own, so every
+reader thread opens it with an ordinary connection and reads concurrently.
+A refresh copies into a new name and switches over; the old copy, and
+every thread's connection to it, is closed once the last request reading
+it has finished.
+
+Reads are never served from a snapshot older than `max_staleness`: until
+the next refresh they fall back to the database, as do reads after a
+write made by this process, so a user always sees their own changes.
+"""
+
+import itertools
+import os
+import sqlite3
+import threading
+import time
+
+from db_cache import query_cache
+from db_connection import get_connection, retire
+from metrics import registry
+
+
+# Oldest data a snapshot read may return; overridable with EXPENSES_SNAPSHOT_STALENESS_MS
+SNAPSHOT_MAX_STALENESS_SECONDS = 1.0
+
+# Least time between two copies of a database; overridable with EXPENSES_SNAPSHOT_REFRESH_MS
+SNAPSHOT_MIN_REFRESH_SECONDS = 5.0
+
+# Snapshots of databases not read for this long are dropped
+SNAPSHOT_IDLE_SECONDS = 300
+
+# Snapshot names are never reused: a thread may hold on to a replaced one for a while
+_names = itertools.count()
+
+
+class _Snapshot:
+    """
+    One copy of a database, and the requests reading it.
+    """
+
+    def __init__(self, name, keeper, source, version, generation, copied_at):
+        self.name = name
+        self.keeper = keeper  # Keeps the copy alive between readers
+        self.source = source  # The connection `version` was read on; those of others do not compare
+        self.version = version  # `PRAGMA data_version` of the source when copied
+        self.generation = generation  # `query_cache` generation of the source when copied
+        self.copied_at = copied_at
+        self.fresh_at = copied_at  # When the source last matched the copy
+        self.readers = 0
+        self.replaced = False
+
+
+class SnapshotManager:
+    """
+    Keeps in-memory copies of the databases read through `acquire`.
+
+    Copies are made by a background thread, started on the first `acquire`
+    (and again in a forked worker, which does not inherit it); `refresh`
+    does the same work on the calling thread.
+    """
+
+    def __init__(self, max_staleness=SNAPSHOT_MAX_STALENESS_SECONDS, idle_timeout=SNAPSHOT_IDLE_SECONDS,
+                 min_refresh_interval=SNAPSHOT_MIN_REFRESH_SECONDS):
+        self.max_staleness = max_staleness
+        self.idle_timeout = idle_timeout
+        self.min_refresh_interval = min_refresh_interval
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._wanted = {}  # db_name -> when it was last read
+        self._current = {}  # db_name -> _Snapshot
+        self._snapshots = {}  # snapshot name -> _Snapshot, including replaced ones still being read
+
+    def start(self):
+        """
+        Start the refresh thread unless this process already runs one.
+        """
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                if self._pid is not None and self._pid != os.getpid():
+                    # The parent's SQLite handles must not be used in a forked worker
+                    self._refresh_lock = threading.Lock()
+                    self._wanted, self._current, self._snapshots = {}, {}, {}
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="db-snapshots", daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """
+        Stop the refresh thread and drop every snapshot not being read.
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and self._pid == os.getpid():
+            self._stop.set()
+            thread.join(timeout)
+        with self._refresh_lock:
+            for db_name in list(self._current):
+                self._drop(db_name)
+
+    def acquire(self, db_name):
+        """
+        Return the name to read `db_name` through, and pin it until `release`.
+
+        Args:
+            db_name (str): The database to read.
+
+        Returns:
+            str: The name of a snapshot no older than `max_staleness` to pass
+            to the read functions, or `db_name` itself when there is none.
+        """
+        if self._pid != os.getpid():
+            self.start()
+        now = time.monotonic()
+        with self._lock:
+            self._wanted[db_name] = now
+            snapshot = self._current.get(db_name)
+            if (snapshot is None or now - snapshot.fresh_at > self.max_staleness
+                    or query_cache.peek_generation(db_name) != snapshot.generation):
+                registry.inc("snapshot_reads_total", (("source", "database"),))
+                return db_name
+            snapshot.readers += 1
+        registry.inc("snapshot_reads_total", (("source", "snapshot"),))
+        return snapshot.name
+
+    def release(self, name):
+        """
+        Unpin a name returned by `acquire`; a replaced snapshot is freed with its last reader.
+        """
+        with self._lock:
+            snapshot = self._snapshots.get(name)
+            if snapshot is None:
+                return  # The database itself
+            snapshot.readers -= 1
+            if snapshot.replaced and snapshot.readers == 0:
+                self._discard(snapshot)
+
+    def refresh(self):
+        """
+        Copy every database read recently that changed since its last copy
+        and is due one, and drop the snapshots of databases that are no
+        longer read.
+        """
+        with self._refresh_lock:
+            now = time.monotonic()
+            for db_name, used_at in list(self._wanted.items()):
+                if now - used_at > self.idle_timeout:
+                    self._drop(db_name)
+                    continue
+                try:
+                    self._refresh(db_name)
+                except sqlite3.Error as e:
+                    print(f"Error refreshing the snapshot of {db_name}: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.max_staleness / 2):
+            self.refresh()
+
+    def _refresh(self, db_name):
+        # This thread's pooled connection; its own commits do not change its data
+        # version, but they do change the query cache generation
+        source = get_connection(db_name)
+        checked = time.monotonic()
+        # Read before the data version, so a write racing the copy leaves it marked stale
+        generation = query_cache.peek_generation(db_name)
+        version = source.execute("PRAGMA data_version").fetchone()[0]
+        current = self._current.get(db_name)
+        if current is not None:
+            if current.source is source and current.version == version and current.generation == generation:
+                with self._lock:
+                    current.fresh_at = checked
+                return
+            if checked - current.copied_at < self.min_refresh_interval:
+                return  # Goes stale, and reads fall back to the database until the next copy
+
+        path = f"/expenses-snapshot-{os.getpid()}-{next(_names)}"
+        # Connection.backup would copy the WAL flag of the file header, which memdb cannot open
+        keeper = sqlite3.connect(f"file:{path}?vfs=memdb", uri=True, check_same_thread=False)
+        try:
+            source.execute("VACUUM INTO ?", (f"file:{path}?vfs=memdb",))
+        except sqlite3.Error:
+            keeper.close()
+            raise
+        registry.observe("snapshot_copy_seconds", (), time.monotonic() - checked)
+
+        snapshot = _Snapshot(f"file:{path}?vfs=memdb&mode=ro", keeper, source, version, generation, checked)
+        with self._lock:
+            self._snapshots[snapshot.name] = snapshot
+            self._current[db_name] = snapshot
+            if current is not None:
+                self._replace(current)
+
+    def _drop(self, db_name):
+        with self._lock:
+            self._wanted.pop(db_name, None)
+            current = self._current.pop(db_name, None)
+            if current is not None:
+                self._replace(current)
+
+    def _replace(self, snapshot):
+        # Called with the lock held
+        snapshot.replaced = True
+        if snapshot.readers == 0:
+            self._discard(snapshot)
+
+    def _discard(self, snapshot):
+        # Called with the lock held
+        del self._snapshots[snapshot.name]
+        snapshot.keeper.close()
+        retire(snapshot.name)
+        query_cache.forget(snapshot.name)
+
+
+def init_app(app, snapshots):
+    """
+    Serve `read_db_name` from `snapshots` (None disables them) and unpin after each request.
+    """
+    from flask import g
+
+    app.config["SNAPSHOTS"] = snapshots
+
+    @app.teardown_request
+    def release_snapshots(error=None):
+        for manager, name in g.pop("snapshot_leases", ()):
+            manager.release(name)
+
+
+def read_db_name(db_name):
+    """
+    Return the name the current request should read `db_name` through.
+
+    With snapshots enabled that is a snapshot, pinned until the request
+    ends, and the same one for every call during the request; otherwise it
+    is `db_name` itself. Only for reads: snapshots are read-only.
+    """
+    from flask import current_app, g
+
+    snapshots = current_app.config.get("SNAPSHOTS")
+    if snapshots is None:
+        return db_name
+    names = g.setdefault("snapshot_names", {})
+    if db_name not in names:
+        names[db_name] = snapshots.acquire(db_name)
+        g.setdefault("snapshot_leases", []).append((snapshots, names[db_name]))
+    return names[db_name]
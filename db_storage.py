@@ -1,16 +1,27 @@
 
+import itertools
+import re
 import sqlite3
-from decimal import Decimal
 import datetime
+from typing import NamedTuple
 
+import archive
+from db_cache import cached, query_cache
+from db_connection import get_connection
+from db_migrations import migrate, rebuild_daily_totals as _rebuild_daily_totals
+from metrics import timed
+from expense import RECURRING_SCHEDULES, Expense, to_cents, format_cents, next_occurrence
 
+
+@timed
 def initialize_db(db_name="expenses.db"):
     """
     Initialize the database and create the `expenses` table 
     with support for recurring expenses.
     """
     try:
-        with sqlite3.connect(db_name) as conn:
+        conn = get_connection(db_name)
+        with conn:
             cursor = conn.cursor()
 
             # Create the expenses table
@@ -25,91 +36,701 @@ def initialize_db(db_name="expenses.db"):
                     recurring_schedule TEXT
                 )
             """)
+
+            # Indexes backing the date range summaries, category filters and
+            # the recurring-expense pass
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_expenses_date_added
+                ON expenses (date_added)
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_expenses_category_date_added
+                ON expenses (category, date_added)
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_expenses_recurring
+                ON expenses (date_added) WHERE recurring = 1
+            """)
             conn.commit()
-            print(f"Database initialized successfully: {db_name}")
+
+        # Bring older databases up to the current schema version
+        migrate(conn)
+        print(f"Database initialized successfully: {db_name}")
     except sqlite3.Error as e:
         print(f"Error initializing database: {e}")
 
 
+# Rows inserted per transaction by `write_expenses`
+WRITE_BATCH_SIZE = 5000
+
+_INSERT_EXPENSE = """
+    INSERT INTO expenses (name, category, amount, amount_cents, date_added, recurring, recurring_schedule, next_due)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Takes the `_INSERT_EXPENSE` parameters and the id. An edited template keeps
+# its place in the schedule: occurrences already charged (and maybe deleted
+# since) are never charged again. A new schedule or start date resumes from
+# the later of the stored and the recomputed next due date.
+_UPDATE_EXPENSE = """
+    UPDATE expenses
+    SET name = ?1, category = ?2, amount = ?3, amount_cents = ?4, date_added = ?5,
+        recurring = ?6, recurring_schedule = ?7,
+        next_due = CASE
+            WHEN ?8 IS NULL THEN NULL
+            WHEN recurring = 1 AND recurring_schedule IS ?7 AND date_added = ?5 THEN next_due
+            ELSE MAX(COALESCE(next_due, ?8), ?8)
+        END
+    WHERE id = ?9
+"""
+
+
+def _expense_name(expense):
+    return expense.name if isinstance(expense, Expense) else expense.get("name")
+
+
+def _expense_row(expense):
+    """
+    Validate an expense dict (or Expense) and convert it to the parameters of `_INSERT_EXPENSE`.
+
+    Raises:
+        ValueError: If a required field is missing or malformed.
+    """
+    if isinstance(expense, Expense):
+        expense = expense.to_dict()
+    if not isinstance(expense, dict):
+        raise ValueError("Expected an expense object.")
+    for field in ("name", "category", "date_added"):
+        if not expense.get(field):
+            raise ValueError(f"The '{field}' field is required.")
+    for field in ("name", "category"):
+        if not isinstance(expense[field], str):
+            raise ValueError(f"The '{field}' field must be text.")
+    day = datetime.date.fromisoformat(str(expense["date_added"]))  # Raises ValueError if malformed
+    # Stored as YYYY-MM-DD whatever ISO form it came in, such as 20250115, so ranges and rollups find it
+    date_added = day.isoformat()
+    amount_cents = to_cents(expense.get("amount"))
+    recurring = expense.get("recurring") or 0  # Default to non-recurring
+    if recurring not in (0, 1, "0", "1"):  # True and False compare equal to 1 and 0
+        raise ValueError(f"Invalid recurring flag: {recurring!r}")
+    recurring = int(recurring)
+    recurring_schedule = expense.get("recurring_schedule") or None
+    next_due = None
+    if recurring:
+        if recurring_schedule not in RECURRING_SCHEDULES:
+            raise ValueError(f"Invalid recurring schedule: {recurring_schedule!r}")
+        next_due = next_occurrence(day, recurring_schedule).isoformat()
+    return (
+        expense["name"],
+        expense["category"],
+        format_cents(amount_cents),
+        amount_cents,
+        date_added,
+        recurring,
+        recurring_schedule,
+        next_due,
+    )
+
+
+@timed
+def insert_expense(expense, db_name="expenses.db"):
+    """
+    Add a new expense to the database, raising on failure.
+
+    Args:
+        expense (dict | Expense): An expense as accepted by `write_expense`.
+        db_name (str): The database file name (default is 'expenses.db').
+
+    Returns:
+        int: The ID of the new expense.
+
+    Raises:
+        ValueError: If a required field is missing or malformed.
+        sqlite3.Error: If the insert fails.
+    """
+    row = _expense_row(expense)
+    conn = get_connection(db_name)
+    with conn:
+        expense_id = conn.execute(_INSERT_EXPENSE, row).lastrowid
+    query_cache.invalidate(db_name)
+    return expense_id
+
+
+@timed
 def write_expense(expense, db_name="expenses.db"):
     """
     Add a new expense to the database.
 
     Args:
-        expense (dict): A dictionary with keys:
+        expense (dict | Expense): An Expense, or a dictionary with keys:
             - 'name': Name of the expense.
             - 'category': Category of the expense.
             - 'amount': Amount of the expense.
             - 'date_added': Date the expense was added (e.g., '2025-01-14').
             - 'recurring': (optional) 0 for non-recurring, 1 for recurring.
             - 'recurring_schedule': (optional) Recurrence schedule (e.g., 'weekly', 'monthly').
+
+    Returns:
+        int: The ID of the new expense, or None if it was not added.
     """
     try:
-        if not expense.get("date_added"):
-            raise ValueError("The 'date_added' field is required.")
-
-        with sqlite3.connect(db_name) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO expenses (name, category, amount, date_added, recurring, recurring_schedule)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (
-                expense["name"],
-                expense["category"],
-                expense["amount"],
-                expense["date_added"],
-                expense.get("recurring", 0),  # Default to non-recurring
-                expense.get("recurring_schedule", None)  # Default to None
-            ))
-            conn.commit()
-            print(f"Expense '{expense['name']}' added successfully!")
+        expense_id = insert_expense(expense, db_name)
+        print(f"Expense '{_expense_name(expense)}' added successfully!")
+        return expense_id
     except ValueError as ve:
         print(f"Validation Error: {ve}")
     except sqlite3.Error as e:
         print(f"Error adding expense: {e}")
+    return None
+
+
+def prepare_expense(expense):
+    """
+    Validate an expense ahead of `insert_prepared_expenses`.
+
+    Args:
+        expense (dict | Expense): An expense as accepted by `write_expense`.
 
+    Returns:
+        tuple: The validated row, to pass to `insert_prepared_expenses`.
+
+    Raises:
+        ValueError: If a required field is missing or malformed.
+    """
+    return _expense_row(expense)
+
+
+@timed
+def insert_prepared_expenses(rows, db_name="expenses.db"):
+    """
+    Insert rows from `prepare_expense` in a single transaction.
+
+    Each row is inserted on its own statement, so one failing row (e.g. a
+    constraint violation) does not take the others with it; they are all
+    committed together, at the cost of a single commit.
+
+    Args:
+        rows (list[tuple]): Rows returned by `prepare_expense`.
+        db_name (str): The database file name (default is 'expenses.db').
+
+    Returns:
+        list[tuple[int, sqlite3.Error]]: Per row, the new expense ID and None,
+        or None and the error that rejected the row.
+
+    Raises:
+        sqlite3.Error: If the transaction as a whole fails; nothing was inserted.
+    """
+    conn = get_connection(db_name)
+    results = []
+    with conn:
+        for row in rows:
+            try:
+                results.append((conn.execute(_INSERT_EXPENSE, row).lastrowid, None))
+            except sqlite3.DatabaseError as e:
+                if not conn.in_transaction:
+                    raise  # The error rolled back the whole transaction
+                results.append((None, e))
+    if any(expense_id is not None for expense_id, _ in results):
+        query_cache.invalidate(db_name)
+    return results
 
-def read_expenses(db_name="expenses.db"):
+
+@timed
+def update_expense(expense_id, expense, db_name="expenses.db"):
     """
-    Retrieve all expenses from the database.
+    Replace the fields of an existing expense.
+
+    Editing a recurring template does not move it back in its schedule,
+    so occurrences already charged are not charged again.
+
+    Args:
+        expense_id (int): The ID of the expense to update.
+        expense (dict | Expense): The new fields, as accepted by `write_expense`.
+        db_name (str): The database file name (default is 'expenses.db').
 
     Returns:
-        list[dict]: A list of dictionaries, each representing an expense with keys:
+        bool: True if the expense exists and was updated.
+
+    Raises:
+        ValueError: If a required field is missing or malformed.
+        archive.ArchivedExpenseError: If the expense is archived.
+        sqlite3.Error: If the update fails.
+    """
+    row = _expense_row(expense)
+    conn = get_connection(db_name)
+    with conn:
+        cursor = conn.execute(_UPDATE_EXPENSE, row + (expense_id,))
+    if not cursor.rowcount:
+        _check_not_archived(conn, expense_id)
+    if cursor.rowcount:
+        query_cache.invalidate(db_name)
+    return cursor.rowcount > 0
+
+
+@timed
+def write_expenses(expenses, db_name="expenses.db", batch_size=WRITE_BATCH_SIZE):
+    """
+    Add many expenses to the database in chunked transactions.
+
+    `expenses` is consumed lazily, so it can be a generator over a file of
+    any size. Invalid expenses are skipped and reported instead of aborting
+    the import. Each chunk of `batch_size` valid rows is inserted with one
+    `executemany` and committed once.
+
+    Args:
+        expenses (Iterable[dict | Expense]): Expenses as accepted by `write_expense`.
+        db_name (str): The database file name (default is 'expenses.db').
+        batch_size (int): Rows inserted per transaction.
+
+    Returns:
+        tuple[int, list[tuple[int, str]]]: The number of inserted expenses and
+        a list of (1-based position, error message) for the rejected ones.
+        A database error stops the import and is reported with position None.
+    """
+    conn = get_connection(db_name)
+    inserted, errors, batch = 0, [], []
+
+    def flush():
+        with conn:
+            conn.executemany(_INSERT_EXPENSE, batch)
+        return len(batch)
+
+    try:
+        for position, expense in enumerate(expenses, start=1):
+            try:
+                batch.append(_expense_row(expense))
+            except ValueError as ve:
+                errors.append((position, str(ve)))
+                continue
+            if len(batch) >= batch_size:
+                inserted += flush()
+                batch = []
+        if batch:
+            inserted += flush()
+    except sqlite3.Error as e:
+        # The failing chunk was rolled back; earlier chunks stay committed
+        errors.append((None, f"Error adding expenses: {e}"))
+    if inserted:
+        query_cache.invalidate(db_name)
+    return inserted, errors
+
+
+# Sort keys accepted by `read_expenses`: (column, direction)
+EXPENSE_SORTS = {
+    "id": ("id", "ASC"),  # Insertion order
+    "date_desc": ("date_added", "DESC"),
+    "date_asc": ("date_added", "ASC"),
+    "amount_desc": ("amount_cents", "DESC"),
+    "amount_asc": ("amount_cents", "ASC"),
+}
+
+
+def make_cursor(expense, sort="date_desc"):
+    """
+    Build the keyset cursor pointing at `expense` for the given sort order.
+
+    Args:
+        expense (Expense): An expense as returned by `read_expenses`.
+        sort (str): One of `EXPENSE_SORTS`.
+
+    Returns:
+        str: An opaque cursor to pass back as `after` or `before`.
+    """
+    column, _ = EXPENSE_SORTS[sort]
+    if column == "id":
+        return str(expense.id)
+    return f"{getattr(expense, column)}:{expense.id}"
+
+
+def _parse_cursor(cursor, sort):
+    """
+    Split a cursor built by `make_cursor` into its sort value and id.
+    """
+    column, _ = EXPENSE_SORTS[sort]
+    try:
+        if column == "id":
+            return (int(cursor),)
+        value, expense_id = cursor.rsplit(":", 1)
+        if column == "amount_cents":
+            value = int(value)
+        return value, int(expense_id)
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+
+def _search_words(text):
+    """
+    Split free text into the words a search matches, as the full-text index tokenizes them.
+    """
+    return re.findall(r"[^\W_]+", text or "")[:MAX_SEARCH_WORDS]
+
+
+def _fts_query(text):
+    """
+    Turn free text into an FTS5 query matching every word as a prefix.
+
+    Words are quoted, so FTS5 operators and punctuation in the text are
+    searched for literally rather than interpreted. Returns None if the
+    text has no words.
+    """
+    words = _search_words(text)
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def _expense_filters(start_date=None, end_date=None, category=None, recurring=None,
+                     min_amount_cents=None, max_amount_cents=None, search=None):
+    """
+    Build the WHERE conditions and parameters for the listing filters.
+    """
+    conditions, params = [], []
+    match = _fts_query(search)
+    if match is not None:
+        conditions.append("id IN (SELECT rowid FROM expenses_fts WHERE expenses_fts MATCH ?)")
+        params.append(match)
+    if start_date is not None:
+        conditions.append("date_added >= ?")
+        params.append(str(start_date))
+    if end_date is not None:
+        conditions.append("date_added < ?")
+        params.append(str(end_date))
+    if category is not None:
+        conditions.append("category = ?")
+        params.append(category)
+    if recurring is not None:
+        conditions.append("recurring = ?")
+        params.append(int(recurring))
+    if min_amount_cents is not None:
+        conditions.append("amount_cents >= ?")
+        params.append(min_amount_cents)
+    if max_amount_cents is not None:
+        conditions.append("amount_cents <= ?")
+        params.append(max_amount_cents)
+    return conditions, params
+
+
+# Columns in the order expected by `Expense.from_row`
+_SELECT_EXPENSES = """
+    SELECT id, name, category, amount_cents, date_added, recurring, recurring_schedule, template_id
+    FROM expenses
+"""
+
+# Rows pulled from SQLite per `fetchmany` call while streaming
+READ_BATCH_SIZE = 500
+
+
+def _stream_rows(cursor, batch_size):
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        try:
+            cursor.close()
+        except sqlite3.ProgrammingError:
+            pass  # The connection was closed before the generator was dropped
+
+
+def iter_expenses(db_name="expenses.db", start_date=None, end_date=None, category=None,
+                  recurring=None, min_amount_cents=None, max_amount_cents=None, search=None,
+                  sort="id", after=None, before=None, limit=None, batch_size=READ_BATCH_SIZE):
+    """
+    Lazily iterate over expenses, optionally filtered and paginated.
+
+    Rows are fetched from SQLite `batch_size` at a time as the iterator is
+    consumed, so memory use stays flat no matter how many rows match.
+    The query itself runs (and arguments are validated) when this function
+    is called, not on the first `next()`.
+
+    Pagination is keyset based: pass the cursor of the last row of a page
+    (see `make_cursor`) as `after` to get the next page, or the cursor of the
+    first row as `before` to get the previous one. Each page costs the same
+    regardless of how deep into the history it is.
+
+    Expenses moved to the archive (see archive.py) are merged in, in sort
+    order, from the archived years the date range overlaps.
+
+    Args:
+        db_name (str): The database file name (default is 'expenses.db').
+        start_date (str | datetime.date): Only expenses dated on or after this day.
+        end_date (str | datetime.date): Only expenses dated before this day.
+        category (str): Only expenses in this category.
+        recurring (int | bool): Only recurring (1) or non-recurring (0) expenses.
+        min_amount_cents (int): Only expenses of at least this amount.
+        max_amount_cents (int): Only expenses of at most this amount.
+        search (str): Only expenses whose name or category contain words
+            starting with every word of this text (see `search_expenses`).
+        sort (str): One of `EXPENSE_SORTS` (default is insertion order).
+        after (str): Cursor; return the rows following it.
+        before (str): Cursor; return the rows preceding it.
+        limit (int): Maximum number of rows to return (default is all).
+        batch_size (int): Rows fetched from SQLite at a time.
+
+    Returns:
+        Iterator[Expense]: The matching expenses.
+
+    Raises:
+        ValueError: If `sort` or a cursor is invalid.
+        sqlite3.Error: If the query fails.
+        archive.ArchiveError: If an archived year's file cannot be read.
+    """
+    if sort not in EXPENSE_SORTS:
+        raise ValueError(f"Invalid sort: {sort!r}")
+    column, direction = EXPENSE_SORTS[sort]
+
+    conditions, params = _expense_filters(start_date, end_date, category, recurring,
+                                          min_amount_cents, max_amount_cents, search)
+    backwards = before is not None
+    if backwards:
+        # Walk the index the other way from the cursor, then restore the order
+        direction = "ASC" if direction == "DESC" else "DESC"
+    cursor_value = before if backwards else after
+    parsed_cursor = None
+    if cursor_value is not None:
+        comparison = "<" if direction == "DESC" else ">"
+        key = "id" if column == "id" else f"({column}, id)"
+        placeholders = "?" if column == "id" else "(?, ?)"
+        conditions.append(f"{key} {comparison} {placeholders}")
+        parsed_cursor = _parse_cursor(cursor_value, sort)
+        params.extend(parsed_cursor)
+
+    query = _SELECT_EXPENSES
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += f" ORDER BY {column} {direction}"
+    if column != "id":
+        query += f", id {direction}"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(int(limit))
+
+    conn = get_connection(db_name)
+    cursor = conn.cursor()
+    cursor.row_factory = Expense.from_row  # Build Expense records straight from the rows
+    cursor.execute(query, params)
+    # Read while the query holds its snapshot, so an expense being archived is seen exactly once
+    years = archive.archived_years(conn, start_date, end_date)
+    if backwards:
+        # A backwards page is bounded by `limit`; materialise it to reverse it
+        rows = cursor.fetchall()
+        cursor.close()
+    else:
+        rows = _stream_rows(cursor, batch_size)
+    if years:
+        rows = archive.merge(
+            rows, years, column, descending=direction == "DESC",
+            after_key=None if parsed_cursor is None else archive.cursor_key(column, parsed_cursor),
+            start_date=start_date, end_date=end_date, category=category, recurring=recurring,
+            min_amount_cents=min_amount_cents, max_amount_cents=max_amount_cents,
+            search_words=_search_words(search),
+        )
+        if limit is not None:
+            rows = itertools.islice(rows, int(limit))
+        if backwards:
+            rows = list(rows)
+    return reversed(rows) if backwards else rows
+
+
+def iter_expenses_by_page(db_name="expenses.db", page_size=READ_BATCH_SIZE, sort="id", **filters):
+    """
+    Iterate over every matching expense, one keyset page query at a time.
+
+    Unlike a single `iter_expenses` call, no statement (and so no read
+    snapshot) stays open between pages. Long exports therefore never hold
+    up WAL checkpoints, and the connection is free between pages.
+
+    Args:
+        db_name (str): The database file name (default is 'expenses.db').
+        page_size (int): Rows read per query.
+        sort (str): One of `EXPENSE_SORTS` (default is insertion order).
+        **filters: Filters accepted by `iter_expenses`.
+
+    Yields:
+        Expense: The matching expenses.
+    """
+    after = None
+    while True:
+        page = list(iter_expenses(db_name, sort=sort, after=after, limit=page_size,
+                                  batch_size=page_size, **filters))
+        yield from page
+        if len(page) < page_size:
+            break
+        after = make_cursor(page[-1], sort)
+
+
+@timed
+def read_expenses(db_name="expenses.db", **filters):
+    """
+    Retrieve expenses from the database, optionally filtered and paginated.
+
+    Accepts the same filter, sort and pagination arguments as `iter_expenses`.
+    Prefer `iter_expenses` for large result sets.
+
+    Returns:
+        list[Expense]: The matching expenses, with attributes:
             - 'id': ID of the expense.
             - 'name': Name of the expense.
             - 'category': Category of the expense.
-            - 'amount': Amount of the expense.
-            - 'date_added': Date the expense was added.
+            - 'amount_cents': Amount of the expense in integer cents.
+            - 'date_added': Date the expense was added (datetime.date).
             - 'recurring': Whether the expense is recurring (0 or 1).
             - 'recurring_schedule': Recurrence schedule (e.g., 'weekly', 'monthly').
+            - 'template_id': For generated recurring charges, the ID of their template.
+
+    Raises:
+        ValueError: If `sort` or a cursor is invalid.
     """
     try:
-        with sqlite3.connect(db_name) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT id, name, category, amount, date_added, recurring, recurring_schedule
-                FROM expenses
-            """)
-            rows = cursor.fetchall()
-
-        # Convert rows to a list of dictionaries
-        expenses = [
-            {
-                "id": row[0],
-                "name": row[1],
-                "category": row[2],
-                "amount": float(row[3]),
-                "date_added": row[4],
-                "recurring": row[5],
-                "recurring_schedule": row[6],
-            }
-            for row in rows
-        ]
-        return expenses
+        return list(iter_expenses(db_name, **filters))
     except sqlite3.Error as e:
         print(f"Error reading expenses: {e}")
         return []
-    
+
+
+# Words of a search beyond this many are ignored
+MAX_SEARCH_WORDS = 8
+
+# Matches ranked together by `search_expenses`; bounds the bm25 work per page
+SEARCH_RANK_WINDOW = 500
+
+_MAX_ROWID = 2 ** 63 - 1
+
+
+class SearchResults(NamedTuple):
+    expenses: list  # list[Expense], best match first
+    next: str  # Cursor of the following page, or None on the last page
+
+
+def _parse_search_cursor(cursor):
+    try:
+        window_end, rank, expense_id = cursor.split(":")
+        return int(window_end), float(rank), int(expense_id)
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+
+@timed
+def search_expenses(query, db_name="expenses.db", limit=50, after=None, **filters):
+    """
+    Full-text search over expense names and categories, best match first.
+
+    Every word of `query` must match the start of a word in the name or
+    category, so "net" finds "Netflix". Matches are ranked by bm25, with
+    name matches weighing more than category matches, and ties broken
+    newest first.
+
+    Ranking a word that matches a large part of the table would cost a
+    bm25 evaluation per match, so matches (after filtering) are ranked in
+    windows of the `SEARCH_RANK_WINDOW` newest ones: all matches of the
+    first window come before any match of the next. A search matching
+    fewer rows than that is ranked exactly. The `next` cursor records the
+    window, so paging goes through every match.
+
+    Args:
+        query (str): The search text.
+        db_name (str): The database file name (default is 'expenses.db').
+        limit (int): Maximum number of expenses to return.
+        after (str): The `next` cursor of the previous page.
+        **filters: Filters accepted by `iter_expenses` (start_date, end_date,
+            category, recurring, min_amount_cents, max_amount_cents).
+
+    Returns:
+        SearchResults: The matching expenses and the cursor of the next page.
+
+    Raises:
+        ValueError: If the cursor is invalid.
+    """
+    match = _fts_query(query)
+    if match is None:
+        return SearchResults([], None)
+    window_end, last = _MAX_ROWID, None
+    if after is not None:
+        window_end, rank, expense_id = _parse_search_cursor(after)
+        last = (rank, -expense_id)
+    conditions, params = _expense_filters(**filters)
+
+    try:
+        conn = get_connection(db_name)
+        page = []  # (rank, -id, window end), best first
+        while len(page) <= limit:
+            window = _search_window(conn, match, window_end, conditions, params)
+            ranked = sorted((rank, -expense_id) for expense_id, rank in window)
+            page += [(rank, key, window_end) for rank, key in ranked if last is None or (rank, key) > last]
+            if len(window) < SEARCH_RANK_WINDOW:
+                break  # That was the oldest window
+            window_end, last = window[-1][0] - 1, None
+
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            rank, key, end = page[-1]
+            next_cursor = f"{end}:{rank!r}:{-key}"
+        ids = [-key for _, key, _ in page]
+        cursor = conn.cursor()
+        cursor.row_factory = Expense.from_row
+        cursor.execute(_SELECT_EXPENSES + f" WHERE id IN ({','.join('?' * len(ids))})", ids)
+        expenses = {expense.id: expense for expense in cursor.fetchall()}
+    except sqlite3.Error as e:
+        print(f"Error searching expenses: {e}")
+        return SearchResults([], None)
+    # An expense deleted since it was ranked is left out
+    return SearchResults([expenses[i] for i in ids if i in expenses], next_cursor)
+
+
+def _search_window(conn, match, window_end, conditions, params):
+    """
+    Return (id, rank) of the newest `SEARCH_RANK_WINDOW` matches up to
+    `window_end` that pass the filter `conditions`, newest first.
+    """
+    query = "SELECT rowid, rank FROM expenses_fts WHERE expenses_fts MATCH ? AND rowid <= ?"
+    if conditions:
+        # Filtering before the LIMIT keeps every window full; bm25 only runs on the rows kept
+        query += f" AND EXISTS (SELECT 1 FROM expenses WHERE id = expenses_fts.rowid AND {' AND '.join(conditions)})"
+    query += " ORDER BY rowid DESC LIMIT ?"
+    return conn.execute(query, [match, window_end, *params, SEARCH_RANK_WINDOW]).fetchall()
+
+
+def _find_expense(conn, expense_id):
+    """
+    Return the expense with `expense_id`, archived or not, or None.
+    """
+    cursor = conn.cursor()
+    cursor.row_factory = Expense.from_row
+    expense = cursor.execute(_SELECT_EXPENSES + " WHERE id = ?", (expense_id,)).fetchone()
+    return expense if expense is not None else archive.find_expense(conn, expense_id)
+
+
+def _check_not_archived(conn, expense_id):
+    """
+    Raise ArchivedExpenseError if `expense_id`, which is not in the expenses table, was archived.
+    """
+    if archive.find_expense(conn, expense_id) is not None:
+        raise archive.ArchivedExpenseError(f"Expense {expense_id} is archived and cannot be changed.")
+
+
+@timed
+def get_expense(expense_id, db_name="expenses.db"):
+    """
+    Retrieve one expense by its ID, including archived ones.
+
+    Args:
+        expense_id (int): The ID of the expense.
+        db_name (str): The database file name (default is 'expenses.db').
+
+    Returns:
+        Expense: The expense, or None if there is no such expense.
+    """
+    try:
+        return _find_expense(get_connection(db_name), expense_id)
+    except sqlite3.Error as e:
+        print(f"Error reading expense: {e}")
+        return None
+
+
+@timed
 def delete_expense(expense_id, db_name="expenses.db"):
     """
     Delete an expense by its ID.
@@ -117,103 +738,395 @@ def delete_expense(expense_id, db_name="expenses.db"):
     Args:
         expense_id (int): The ID of the expense to delete.
         db_name (str): The database file name (default is 'expenses.db').
+
+    Returns:
+        bool: True if an expense was deleted.
+
+    Raises:
+        archive.ArchivedExpenseError: If the expense is archived.
     """
     try:
-        with sqlite3.connect(db_name) as conn:
+        conn = get_connection(db_name)
+        with conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM expenses WHERE id = ?", (expense_id,))
-            conn.commit()
-            print(f"Expense with ID {expense_id} deleted successfully.")
+        if not cursor.rowcount:
+            _check_not_archived(conn, expense_id)
+            return False
+        query_cache.invalidate(db_name)
+        print(f"Expense with ID {expense_id} deleted successfully.")
+        return True
     except sqlite3.Error as e:
         print(f"Error deleting expense: {e}")
+        return False
 
 
-
-def process_recurring_expenses(db_name="expenses.db"):
+@timed
+def get_data_version(db_name="expenses.db"):
     """
-    Processes all recurring expenses and adds a new instance if needed.
-    Updates the `date_added` field for recurring expenses after processing.
+    Return the persistent change counter of the expenses table.
+
+    The counter is bumped by triggers on every insert, update and delete,
+    whichever process makes it, so equal versions mean equal data.
+
+    Returns:
+        int: The current version, or None if it cannot be read.
     """
     try:
-        today = datetime.date.today()
+        return get_connection(db_name).execute("SELECT version FROM expenses_version").fetchone()[0]
+    except sqlite3.Error as e:
+        print(f"Error reading data version: {e}")
+        return None
 
-        with sqlite3.connect(db_name) as conn:
-            cursor = conn.cursor()
 
-            # Fetch all recurring expenses
-            cursor.execute("""
-                SELECT id, name, category, amount, date_added, recurring_schedule 
-                FROM expenses 
-                WHERE recurring = 1
-            """)
-            recurring_expenses = cursor.fetchall()
-
-            for expense in recurring_expenses:
-                expense_id, name, category, amount, date_added, schedule = expense
-                date_added = datetime.datetime.strptime(date_added, "%Y-%m-%d").date()
-
-                # Determine if the expense needs to recur based on the schedule
-                if schedule == "daily":
-                    next_occurrence = date_added + datetime.timedelta(days=1)
-                elif schedule == "weekly":
-                    next_occurrence = date_added + datetime.timedelta(weeks=1)
-                elif schedule == "monthly":
-                    # Add one month by using the calendar module
-                    year, month = date_added.year, date_added.month
-                    next_month = (month % 12) + 1
-                    year += (month + 1) // 13
-                    next_occurrence = date_added.replace(year=year, month=next_month)
-
-                # If today matches or exceeds the next occurrence, add the expense
-                if next_occurrence <= today:
-                    # Add a new expense for today
-                    cursor.execute("""
-                        INSERT INTO expenses (name, category, amount, date_added, recurring, recurring_schedule)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    """, (name, category, amount, today.strftime("%Y-%m-%d"), 1, schedule))
-
-                    # Update the `date_added` field for the original expense
-                    cursor.execute("""
-                        UPDATE expenses
-                        SET date_added = ?
-                        WHERE id = ?
-                    """, (today.strftime("%Y-%m-%d"), expense_id))
+# Changes returned per call of `get_changes`
+CHANGES_PAGE_SIZE = 1000
+
+
+class ExpenseChange(NamedTuple):
+    seq: int  # Position of the expense's latest change in the change log
+    id: int
+    expense: Expense  # The expense as it is now, or None if it was deleted
 
-            conn.commit()
-            print("Recurring expenses processed successfully.")
 
+class ChangeSet(NamedTuple):
+    changes: list  # list[ExpenseChange], oldest change first
+    cursor: int  # The `since` of the next call
+    has_more: bool  # Whether more changes are waiting after `cursor`
+
+
+@timed
+def get_changes(db_name="expenses.db", since=0, limit=CHANGES_PAGE_SIZE):
+    """
+    Return the expenses changed after `since`, for incremental sync.
+
+    The change log keeps only the latest change of each expense, so an
+    expense edited many times is returned once, as it is now, and a
+    deleted one as a tombstone. Starting from `since=0` returns every
+    expense; afterwards, only what changed since the previous call.
+
+    Args:
+        db_name (str): The database file name (default is 'expenses.db').
+        since (int): The `cursor` of the previous call.
+        limit (int): Maximum number of changes to return.
+
+    Returns:
+        ChangeSet: The changes and the cursor to continue from, or None if
+        the change log cannot be read.
+    """
+    try:
+        conn = get_connection(db_name)
+        cursor = conn.execute("""
+            SELECT c.seq, c.expense_id, c.deleted,
+                   e.id, e.name, e.category, e.amount_cents, e.date_added,
+                   e.recurring, e.recurring_schedule, e.template_id
+            FROM expense_changes AS c
+            LEFT JOIN expenses AS e ON e.id = c.expense_id
+            WHERE c.seq > ?
+            ORDER BY c.seq
+            LIMIT ?
+        """, (since, limit + 1))
+        rows = cursor.fetchall()
+        changes = []
+        for seq, expense_id, deleted, *row in rows[:limit]:
+            if deleted:
+                expense = None
+            elif row[0] is not None:
+                expense = Expense.from_row(None, row)
+            else:
+                expense = archive.find_expense(conn, expense_id)  # Archived expenses stay in the log
+            changes.append(ExpenseChange(seq, expense_id, expense))
     except sqlite3.Error as e:
-        print(f"Error processing recurring expenses: {e}")
+        print(f"Error reading changes: {e}")
+        return None
+    return ChangeSet(changes, changes[-1].seq if changes else since, len(rows) > limit)
+
+
+class SyncResult(NamedTuple):
+    status: str  # "applied", "conflict" or "invalid"
+    id: int  # The expense changed (for a create, the new one)
+    seq: int  # Applied: the change's position in the log; conflict: the latest change's
+    expense: Expense = None  # Conflict: the expense as it is now, or None if it was deleted
+    error: str = None  # Invalid: why the change was rejected
+
+
+def _apply_change(conn, expense_id, base, row):
+    """
+    Apply one change of `sync_expenses` inside its transaction.
+    """
+    if expense_id is None:
+        expense_id = conn.execute(_INSERT_EXPENSE, row).lastrowid
+    else:
+        current = conn.execute("SELECT seq, deleted FROM expense_changes WHERE expense_id = ?",
+                               (expense_id,)).fetchone()
+        if current is None:
+            return SyncResult("invalid", expense_id, None, error=f"Unknown expense: {expense_id}")
+        seq, deleted = current
+        if seq != base or (deleted and row is not None):
+            expense = None if deleted else _find_expense(conn, expense_id)
+            return SyncResult("conflict", expense_id, seq, expense)
+        if row is None:
+            cursor = conn.execute("DELETE FROM expenses WHERE id = ?", (expense_id,))
+        else:
+            cursor = conn.execute(_UPDATE_EXPENSE, row + (expense_id,))
+        if not cursor.rowcount:
+            return SyncResult("invalid", expense_id, seq, error=f"Expense {expense_id} is archived and read-only.")
+    seq = conn.execute("SELECT seq FROM expense_changes WHERE expense_id = ?", (expense_id,)).fetchone()[0]
+    return SyncResult("applied", expense_id, seq)
+
+
+@timed
+def sync_expenses(changes, db_name="expenses.db"):
+    """
+    Apply a batch of changes made offline, in one transaction.
 
+    Each change is an (expense_id, base, expense) tuple: without an
+    `expense_id` it creates `expense`, without an `expense` it deletes
+    the expense, and otherwise it replaces its fields. `base` is the
+    `seq` of the expense the client last synced; a change to an expense
+    that changed since is not applied but reported as a conflict, with
+    the current version for the client to merge and send again on top of.
+    Invalid changes are reported and skipped; the others commit together.
 
-def get_recent_and_future_expenses(db_name="expenses.db"):
+    Args:
+        changes (list[tuple[int, int, dict]]): The changes, in order.
+        db_name (str): The database file name (default is 'expenses.db').
+
+    Returns:
+        list[SyncResult]: The outcome of each change, in order.
+
+    Raises:
+        sqlite3.Error: If the transaction as a whole fails; nothing was applied.
+    """
+    rows = []
+    for _, _, expense in changes:
+        try:
+            rows.append(None if expense is None else _expense_row(expense))
+        except ValueError as ve:
+            rows.append(ve)
+
+    conn = get_connection(db_name)
+    results = []
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")  # Conflicts are checked against what this transaction changes
+        for (expense_id, base, _), row in zip(changes, rows):
+            if isinstance(row, ValueError):
+                results.append(SyncResult("invalid", expense_id, None, error=str(row)))
+                continue
+            try:
+                results.append(_apply_change(conn, expense_id, base, row))
+            except sqlite3.DatabaseError as e:
+                if not conn.in_transaction:
+                    raise  # The error rolled back the whole transaction
+                results.append(SyncResult("invalid", expense_id, None, error=str(e)))
+    if any(result.status == "applied" for result in results):
+        query_cache.invalidate(db_name)
+    return results
+
+
+@timed
+def process_recurring_expenses(db_name="expenses.db", today=None):
+    """
+    Charge every recurring expense that has fallen due.
+
+    Each recurring expense is a template with a `next_due` date. Only the
+    templates due by `today` are read (through the partial `next_due`
+    index), every missed occurrence up to `today` is inserted with a
+    `template_id` pointing back at the template, and `next_due` moves past
+    `today`. Everything happens in one write transaction, and the unique
+    (template_id, date_added) index makes a concurrent or repeated run a
+    no-op instead of double charging. Occurrences moved to the archive
+    count as charged too (see `archived_occurrences`).
+
+    Args:
+        db_name (str): The database file name (default is 'expenses.db').
+        today (datetime.date): Charge occurrences up to this day (default is today).
+
+    Returns:
+        int: The number of occurrences added.
+    """
     try:
-        today = datetime.date.today()
-        seven_days_ago = today - datetime.timedelta(days=7)
+        today = today or datetime.date.today()
 
-        with sqlite3.connect(db_name) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT id, name, category, amount, date_added, recurring, recurring_schedule
+        conn = get_connection(db_name)
+        with conn:
+            # Take the write lock before reading, so concurrent runs queue up
+            conn.execute("BEGIN IMMEDIATE")
+
+            due = conn.execute("""
+                SELECT id, name, category, amount, amount_cents, date_added, recurring_schedule, next_due
                 FROM expenses
-                WHERE date_added >= ?
-                ORDER BY date_added DESC
-            """, (seven_days_ago,))
-            rows = cursor.fetchall()
-
-        expenses = [
-            {
-                "id": row[0],
-                "name": row[1],
-                "category": row[2],
-                "amount": float(row[3]),
-                "date_added": row[4],
-                "recurring": row[5],
-                "recurring_schedule": row[6],
-            }
-            for row in rows
-        ]
-        return expenses
+                WHERE recurring = 1 AND next_due <= ?
+            """, (today.isoformat(),)).fetchall()
+
+            occurrences, next_dues = [], []
+            for expense_id, name, category, amount, amount_cents, date_added, schedule, next_due in due:
+                anchor_day = datetime.date.fromisoformat(date_added).day
+                occurrence = datetime.date.fromisoformat(next_due)
+                while occurrence <= today:
+                    occurrences.append((name, category, amount, amount_cents, occurrence.isoformat(),
+                                        schedule, expense_id))
+                    occurrence = next_occurrence(occurrence, schedule, anchor_day)
+                next_dues.append((occurrence.isoformat(), expense_id))
+
+            added = conn.executemany("""
+                INSERT OR IGNORE INTO expenses
+                    (name, category, amount, amount_cents, date_added, recurring, recurring_schedule, template_id)
+                SELECT ?1, ?2, ?3, ?4, ?5, 0, ?6, ?7
+                WHERE NOT EXISTS (SELECT 1 FROM archived_occurrences WHERE template_id = ?7 AND date_added = ?5)
+            """, occurrences).rowcount
+            conn.executemany("UPDATE expenses SET next_due = ? WHERE id = ?", next_dues)
+
+        if due:
+            query_cache.invalidate(db_name)
+        print(f"Recurring expenses processed successfully: {added} added.")
+        return added
+
+    except (sqlite3.Error, ValueError) as e:
+        print(f"Error processing recurring expenses: {e}")
+        return 0
+
+
+@timed
+def record_job_run(name, started_at, finished_at, duration_ms, result, db_name="expenses.db"):
+    """
+    Record the latest run of a background job.
+
+    Args:
+        name (str): Name of the job (e.g. 'process_recurring_expenses').
+        started_at (str): ISO timestamp the run started at.
+        finished_at (str): ISO timestamp the run finished at.
+        duration_ms (float): How long the run took, in milliseconds.
+        result (str): Short description of the outcome.
+        db_name (str): The database file name (default is 'expenses.db').
+    """
+    try:
+        conn = get_connection(db_name)
+        with conn:
+            conn.execute("""
+                INSERT INTO job_runs (name, last_started_at, last_finished_at, last_duration_ms, last_result, run_count)
+                VALUES (?, ?, ?, ?, ?, 1)
+                ON CONFLICT (name) DO UPDATE SET
+                    last_started_at = excluded.last_started_at,
+                    last_finished_at = excluded.last_finished_at,
+                    last_duration_ms = excluded.last_duration_ms,
+                    last_result = excluded.last_result,
+                    run_count = run_count + 1
+            """, (name, started_at, finished_at, duration_ms, result))
+    except sqlite3.Error as e:
+        print(f"Error recording job run: {e}")
+
+
+@timed
+def get_job_runs(db_name="expenses.db"):
+    """
+    Retrieve the latest run of every background job.
+
+    Returns:
+        dict[str, dict]: Job name to its last start/finish timestamps,
+        duration in milliseconds, result and number of runs.
+    """
+    try:
+        conn = get_connection(db_name)
+        rows = conn.execute("""
+            SELECT name, last_started_at, last_finished_at, last_duration_ms, last_result, run_count
+            FROM job_runs
+        """).fetchall()
+    except sqlite3.Error as e:
+        print(f"Error reading job runs: {e}")
+        return {}
+    return {
+        row[0]: {
+            "last_started_at": row[1],
+            "last_finished_at": row[2],
+            "last_duration_ms": row[3],
+            "last_result": row[4],
+            "run_count": row[5],
+        }
+        for row in rows
+    }
+
+
+@timed
+def rebuild_daily_totals(db_name="expenses.db"):
+    """
+    Recompute the `daily_totals` rollup from scratch.
+
+    The triggers keep the rollup current; this backfills it after the
+    expenses table was changed with the triggers bypassed (e.g. restored
+    from a backup or edited with an external tool). Archived expenses
+    are counted too.
+
+    Args:
+        db_name (str): The database file name (default is 'expenses.db').
+    """
+    try:
+        conn = get_connection(db_name)
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            _rebuild_daily_totals(conn)
+            archive.add_daily_totals(conn, archive.archived_years(conn))
+        query_cache.invalidate(db_name)
+        print(f"Daily totals rebuilt: {db_name}")
+    except sqlite3.Error as e:
+        print(f"Error rebuilding daily totals: {e}")
+
+
+def _week_bounds(day):
+    """
+    Return the half-open range [monday, next monday) containing `day`.
+    """
+    start = day - datetime.timedelta(days=day.weekday())
+    return start, start + datetime.timedelta(weeks=1)
+
+
+def _month_bounds(day):
+    """
+    Return the half-open range [first of month, first of next month) containing `day`.
+    """
+    start = day.replace(day=1)
+    if start.month == 12:
+        end = start.replace(year=start.year + 1, month=1)
+    else:
+        end = start.replace(month=start.month + 1)
+    return start, end
+
+
+def _sum_amount_between(db_name, start, end):
+    """
+    Sum the amounts, in cents, of expenses dated in [start, end).
+
+    Reads the `daily_totals` rollup, so the cost depends on the number of
+    days in the range rather than the number of expenses.
+    """
+    conn = get_connection(db_name)
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT COALESCE(SUM(total_cents), 0)
+            FROM daily_totals
+            WHERE date >= ? AND date < ?
+        """, (start.isoformat(), end.isoformat()))
+        return cursor.fetchone()[0]
+
+
+@timed
+@cached
+def get_recent_and_future_expenses(db_name="expenses.db", today=None):
+    """
+    Retrieve expenses dated from seven days ago onwards, newest first.
+
+    Args:
+        db_name (str): Name of the database file.
+        today (datetime.date): Reference day (default is today).
+
+    Returns:
+        list[Expense]: The matching expenses, newest first.
+    """
+    try:
+        today = today or datetime.date.today()
+        seven_days_ago = today - datetime.timedelta(days=7)
+        return list(iter_expenses(db_name, start_date=seven_days_ago.isoformat(), sort="date_desc"))
     except sqlite3.Error as e:
         print(f"Error retrieving recent and future expenses: {e}")
         return []
@@ -221,59 +1134,133 @@ def get_recent_and_future_expenses(db_name="expenses.db"):
 
 
 
-def get_monthly_expenses_amount(db_name="expenses.db"):
+@timed
+@cached
+def get_monthly_expenses_amount(db_name="expenses.db", today=None):
     """
     Calculate the total expenses for the current month.
 
     Args:
         db_name (str): Name of the database file.
+        today (datetime.date): Day whose month is summed (default is today).
 
     Returns:
-        float: Total expenses for the current month.
+        int: Total expenses for the current month, in cents.
     """
     try:
-        with sqlite3.connect(db_name) as conn:
-            cursor = conn.cursor()
-            # Get current month and year
-            current_month = datetime.datetime.now().strftime("%Y-%m")
-            
-            # Query expenses for the current month
-            cursor.execute("""
-                SELECT SUM(CAST(amount AS REAL)) 
-                FROM expenses 
-                WHERE strftime('%Y-%m', date_added) = ?
-            """, (current_month,))
-            total = cursor.fetchone()[0]
-            return total if total else 0.0
+        start, end = _month_bounds(today or datetime.date.today())
+        return _sum_amount_between(db_name, start, end)
     except sqlite3.Error as e:
         print(f"Error calculating monthly expenses: {e}")
-        return 0.0
+        return 0
 
-def get_weekly_expenses_amount(db_name="expenses.db"):
+@timed
+@cached
+def get_weekly_expenses_amount(db_name="expenses.db", today=None):
     """
     Calculate the total expenses amount for the current week (Monday to Sunday).
 
     Args:
         db_name (str): Name of the database file.
+        today (datetime.date): Day whose week is summed (default is today).
 
     Returns:
-        float: Total expenses for the current week.
+        int: Total expenses for the current week, in cents.
     """
     try:
-        with sqlite3.connect(db_name) as conn:
-            cursor = conn.cursor()
-            
-            # Get the current week and year
-            current_year_week = datetime.datetime.now().strftime("%Y-%W")
-            
-            # Query for the total expenses for the current week
-            cursor.execute("""
-                SELECT SUM(CAST(amount AS REAL))
-                FROM expenses
-                WHERE strftime('%Y-%W', date_added) = ?
-            """, (current_year_week,))
-            total = cursor.fetchone()[0]
-            return total if total else 0.0
+        start, end = _week_bounds(today or datetime.date.today())
+        return _sum_amount_between(db_name, start, end)
     except sqlite3.Error as e:
         print(f"Error calculating weekly expenses: {e}")
-        return 0.0
\ No newline at end of file
+        return 0
+
+
+class CategoryTotals(NamedTuple):
+    category: str
+    daily_cents: int
+    weekly_cents: int
+    monthly_cents: int
+
+
+class DashboardSummary(NamedTuple):
+    today: datetime.date
+    daily_cents: int
+    weekly_cents: int
+    monthly_cents: int
+    categories: list  # list[CategoryTotals], largest monthly total first
+    recent_expenses: list  # list[Expense], see `get_recent_and_future_expenses`
+
+
+@timed
+@cached
+def get_dashboard_summary(db_name="expenses.db", today=None):
+    """
+    Compute everything the dashboard shows in one read transaction.
+
+    The daily, weekly and monthly totals and their per-category breakdown
+    come from a single conditional aggregation over the `daily_totals`
+    rollup, covering the union of the current week and month. The recent
+    expenses list is a second query in the same snapshot.
+
+    Args:
+        db_name (str): Name of the database file.
+        today (datetime.date): Reference day (default is today).
+
+    Returns:
+        DashboardSummary: The totals in cents, per-category totals and recent expenses.
+    """
+    today = today or datetime.date.today()
+    week_start, week_end = _week_bounds(today)
+    month_start, month_end = _month_bounds(today)
+    empty = DashboardSummary(today, 0, 0, 0, [], [])
+
+    try:
+        conn = get_connection(db_name)
+        with conn:
+            conn.execute("BEGIN")  # One snapshot for both queries
+            rows = conn.execute("""
+                SELECT category,
+                       SUM(CASE WHEN date = ? THEN total_cents ELSE 0 END),
+                       SUM(CASE WHEN date >= ? AND date < ? THEN total_cents ELSE 0 END),
+                       SUM(CASE WHEN date >= ? AND date < ? THEN total_cents ELSE 0 END)
+                FROM daily_totals
+                WHERE date >= ? AND date < ?
+                GROUP BY category
+            """, (
+                today.isoformat(),
+                week_start.isoformat(), week_end.isoformat(),
+                month_start.isoformat(), month_end.isoformat(),
+                min(week_start, month_start).isoformat(), max(week_end, month_end).isoformat(),
+            )).fetchall()
+            recent_expenses = list(iter_expenses(
+                db_name,
+                start_date=(today - datetime.timedelta(days=7)).isoformat(),
+                sort="date_desc",
+            ))
+    except sqlite3.Error as e:
+        print(f"Error calculating dashboard summary: {e}")
+        return empty
+
+    categories = sorted((CategoryTotals(*row) for row in rows),
+                        key=lambda totals: (-totals.monthly_cents, totals.category))
+    return DashboardSummary(
+        today=today,
+        daily_cents=sum(totals.daily_cents for totals in categories),
+        weekly_cents=sum(totals.weekly_cents for totals in categories),
+        monthly_cents=sum(totals.monthly_cents for totals in categories),
+        categories=categories,
+        recent_expenses=recent_expenses,
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Expense database maintenance.")
+    parser.add_argument("command", choices=["rebuild-daily-totals"])
+    parser.add_argument("db_name", nargs="?", default="expenses.db")
+    args = parser.parse_args()
+
+    initialize_db(args.db_name)
+    if args.command == "rebuild-daily-totals":
+        rebuild_daily_totals(args.db_name)
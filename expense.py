@@ -1,15 +1,113 @@
+import calendar
+import datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+
+RECURRING_SCHEDULES = ("daily", "weekly", "monthly")
+
+
+def to_cents(amount):
+    """
+    Convert an amount such as '12.50', 12.5 or Decimal('12.50') to integer cents.
+
+    Raises:
+        ValueError: If the amount is not a number.
+    """
+    text = str(amount).strip()
+
+    # Fast path for plain amounts such as '12', '12.5' or '12.50'
+    whole, dot, frac = text.partition(".")
+    if whole.isdigit() and whole.isascii() and len(frac) <= 2 and (frac.isdigit() or not dot):
+        return int(whole) * 100 + int(frac.ljust(2, "0"))
+
+    try:
+        value = Decimal(text)
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"Invalid amount: {amount!r}")
+    if not value.is_finite():
+        raise ValueError(f"Invalid amount: {amount!r}")
+    return int((value * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def format_cents(cents):
+    """
+    Format integer cents as a decimal string, e.g. 1250 -> '12.50'.
+    """
+    sign = "-" if cents < 0 else ""
+    whole, frac = divmod(abs(cents), 100)
+    return f"{sign}{whole}.{frac:02d}"
+
+
+def next_occurrence(previous, schedule, anchor_day=None):
+    """
+    Return the occurrence of a recurring expense following `previous`.
+
+    Monthly expenses fall on `anchor_day` (the day of month of the first
+    charge), clamped to the length of the month: an expense first charged
+    on Jan 31 recurs on Feb 28 (or 29), Mar 31, Apr 30 and so on.
+
+    Args:
+        previous (datetime.date): The previous occurrence.
+        schedule (str): One of `RECURRING_SCHEDULES`.
+        anchor_day (int): Day of month for monthly expenses (default is `previous.day`).
+
+    Raises:
+        ValueError: If the schedule is unknown.
+    """
+    if schedule == "daily":
+        return previous + datetime.timedelta(days=1)
+    if schedule == "weekly":
+        return previous + datetime.timedelta(weeks=1)
+    if schedule == "monthly":
+        year, month = divmod(previous.year * 12 + previous.month, 12)  # month is 0-based here
+        last_day = calendar.monthrange(year, month + 1)[1]
+        return previous.replace(year=year, month=month + 1, day=min(anchor_day or previous.day, last_day))
+    raise ValueError(f"Invalid recurring schedule: {schedule!r}")
+
+
 class Expense:
-    def __init__(self, name, category, amount,date_added, recurring=0, recurring_schedule=None):
+    """
+    A single expense as stored in the database.
+
+    Uses `__slots__` instead of a per-instance dict, so large result sets
+    take a fraction of the memory of one dict per row.
+    """
+
+    __slots__ = ("name", "category", "amount_cents", "date_added", "recurring",
+                 "recurring_schedule", "id", "template_id")
+
+    def __init__(self, name, category, amount_cents, date_added, recurring=0, recurring_schedule=None,
+                 id=None, template_id=None):
         """
-        Initialize an Expense object with a name, category, amount, and optional
-        recurring information.
+        Initialize an Expense object with a name, category, amount in integer
+        cents, date (datetime.date), and optional recurring information.
         """
         self.name = name
         self.category = category
-        self.amount = amount
+        self.amount_cents = amount_cents
         self.date_added = date_added
-        self.recurring = recurring  
-        self.recurring_schedule = recurring_schedule 
+        self.recurring = recurring
+        self.recurring_schedule = recurring_schedule
+        self.id = id
+        self.template_id = template_id
+
+    @classmethod
+    def from_row(cls, cursor, row):
+        """
+        SQLite row factory building an Expense from a row of
+        (id, name, category, amount_cents, date_added, recurring, recurring_schedule, template_id).
+        """
+        expense_id, name, category, amount_cents, date_added, recurring, recurring_schedule, template_id = row
+        if date_added is not None:
+            date_added = datetime.date.fromisoformat(date_added)
+        return cls(name, category, amount_cents, date_added, recurring, recurring_schedule, expense_id, template_id)
+
+    @property
+    def amount(self):
+        """
+        The amount as a decimal string, e.g. '12.50'.
+        """
+        return format_cents(self.amount_cents)
 
     def to_dict(self):
         """
@@ -19,11 +117,22 @@ class Expense:
             "name": self.name,
             "category": self.category,
             "amount": self.amount,
-            "date_added": self.date_added,
+            "date_added": self.date_added.isoformat() if self.date_added else None,
             "recurring": self.recurring,
             "recurring_schedule": self.recurring_schedule,
         }
 
+    def _fields(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __eq__(self, other):
+        if not isinstance(other, Expense):
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    def __repr__(self):
+        return f"Expense(id={self.id!r}, name={self.name!r}, amount_cents={self.amount_cents!r}, date_added={self.date_added!r})"
+
     def __str__(self):
         """
         Return a human-readable string representation of the expense.
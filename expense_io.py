@@ -0,0 +1,96 @@
+"""
+Reading and writing expenses in interchange formats (CSV and NDJSON).
+
+Everything here works on iterables of lines or rows so files of any size
+can be streamed through without being loaded into memory.
+"""
+
+import csv
+import io
+import json
+
+
+# Columns of imported/exported CSV files. Imports also accept the
+# `name,category,amount` layout of the original CSV storage.
+CSV_FIELDS = ["name", "category", "amount", "date_added", "recurring", "recurring_schedule"]
+
+# Columns written by exports
+EXPORT_FIELDS = ["id"] + CSV_FIELDS
+
+
+def parse_csv(lines, default_date):
+    """
+    Yield expense dicts from CSV lines with a header row.
+
+    Args:
+        lines (Iterable[str]): The CSV text, line by line.
+        default_date (str): Date used for rows without a 'date_added' (or 'date') column.
+    """
+    for row in csv.DictReader(lines):
+        yield {
+            "name": (row.get("name") or "").strip(),
+            "category": (row.get("category") or "").strip(),
+            "amount": row.get("amount"),
+            "date_added": (row.get("date_added") or row.get("date") or default_date).strip(),
+            "recurring": (row.get("recurring") or "0").strip(),
+            "recurring_schedule": (row.get("recurring_schedule") or "").strip() or None,
+        }
+
+
+def parse_ndjson(lines, default_date):
+    """
+    Yield expense dicts from newline-delimited JSON, one object per line.
+
+    Blank lines are skipped. A line that is not valid JSON is yielded as is
+    so the storage layer reports it as an invalid expense.
+
+    Args:
+        lines (Iterable[str]): The NDJSON text, line by line.
+        default_date (str): Date used for objects without 'date_added'.
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            expense = json.loads(line)
+        except ValueError:
+            yield line
+            continue
+        if isinstance(expense, dict):
+            expense.setdefault("date_added", default_date)
+        yield expense
+
+
+def _export_record(expense):
+    return {
+        "id": expense.id,
+        "name": expense.name,
+        "category": expense.category,
+        "amount": expense.amount,
+        "date_added": expense.date_added.isoformat() if expense.date_added else None,
+        "recurring": expense.recurring,
+        "recurring_schedule": expense.recurring_schedule,
+    }
+
+
+def to_csv(expenses):
+    """
+    Yield CSV lines (header first) for an iterable of expenses.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for expense in expenses:
+        writer.writerow(_export_record(expense))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def to_ndjson(expenses):
+    """
+    Yield one JSON line per expense.
+    """
+    for expense in expenses:
+        yield json.dumps(_export_record(expense), separators=(",", ":")) + "\n"
@@ -0,0 +1,129 @@
+"""
+Request parsing and response encoding shared by the HTML and JSON routes.
+"""
+
+import zlib
+from datetime import date
+
+from werkzeug.exceptions import Unauthorized
+
+from db_storage import EXPENSE_SORTS
+from expense import to_cents
+
+
+# Content codings we can produce, in order of preference
+COMPRESSIONS = ("gzip", "deflate")
+
+# Responses smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 1024
+
+# Header carrying the ID of the signed-in user, set by the authenticating proxy
+USER_HEADER = "X-User-Id"
+
+# zlib `wbits` for each content coding: 31 writes a gzip container, 15 a zlib stream
+_WBITS = {"gzip": 31, "deflate": 15}
+
+
+def request_db_name(request, config):
+    """
+    Return the database serving `request`.
+
+    Without a `SHARD_ROUTER` in the app config that is the single
+    `DB_NAME`; with one, it is the database of the user named by the
+    `USER_HEADER` header.
+
+    Raises:
+        Unauthorized: If sharding is enabled and the request names no user.
+    """
+    router = config.get("SHARD_ROUTER")
+    if router is None:
+        return config["DB_NAME"]
+    user_id = request.headers.get(USER_HEADER)
+    if not user_id:
+        raise Unauthorized(f"The {USER_HEADER} header is required.")
+    return router.db_name(user_id)
+
+
+def parse_expense_filters(args):
+    """
+    Translate query string filters into `read_expenses` keyword arguments.
+
+    Recognised parameters: start, end, category, recurring, min_amount,
+    max_amount, q (full-text search) and sort. Empty values are ignored.
+
+    Raises:
+        ValueError: If a value is malformed.
+    """
+    filters = {}
+    if args.get("start"):
+        filters["start_date"] = date.fromisoformat(args["start"])
+    if args.get("end"):
+        filters["end_date"] = date.fromisoformat(args["end"])
+    if args.get("category"):
+        filters["category"] = args["category"]
+    if args.get("recurring") in ("0", "1"):
+        filters["recurring"] = int(args["recurring"])
+    if args.get("min_amount"):
+        filters["min_amount_cents"] = to_cents(args["min_amount"])
+    if args.get("max_amount"):
+        filters["max_amount_cents"] = to_cents(args["max_amount"])
+    if args.get("q"):
+        filters["search"] = args["q"]
+    sort = args.get("sort") or "date_desc"
+    if sort not in EXPENSE_SORTS:
+        raise ValueError(f"Invalid sort: {sort!r}")
+    filters["sort"] = sort
+    return filters
+
+
+def negotiate_encoding(request):
+    """
+    Return the preferred content coding the client accepts, or None.
+    """
+    return request.accept_encodings.best_match(COMPRESSIONS)
+
+
+def chunked(lines, size):
+    """
+    Join small strings into encoded chunks of roughly `size` bytes.
+    """
+    buffer, buffered = [], 0
+    for line in lines:
+        buffer.append(line)
+        buffered += len(line)
+        if buffered >= size:
+            yield "".join(buffer).encode("utf-8")
+            buffer, buffered = [], 0
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
+
+
+def compressed(chunks, encoding="gzip"):
+    """
+    Compress a stream of byte chunks on the fly.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, _WBITS[encoding])
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def compress_response(response, encoding):
+    """
+    Compress a buffered response in place when it is large enough.
+
+    Args:
+        response (flask.Response): A non-streamed response.
+        encoding (str): 'gzip', 'deflate' or None for no compression.
+
+    Returns:
+        flask.Response: The same response.
+    """
+    response.vary.add("Accept-Encoding")
+    if encoding is None or response.content_length < MIN_COMPRESS_BYTES:
+        return response
+    response.set_data(b"".join(compressed([response.get_data()], encoding)))
+    response.headers["Content-Encoding"] = encoding
+    return response
@@ -0,0 +1,461 @@
+"""
+Timing and error instrumentation with a Prometheus text exposition.
+
+What is measured:
+
+* every SQL statement run through a storage connection: execute time,
+  rows fetched or changed, SQLITE_BUSY and other SQLite errors, and the
+  time spent waiting for the write lock in `BEGIN IMMEDIATE`;
+* every storage function decorated with `timed`;
+* every Flask request, by route, method and status (`init_app`);
+* the group commits of the write queue (`write_queue`);
+* the copies made for, and the reads served by, in-memory snapshots
+  (`db_snapshot`).
+
+Statements are labelled by their fingerprint: the SQL with literals
+replaced by `?`, lists of placeholders collapsed and whitespace squeezed,
+so the label does not depend on the values. Past `MAX_STATEMENT_LABELS`
+distinct fingerprints, further statements are counted as 'other'.
+Statements slower than `SLOW_QUERY_SECONDS` are logged. Statement times
+cover `execute` only: for a query that streams its rows, the work done
+while fetching is not included.
+
+Each thread records into its own accumulator, without taking a lock; they
+are summed when the metrics are read. Each worker process writes a
+snapshot to `<directory>/<pid>.json` at most every `FLUSH_INTERVAL_SECONDS`.
+`render` merges the snapshots of all processes, so any worker can answer a
+scrape for the whole deployment; the snapshots of processes that have
+exited are deleted then, and when a worker starts.
+"""
+
+import bisect
+import functools
+import glob
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# Statements slower than this are logged; overridable with EXPENSES_SLOW_QUERY_MS
+SLOW_QUERY_SECONDS = float(os.environ.get("EXPENSES_SLOW_QUERY_MS", 250)) / 1000
+
+# Minimum time between two snapshots of a process's metrics
+FLUSH_INTERVAL_SECONDS = 1.0
+
+# Distinct statement labels per process; statements past them are labelled 'other'
+MAX_STATEMENT_LABELS = 500
+
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Histogram bucket upper bounds for group commit sizes
+GROUP_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+# name -> (type, help, bucket bounds or None)
+METRICS = {
+    "sqlite_statement_seconds": ("histogram", "Time to execute a SQL statement.", LATENCY_BUCKETS),
+    "sqlite_rows_total": ("counter", "Rows fetched or changed by a SQL statement.", None),
+    "sqlite_lock_wait_seconds": ("histogram", "Time spent acquiring the write lock (BEGIN IMMEDIATE).",
+                                 LATENCY_BUCKETS),
+    "sqlite_busy_total": ("counter", "Statements that failed with SQLITE_BUSY or SQLITE_LOCKED.", None),
+    "sqlite_errors_total": ("counter", "Statements that failed with a SQLite error, by error name.", None),
+    "sqlite_slow_statements_total": ("counter", "Statements slower than the slow query threshold.", None),
+    "sqlite_connections_evicted_total": ("counter", "Idle connections closed to stay under the per-thread limit.",
+                                         None),
+    "storage_call_seconds": ("histogram", "Time spent in a storage function.", LATENCY_BUCKETS),
+    "storage_errors_total": ("counter", "Storage function calls that raised.", None),
+    "http_request_duration_seconds": ("histogram", "Time to produce an HTTP response.", LATENCY_BUCKETS),
+    "write_queue_group_size": ("histogram", "Expenses committed together by the write queue.", GROUP_SIZE_BUCKETS),
+    "write_queue_wait_seconds": ("histogram", "Time from queueing an expense to its commit.", LATENCY_BUCKETS),
+    "snapshot_copy_seconds": ("histogram", "Time to copy a database into a new in-memory snapshot.",
+                              LATENCY_BUCKETS),
+    "snapshot_reads_total": ("counter", "Reads that could use a snapshot, by where they were served from.", None),
+}
+
+_BUSY_CODES = {sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED}
+
+
+def _accumulate(total, values):
+    """
+    Add `values` ({name: {labels: value}}) to `total`, in place.
+    """
+    for name, series in values.items():
+        target = total[name]
+        # A copy, as the thread owning `values` may be adding a series
+        for labels, value in list(series.items()):
+            if isinstance(value, list):
+                current = target.get(labels)
+                if current is None:
+                    target[labels] = list(value)
+                else:
+                    target[labels] = [a + b for a, b in zip(current, value)]
+            else:
+                target[labels] = target.get(labels, 0) + value
+
+
+class Registry:
+    """
+    The metrics of one process.
+
+    Counters are stored as {name: {labels: value}} and histograms as
+    {name: {labels: [bucket counts..., sum, count]}}, where `labels` is a
+    tuple of (label, value) pairs. Every thread has its own such dict, which
+    only it writes to; `values` sums them.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def _thread_values(self):
+        values = getattr(self._local, "values", None)
+        if values is None:
+            values = self._local.values = {name: {} for name in METRICS}
+            with self._lock:
+                self._threads.append((threading.current_thread(), values))
+        return values
+
+    def inc(self, name, labels=(), amount=1):
+        series = self._thread_values()[name]
+        series[labels] = series.get(labels, 0) + amount
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        series = self._thread_values()[name]
+        counts = series.get(labels)
+        if counts is None:
+            counts = series[labels] = [0] * (len(buckets) + 3)
+        counts[bisect.bisect_left(buckets, value)] += 1  # The last bucket is +Inf
+        counts[-2] += value
+        counts[-1] += 1
+
+    def values(self):
+        """
+        Return the sum of every thread's metrics, as {name: {labels: value}}.
+        """
+        with self._lock:
+            running = []
+            for thread, values in self._threads:
+                if thread.is_alive():
+                    running.append((thread, values))
+                else:
+                    _accumulate(self._exited, values)  # Final: fold it in once and let it go
+            self._threads = running
+            total = {name: {} for name in METRICS}
+            _accumulate(total, self._exited)
+        for thread, values in running:
+            _accumulate(total, values)
+        return total
+
+    def snapshot(self):
+        """
+        Return the metrics as a JSON-serialisable dict.
+        """
+        return {
+            name: [[list(labels), value if isinstance(value, (int, float)) else list(value)]
+                   for labels, value in series.items()]
+            for name, series in self.values().items()
+        }
+
+    def reset(self):
+        """
+        Forget everything; used in a freshly forked process, so the lock is replaced too.
+        """
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._threads = []  # (thread, its values) of every live thread that recorded something
+        self._exited = {name: {} for name in METRICS}  # Sum of the values of threads that have exited
+        self._last_flush = 0.0
+
+    def flush(self, directory, force=False):
+        """
+        Write this process's snapshot to `directory`, unless one was written recently.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_flush < FLUSH_INTERVAL_SECONDS:
+            return
+        self._last_flush = now
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        partial = f"{path}.{threading.get_ident()}.tmp"
+        with open(partial, "w") as file:
+            json.dump(self.snapshot(), file)
+        os.replace(partial, path)
+
+
+registry = Registry()
+
+# Snapshot directory of this process, set by `init_app`
+_directory = None
+
+
+if hasattr(os, "register_at_fork"):
+    # A forked worker must not report the parent's measurements as its own
+    os.register_at_fork(after_in_child=registry.reset)
+
+
+_statement_labels = set()
+_statement_labels_lock = threading.Lock()
+
+_FINGERPRINT_PATTERNS = [
+    (re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL), " "),  # Comments
+    (re.compile(r"'(?:[^']|'')*'"), "?"),  # String literals
+    (re.compile(r"\?\d+|(?<![\w.])\d+(?:\.\d+)?(?:e[+-]?\d+)?\b", re.IGNORECASE), "?"),  # Numbers
+    (re.compile(r"\s+"), " "),
+    (re.compile(r"\(\s?\?(?:\s?,\s?\?)*\s?\)"), "(?)"),  # IN lists and VALUES rows
+    (re.compile(r"\(\?\)(?:\s?,\s?\(\?\))+"), "(?)"),  # Multi-row VALUES
+]
+
+
+def _fingerprint(sql):
+    """
+    Return `sql` with literals replaced by `?`, placeholder lists collapsed and whitespace squeezed.
+    """
+    for pattern, replacement in _FINGERPRINT_PATTERNS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+@functools.lru_cache(maxsize=512)
+def _statement_label(sql):
+    """
+    Return the label of a statement: its fingerprint, or 'other' once
+    `MAX_STATEMENT_LABELS` fingerprints have been handed out.
+    """
+    fingerprint = _fingerprint(sql)
+    with _statement_labels_lock:
+        if fingerprint not in _statement_labels:
+            if len(_statement_labels) >= MAX_STATEMENT_LABELS:
+                return "other"
+            _statement_labels.add(fingerprint)
+    return fingerprint
+
+
+def _record(sql, started, rows=0, error=None):
+    elapsed = time.perf_counter() - started
+    statement = _statement_label(sql)
+    labels = (("statement", statement),)
+    if statement.upper().startswith("BEGIN IMMEDIATE"):
+        registry.observe("sqlite_lock_wait_seconds", (), elapsed)
+    registry.observe("sqlite_statement_seconds", labels, elapsed)
+    if rows > 0:
+        registry.inc("sqlite_rows_total", labels, rows)
+    if error is not None:
+        if getattr(error, "sqlite_errorcode", None) in _BUSY_CODES:
+            registry.inc("sqlite_busy_total", labels)
+        registry.inc("sqlite_errors_total", (("error", getattr(error, "sqlite_errorname", type(error).__name__)),))
+    if elapsed >= SLOW_QUERY_SECONDS:
+        registry.inc("sqlite_slow_statements_total", labels)
+        logger.warning("Slow SQL statement (%.1f ms): %s", elapsed * 1000, _fingerprint(sql))
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    A cursor that records the time, rows and errors of its statements.
+    """
+
+    _sql = ""
+
+    def execute(self, sql, parameters=()):
+        self._sql = sql
+        started = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        except sqlite3.Error as e:
+            _record(sql, started, error=e)
+            raise
+        _record(sql, started, rows=self.rowcount)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._sql = sql
+        started = time.perf_counter()
+        try:
+            super().executemany(sql, seq_of_parameters)
+        except sqlite3.Error as e:
+            _record(sql, started, error=e)
+            raise
+        _record(sql, started, rows=self.rowcount)
+        return self
+
+    def _count(self, rows):
+        if rows:
+            registry.inc("sqlite_rows_total", (("statement", _statement_label(self._sql)),), len(rows))
+        return rows
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            registry.inc("sqlite_rows_total", (("statement", _statement_label(self._sql)),))
+        return row
+
+    def fetchmany(self, size=None):
+        return self._count(super().fetchmany(self.arraysize if size is None else size))
+
+    def fetchall(self):
+        return self._count(super().fetchall())
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """
+    A connection whose statements all go through `InstrumentedCursor`.
+    """
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def timed(func):
+    """
+    Record the duration of every call to a storage function, and the calls that raise.
+    """
+    labels = (("function", func.__name__),)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            registry.inc("storage_errors_total", labels)
+            raise
+        finally:
+            registry.observe("storage_call_seconds", labels, time.perf_counter() - started)
+
+    return wrapper
+
+
+def init_app(app, directory):
+    """
+    Time every request of `app` and share this process's metrics through `directory`.
+    """
+    from flask import g, request
+
+    global _directory
+    _directory = directory
+    _remove_exited(directory)
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop("metrics_started", None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            labels = (("method", request.method), ("route", route), ("status", str(response.status_code)))
+            registry.observe("http_request_duration_seconds", labels, time.perf_counter() - started)
+        try:
+            registry.flush(directory)
+        except OSError as e:
+            logger.warning("Could not write metrics snapshot: %s", e)
+        return response
+
+
+def _process_exists(pid):
+    if os.name != "posix":
+        return True  # os.kill(pid, 0) would terminate the process on Windows
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # Exists, but belongs to another user
+    return True
+
+
+def _remove_exited(directory):
+    """
+    Delete the snapshots, and unfinished writes, of processes that have exited.
+    """
+    for path in glob.glob(os.path.join(directory, "*.json*")):
+        pid = os.path.basename(path).split(".", 1)[0]
+        if pid.isdigit() and not _process_exists(int(pid)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # Removed by another worker
+
+
+def _merge(snapshots):
+    """
+    Sum the counters and histogram buckets of several snapshots.
+    """
+    merged = {name: {} for name in METRICS}
+    for snapshot in snapshots:
+        for name, series in snapshot.items():
+            if name not in merged:
+                continue  # Written by another version of this module
+            for labels, value in series:
+                key = tuple(tuple(pair) for pair in labels)
+                if isinstance(value, list):
+                    current = merged[name].setdefault(key, [0] * len(value))
+                    merged[name][key] = [a + b for a, b in zip(current, value)]
+                else:
+                    merged[name][key] = merged[name].get(key, 0) + value
+    return merged
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(directory=None):
+    """
+    Return the metrics of every process sharing `directory` in the Prometheus text format.
+
+    Without a directory (and before `init_app`) only this process is reported.
+    """
+    directory = directory or _directory
+    snapshots = []
+    if directory is not None:
+        registry.flush(directory, force=True)
+        _remove_exited(directory)
+        for path in glob.glob(os.path.join(directory, "*.json")):
+            try:
+                with open(path) as file:
+                    snapshots.append(json.load(file))
+            except (OSError, ValueError):
+                continue  # Being replaced, or removed, by its process
+    else:
+        snapshots.append(registry.snapshot())
+
+    lines = []
+    for name, series in _merge(snapshots).items():
+        kind, help_text, buckets = METRICS[name]
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(series.items()):
+            if kind == "counter":
+                lines.append(f"{name}{_format_labels(labels)} {_format_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + ("+Inf",), value[:-2]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_number(value[-2])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {value[-1]}")
+    return "\n".join(lines) + "\n"
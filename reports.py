@@ -0,0 +1,257 @@
+"""
+Month-end reports over many expense databases at once.
+
+`python reports.py` takes any number of database files (one per user or
+tenant), or every user's database of a shard directory, and computes for
+each the spending per month and per category and its recurring expenses
+over a date range. Databases are reported in parallel by a pool of worker
+processes, handed out `--chunksize` at a time, so a run over thousands of
+small databases keeps every core busy. The per-database reports and their
+totals are written as one JSON document, or as CSV rows.
+
+Reports read the `daily_totals` rollup, so their cost depends on the
+length of the range rather than on the number of expenses, and include
+archived years (see archive.py). Databases are opened read-only, one at a
+time per worker, and never migrated; a database that cannot be read is
+listed with its error and makes the run exit with status 1.
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import csv
+import datetime
+import functools
+import json
+import os
+import sqlite3
+import sys
+import urllib.request
+
+import archive
+from shards import ShardRouter
+
+
+def _previous_month(today):
+    """
+    Return the first and last day of the month before `today`.
+    """
+    end = today.replace(day=1) - datetime.timedelta(days=1)
+    return end.replace(day=1), end
+
+
+def _add_totals(totals, key, total_cents, count):
+    entry = totals.setdefault(key, {"total_cents": 0, "count": 0})
+    entry["total_cents"] += total_cents
+    entry["count"] += count
+
+
+def _generated_charges(conn, start, end):
+    """
+    Return the count and total of the charges generated from recurring templates in [start, end].
+    """
+    count, total = conn.execute("""
+        SELECT COUNT(*), COALESCE(SUM(amount_cents), 0)
+        FROM expenses
+        WHERE template_id IS NOT NULL AND date_added >= ? AND date_added <= ?
+    """, (start.isoformat(), end.isoformat())).fetchone()
+    low, high = start.toordinal(), end.toordinal()
+    for year in archive.archived_years(conn, start, end + datetime.timedelta(days=1)):
+        columns = year.load().columns
+        for day, template_id, amount in zip(columns["day"], columns["template_id"], columns["amount_cents"]):
+            if template_id and low <= day <= high:
+                count, total = count + 1, total + amount
+    return count, total
+
+
+def report_database(db_name, start, end):
+    """
+    Compute the report of one database for the days from `start` to `end`.
+
+    Args:
+        db_name (str): The database file.
+        start (datetime.date): First day of the range.
+        end (datetime.date): Last day of the range.
+
+    Returns:
+        dict: 'database', 'total_cents', 'count', 'months' and 'categories'
+        (each {key: {'total_cents', 'count'}}) and 'recurring' (the active
+        templates, and the count and total of the charges generated in the
+        range); or 'database' and 'error' if it could not be read.
+    """
+    uri = f"file:{urllib.request.pathname2url(os.path.abspath(db_name))}?mode=ro"
+    try:
+        conn = sqlite3.connect(uri, uri=True)
+    except sqlite3.Error as e:
+        return {"database": db_name, "error": str(e)}
+    try:
+        with conn:
+            conn.execute("BEGIN")  # One snapshot for every query
+            rollup = conn.execute("""
+                SELECT substr(date, 1, 7), category, SUM(total_cents), SUM(count)
+                FROM daily_totals
+                WHERE date >= ? AND date <= ?
+                GROUP BY 1, 2
+            """, (start.isoformat(), end.isoformat())).fetchall()
+            templates = conn.execute("""
+                SELECT id, name, category, amount_cents, recurring_schedule, next_due
+                FROM expenses
+                WHERE recurring = 1
+                ORDER BY id
+            """).fetchall()
+            generated_count, generated_cents = _generated_charges(conn, start, end)
+    except (sqlite3.Error, archive.ArchiveError) as e:
+        return {"database": db_name, "error": str(e)}
+    finally:
+        conn.close()
+
+    months, categories = {}, {}
+    for month, category, total_cents, count in rollup:
+        _add_totals(months, month, total_cents, count)
+        _add_totals(categories, category, total_cents, count)
+    return {
+        "database": db_name,
+        "total_cents": sum(entry["total_cents"] for entry in months.values()),
+        "count": sum(entry["count"] for entry in months.values()),
+        "months": dict(sorted(months.items())),
+        "categories": dict(sorted(categories.items(), key=lambda item: (-item[1]["total_cents"], item[0]))),
+        "recurring": {
+            "templates": [
+                {"id": template_id, "name": name, "category": category, "amount_cents": amount_cents,
+                 "schedule": schedule, "next_due": next_due}
+                for template_id, name, category, amount_cents, schedule, next_due in templates
+            ],
+            "generated_count": generated_count,
+            "generated_cents": generated_cents,
+        },
+    }
+
+
+def _default_chunksize(databases, workers):
+    # About four chunks per worker, as multiprocessing.Pool.map picks
+    return max(1, -(-databases // (workers * 4)))
+
+
+def generate_reports(db_names, start, end, workers=None, chunksize=None):
+    """
+    Report every database of `db_names`, in parallel.
+
+    Args:
+        db_names (list[str]): The database files.
+        start (datetime.date): First day of the range.
+        end (datetime.date): Last day of the range.
+        workers (int): Worker processes (default is one per CPU). With 1,
+            the databases are reported in this process.
+        chunksize (int): Databases handed to a worker at a time (default
+            is about four chunks per worker).
+
+    Returns:
+        dict: The range, the reports in the order of `db_names` and their
+        'totals' (like a report, with the number of 'databases' and
+        'templates' instead of the template list), and the 'errors'.
+    """
+    workers = workers or os.cpu_count() or 1
+    report = functools.partial(report_database, start=start, end=end)
+    if workers == 1 or len(db_names) <= 1:
+        reports = map(report, db_names)
+        executor = None
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(db_names)))
+        reports = executor.map(report, db_names,
+                               chunksize=chunksize or _default_chunksize(len(db_names), workers))
+
+    totals = {"databases": 0, "total_cents": 0, "count": 0, "months": {}, "categories": {},
+              "recurring": {"templates": 0, "generated_count": 0, "generated_cents": 0}}
+    databases, errors = [], []
+    try:
+        for result in reports:
+            if "error" in result:
+                errors.append(result)
+                continue
+            databases.append(result)
+            totals["databases"] += 1
+            totals["total_cents"] += result["total_cents"]
+            totals["count"] += result["count"]
+            for section in ("months", "categories"):
+                for key, entry in result[section].items():
+                    _add_totals(totals[section], key, entry["total_cents"], entry["count"])
+            recurring = result["recurring"]
+            totals["recurring"]["templates"] += len(recurring["templates"])
+            totals["recurring"]["generated_count"] += recurring["generated_count"]
+            totals["recurring"]["generated_cents"] += recurring["generated_cents"]
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    totals["months"] = dict(sorted(totals["months"].items()))
+    totals["categories"] = dict(sorted(totals["categories"].items(),
+                                       key=lambda item: (-item[1]["total_cents"], item[0])))
+    return {"start": start.isoformat(), "end": end.isoformat(), "totals": totals,
+            "databases": databases, "errors": errors}
+
+
+def write_csv(document, file):
+    """
+    Write a `generate_reports` document as CSV: one row per database (or
+    'TOTAL'), section ('month', 'category', 'recurring' or 'error') and key.
+    """
+    writer = csv.writer(file)
+    writer.writerow(["database", "section", "key", "total_cents", "count"])
+
+    def write_report(database, report):
+        for section, entries in (("month", report["months"]), ("category", report["categories"])):
+            for key, entry in entries.items():
+                writer.writerow([database, section, key, entry["total_cents"], entry["count"]])
+        recurring = report["recurring"]
+        writer.writerow([database, "recurring", "generated", recurring["generated_cents"],
+                         recurring["generated_count"]])
+
+    for report in document["databases"]:
+        write_report(report["database"], report)
+    write_report("TOTAL", document["totals"])
+    for error in document["errors"]:
+        writer.writerow([error["database"], "error", error["error"], "", ""])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report the spending of many expense databases in parallel.")
+    parser.add_argument("databases", nargs="*", help="The database files to report.")
+    parser.add_argument("--shard-dir", default=os.environ.get("EXPENSES_SHARD_DIR"),
+                        help="Also report every user's database in this directory.")
+    parser.add_argument("--start", type=datetime.date.fromisoformat,
+                        help="First day to report (default: the first day of last month).")
+    parser.add_argument("--end", type=datetime.date.fromisoformat,
+                        help="Last day to report (default: the last day of last month).")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: one per CPU).")
+    parser.add_argument("--chunksize", type=int,
+                        help="Databases handed to a worker at a time (default: about four chunks per worker).")
+    parser.add_argument("--format", choices=["json", "csv"], default="json")
+    parser.add_argument("--output", help="Write the report to this file (default: standard output).")
+    args = parser.parse_args(argv)
+
+    db_names = list(args.databases)
+    if args.shard_dir:
+        db_names += ShardRouter(args.shard_dir).db_names()
+    if not db_names:
+        parser.error("no databases to report")
+    if (args.workers is not None and args.workers < 1) or (args.chunksize is not None and args.chunksize < 1):
+        parser.error("--workers and --chunksize must be at least 1")
+    default_start, default_end = _previous_month(datetime.date.today())
+    start, end = args.start or default_start, args.end or default_end
+    if start > end:
+        parser.error("--start must not be after --end")
+
+    document = generate_reports(db_names, start, end, args.workers, args.chunksize)
+    with open(args.output, "w", newline="") if args.output else contextlib.nullcontext(sys.stdout) as file:
+        if args.format == "csv":
+            write_csv(document, file)
+        else:
+            json.dump(document, file, indent=2)
+            file.write("\n")
+    for error in document["errors"]:
+        print(f"Error reporting {error['database']}: {error['error']}", file=sys.stderr)
+    return 1 if document["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""
+Background scheduler that materialises recurring expenses.
+
+Every worker process starts a `RecurringScheduler`, but only the one
+holding an exclusive lock on `<db_name>.scheduler.lock` runs the job on its
+interval. If that worker exits, its lock is released and another worker
+takes over at its next tick. Run bookkeeping is stored in the database so
+any worker can report it.
+"""
+
+import datetime
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from db_storage import process_recurring_expenses, record_job_run, get_job_runs
+
+
+JOB_NAME = "process_recurring_expenses"
+
+# Seconds between runs; overridable with the EXPENSES_RECURRING_INTERVAL environment variable
+RECURRING_INTERVAL_SECONDS = 3600
+
+
+def _try_lock(file):
+    """
+    Try to take an exclusive, non-blocking lock on an open file.
+    """
+    try:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+
+
+class RecurringScheduler:
+    """
+    Runs `process_recurring_expenses` on a background thread.
+
+    The job runs at startup and then every `interval` seconds, on the
+    worker that holds the scheduler lock. `run_now` makes the job run on
+    this worker right away, lock or not; the job itself is safe to run
+    concurrently.
+
+    The job runs on `db_name`, which also holds the run bookkeeping, or on
+    every database returned by `databases` (e.g. `ShardRouter.db_names`).
+    """
+
+    def __init__(self, db_name="expenses.db", interval=RECURRING_INTERVAL_SECONDS, lock_path=None, databases=None):
+        self.db_name = db_name
+        self.databases = databases or (lambda: [db_name])
+        self.interval = interval
+        self.lock_path = lock_path or f"{db_name}.scheduler.lock"
+        self._lock_file = None
+        self._thread = None
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._run_requested = False
+
+    @property
+    def is_leader(self):
+        return self._lock_file is not None
+
+    def _acquire_leadership(self):
+        if self._lock_file is None:
+            lock_file = open(self.lock_path, "a+")
+            if _try_lock(lock_file):
+                self._lock_file = lock_file  # Held until the process exits
+            else:
+                lock_file.close()
+        return self.is_leader
+
+    def start(self):
+        """
+        Start the background thread (once).
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="recurring-scheduler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run_now(self):
+        """
+        Ask the background thread to run the job as soon as possible.
+        """
+        self._run_requested = True
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            requested, self._run_requested = self._run_requested, False
+            if requested or self._acquire_leadership():
+                self.run_once()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def run_once(self):
+        """
+        Run the job in the calling thread and record the run.
+
+        Returns:
+            int: The number of recurring occurrences added.
+        """
+        started_at, start = _now(), time.perf_counter()
+        added = sum(process_recurring_expenses(db_name) for db_name in self.databases())
+        duration_ms = (time.perf_counter() - start) * 1000
+        record_job_run(JOB_NAME, started_at, _now(), duration_ms, f"{added} added", self.db_name)
+        return added
+
+    def status(self):
+        """
+        Return the scheduler's state in this worker and the last recorded run.
+        """
+        return {
+            "interval_seconds": self.interval,
+            "running": self._thread is not None and self._thread.is_alive(),
+            "leader": self.is_leader,
+            "pid": os.getpid(),
+            "last_run": get_job_runs(self.db_name).get(JOB_NAME),
+        }
@@ -0,0 +1,72 @@
+"""
+Per-user databases.
+
+With sharding enabled (`EXPENSES_SHARD_DIR`), every user's expenses live in
+their own SQLite file. Separate files have separate write locks, so one
+user's import never holds up another user's inserts, and every query only
+ever sees that user's rows. The `db_storage` functions need no changes:
+the path returned by `ShardRouter.db_name` is the shard context they take
+as `db_name`.
+
+Files are named after a hash of the user ID, fanned out over 256
+subdirectories, so any ID maps to a safe, case-insensitively unique file
+name and no directory grows too large.
+"""
+
+import glob
+import hashlib
+import os
+import threading
+
+from db_storage import initialize_db
+
+
+class ShardRouter:
+    """
+    Maps user IDs to their database files, creating each file on first use.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._ready = set()  # Databases initialised by this process
+
+    def path(self, user_id):
+        """
+        Return the database file of `user_id`, without creating it.
+
+        Raises:
+            ValueError: If the user ID is empty.
+        """
+        if not user_id:
+            raise ValueError("A user ID is required.")
+        digest = hashlib.sha256(user_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest[:2], f"{digest[2:34]}.db")
+
+    def db_name(self, user_id):
+        """
+        Return the database of `user_id`, creating or migrating it on first use.
+
+        Args:
+            user_id (str): The ID of the user.
+
+        Returns:
+            str: The database file name to pass to the `db_storage` functions.
+
+        Raises:
+            ValueError: If the user ID is empty.
+        """
+        path = self.path(user_id)
+        if path not in self._ready:
+            with self._lock:
+                if path not in self._ready:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    initialize_db(path)
+                    self._ready.add(path)
+        return path
+
+    def db_names(self):
+        """
+        Return the databases of every user who has one, e.g. for background jobs.
+        """
+        return sorted(glob.glob(os.path.join(self.directory, "*", "*.db")))
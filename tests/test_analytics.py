@@ -0,0 +1,106 @@
+import os
+import unittest
+from datetime import date
+from unittest.mock import patch
+
+import analytics
+from analytics import spending_trends
+from db_connection import close_connections, get_connection
+from db_storage import initialize_db, write_expenses
+
+
+class TestSpendingTrends(unittest.TestCase):
+    TEST_DB = "test_analytics.db"
+
+    def setUp(self):
+        initialize_db(self.TEST_DB)
+        write_expenses([
+            {"name": "Rent", "category": "Housing", "amount": "900", "date_added": "2025-01-01"},
+            {"name": "Lunch", "category": "Food", "amount": "12.50", "date_added": "2025-01-20"},
+            {"name": "Rent", "category": "Housing", "amount": "900", "date_added": "2025-02-01"},
+            {"name": "Groceries", "category": "Food", "amount": "60", "date_added": "2025-02-03"},
+            {"name": "Bus", "category": "Transport", "amount": "3", "date_added": "2025-02-03"},
+            {"name": "Coffee", "category": "Food", "amount": "4.50", "date_added": "2025-02-10"},
+        ], self.TEST_DB)
+
+    def tearDown(self):
+        close_connections()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.TEST_DB + suffix):
+                os.remove(self.TEST_DB + suffix)
+
+    def _trends(self, **kwargs):
+        # Bypass the query cache so each backend computes its own result
+        return spending_trends.__wrapped__(self.TEST_DB, **kwargs)
+
+    def test_totals_deltas_and_projection(self):
+        trends = self._trends(start_date=date(2025, 2, 1), end_date=date(2025, 2, 14))
+
+        self.assertEqual(trends["total_cents"], 96750)
+        self.assertEqual(trends["count"], 4)
+        self.assertEqual([(c["category"], c["total_cents"]) for c in trends["categories"]],
+                         [("Housing", 90000), ("Food", 6450), ("Transport", 300)])
+
+        (february,) = trends["months"]
+        self.assertEqual(february, {"month": "2025-02", "total_cents": 96750,
+                                    "change_cents": 96750 - 91250, "change_ratio": 0.0603})
+
+        self.assertEqual(len(trends["days"]), 14)
+        self.assertEqual(trends["days"][2], {"date": "2025-02-03", "total_cents": 6300,
+                                             "avg_7d_cents": 13757.14, "avg_30d_cents": 3251.67})
+        # The 30 day window reaches back into January
+        self.assertEqual(trends["days"][-1]["avg_30d_cents"], round((1250 + 96750) / 30, 2))
+
+        projection = trends["projection"]
+        self.assertEqual(projection["days_left"], 14)
+        self.assertEqual(projection["projected_cents"], 96750 + round(98000 / 30 * 14))
+
+    def test_percentiles_of_amounts_in_range(self):
+        trends = self._trends(start_date=date(2025, 1, 1), end_date=date(2025, 2, 28))
+        self.assertEqual(trends["percentiles_cents"],
+                         {"p50": 1250, "p75": 90000, "p90": 90000, "p95": 90000, "p99": 90000})
+
+        empty = self._trends(start_date=date(2024, 1, 1), end_date=date(2024, 1, 31))
+        self.assertEqual(empty["total_cents"], 0)
+        self.assertIsNone(empty["percentiles_cents"]["p50"])
+        self.assertEqual(empty["projection"]["projected_cents"], 0)
+
+    def test_fallback_matches_numpy(self):
+        kwargs = {"start_date": date(2025, 1, 5), "end_date": date(2025, 3, 10)}
+        with patch.object(analytics, "np", None):
+            fallback = self._trends(**kwargs)
+        if analytics.np is None:
+            self.skipTest("NumPy is not installed")
+        self.assertEqual(self._trends(**kwargs), fallback)
+
+    def test_default_range_ends_today(self):
+        trends = spending_trends(self.TEST_DB, today=date(2025, 2, 10))
+        self.assertEqual(trends["end"], "2025-02-10")
+        self.assertEqual(len(trends["days"]), analytics.DEFAULT_RANGE_DAYS)
+        self.assertEqual(trends["total_cents"], 180000 + 1250 + 6450 + 300)
+
+    def test_reads_only_the_rollup_and_an_index(self):
+        conn = get_connection(self.TEST_DB)
+        statements = []
+        conn.set_trace_callback(statements.append)
+        try:
+            self._trends(start_date=date(2025, 1, 1), end_date=date(2025, 12, 31))
+        finally:
+            conn.set_trace_callback(None)
+        plans = [
+            " | ".join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql))
+            for sql in statements if sql.lstrip().upper().startswith("SELECT")
+        ]
+        self.assertEqual(len(plans), 3)
+        self.assertIn("daily_totals", plans[0])
+        self.assertIn("COVERING INDEX idx_expenses_amount_cents_date_added", plans[1])
+        self.assertNotIn("TEMP B-TREE", plans[1])
+        self.assertIn("SEARCH archive_partitions USING INTEGER PRIMARY KEY", plans[2])
+
+    def test_rejects_inverted_range(self):
+        with self.assertRaises(ValueError):
+            self._trends(start_date=date(2025, 2, 1), end_date=date(2025, 1, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
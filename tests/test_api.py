@@ -0,0 +1,228 @@
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+import zlib
+
+os.environ["EXPENSES_DB"] = "test_app_expenses.db"
+os.environ["EXPENSES_SCHEDULER"] = "0"
+
+from app import app, DB_NAME
+import archive
+from db_connection import close_connections, get_connection
+from db_storage import initialize_db, write_expense, get_data_version
+from shards import ShardRouter
+
+
+class TestExpensesAPI(unittest.TestCase):
+
+    def setUp(self):
+        initialize_db(DB_NAME)
+        for day in range(1, 8):
+            write_expense({
+                "name": f"Expense {day}",
+                "category": "Food" if day % 2 else "Transport",
+                "amount": str(day),
+                "date_added": f"2025-01-{day:02d}",
+            }, DB_NAME)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        close_connections()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(DB_NAME + suffix):
+                os.remove(DB_NAME + suffix)
+        shutil.rmtree(f"{DB_NAME}.metrics", ignore_errors=True)
+
+    def test_list_pages_with_cursor(self):
+        first = self.client.get("/api/expenses?limit=4").get_json()
+        self.assertEqual([e["name"] for e in first["expenses"]],
+                         ["Expense 7", "Expense 6", "Expense 5", "Expense 4"])
+        second = self.client.get(f"/api/expenses?limit=4&after={first['next']}").get_json()
+        self.assertEqual([e["name"] for e in second["expenses"]], ["Expense 3", "Expense 2", "Expense 1"])
+        self.assertIsNone(second["next"])
+
+        food = self.client.get("/api/expenses?category=Food&sort=amount_asc").get_json()
+        self.assertEqual([e["amount_cents"] for e in food["expenses"]], [100, 300, 500, 700])
+        self.assertEqual(self.client.get("/api/expenses?sort=nope").status_code, 400)
+
+    def test_search(self):
+        first = self.client.get("/api/search?q=exp&category=Food&limit=2").get_json()
+        self.assertEqual([e["name"] for e in first["expenses"]], ["Expense 7", "Expense 5"])
+        second = self.client.get(f"/api/search?q=exp&category=Food&limit=2&after={first['next']}").get_json()
+        self.assertEqual([e["name"] for e in second["expenses"]], ["Expense 3", "Expense 1"])
+        self.assertIsNone(second["next"])
+        self.assertEqual(self.client.get("/api/search?q=exp&after=nope").status_code, 400)
+
+    def test_sharded_users_only_see_their_own_expenses(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with patch.dict(app.config, {"SHARD_ROUTER": ShardRouter(directory)}):
+            response = self.client.post("/api/expenses", headers={"X-User-Id": "alice"}, json={
+                "name": "Lunch", "category": "Food", "amount": "12.50", "date_added": "2025-01-15"})
+            self.assertEqual(response.status_code, 201)
+
+            alice = self.client.get("/api/expenses", headers={"X-User-Id": "alice"}).get_json()
+            response = self.client.get("/api/expenses", headers={"X-User-Id": "bob"})
+            self.assertIn("X-User-Id", response.headers["Vary"])
+            bob = response.get_json()
+            self.assertEqual([e["name"] for e in alice["expenses"]], ["Lunch"])
+            self.assertEqual(bob["expenses"], [])
+
+            response = self.client.get("/api/expenses")
+            self.assertEqual(response.status_code, 401)
+            self.assertIn("X-User-Id", response.get_json()["error"])
+
+    def test_create_get_update_delete(self):
+        response = self.client.post("/api/expenses", json={
+            "name": "Lunch", "category": "Food", "amount": "12.50", "date_added": "2025-01-15"})
+        self.assertEqual(response.status_code, 201)
+        created = response.get_json()
+        self.assertEqual((created["amount"], created["amount_cents"]), ("12.50", 1250))
+
+        location = response.headers["Location"]
+        self.assertEqual(self.client.get(location).get_json(), created)
+
+        updated = self.client.put(location, json={
+            "name": "Dinner", "category": "Food", "amount": "30", "date_added": "2025-01-15"}).get_json()
+        self.assertEqual((updated["id"], updated["name"], updated["amount_cents"]), (created["id"], "Dinner", 3000))
+
+        self.assertEqual(self.client.delete(location).status_code, 204)
+        self.assertEqual(self.client.get(location).status_code, 404)
+        self.assertEqual(self.client.delete(location).status_code, 404)
+        self.assertEqual(self.client.put(location, json=updated).status_code, 404)
+
+    def test_invalid_bodies_are_rejected_with_json_errors(self):
+        response = self.client.post("/api/expenses", json={"name": "Lunch", "category": "Food", "amount": "abc",
+                                                            "date_added": "2025-01-15"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("error", response.get_json())
+        self.assertEqual(self.client.post("/api/expenses", data="[]", content_type="application/json").status_code,
+                         400)
+        self.assertEqual(self.client.put("/api/expenses/1", json={"name": "No date"}).status_code, 400)
+        for field, value in (("recurring", [1]), ("recurring", 2), ("name", ["x"]), ("category", {"a": 1})):
+            response = self.client.post("/api/expenses", json={"name": "Lunch", "category": "Food", "amount": "1",
+                                                                "date_added": "2025-01-15", field: value})
+            self.assertEqual(response.status_code, 400, (field, value))
+
+    def test_dates_are_stored_in_canonical_form(self):
+        for date_added in ("20250115", "2025-W03-3"):
+            response = self.client.post("/api/expenses", json={"name": date_added, "category": "Food", "amount": "1",
+                                                                "date_added": date_added})
+            self.assertEqual(response.get_json()["date_added"], "2025-01-15")
+        found = self.client.get("/api/expenses?start=2025-01-10&end=2025-01-20").get_json()
+        self.assertEqual(sorted(expense["name"] for expense in found["expenses"]), ["2025-W03-3", "20250115"])
+        rollup = get_connection(DB_NAME).execute("SELECT date, total_cents FROM daily_totals WHERE date >= '2025-01-10'")
+        self.assertEqual(rollup.fetchall(), [("2025-01-15", 200)])
+
+    def test_database_errors_are_reported_as_json(self):
+        body = {"name": "Lunch", "category": "Food", "amount": "12.50", "date_added": "2025-01-15"}
+        busy = sqlite3.OperationalError("database is locked")
+        busy.sqlite_errorcode = sqlite3.SQLITE_BUSY
+        for error, status in ((busy, 503), (sqlite3.DatabaseError("disk I/O error"), 500)):
+            with patch("api.insert_expense", side_effect=error), self.assertLogs(app.logger, "ERROR"):
+                response = self.client.post("/api/expenses", json=body)
+            self.assertEqual(response.status_code, status)
+            self.assertIn("error", response.get_json())
+
+        # Written, but not read back: the id and Location still tell the client where it is
+        with patch("api.get_expense", return_value=None):
+            response = self.client.post("/api/expenses", json=body)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.client.get(response.headers["Location"]).get_json()["id"], response.get_json()["id"])
+
+    def test_etag_revalidation(self):
+        response = self.client.get("/api/summary")
+        etag = response.headers["ETag"]
+        self.assertEqual(response.headers["Cache-Control"], "no-cache")
+
+        not_modified = self.client.get("/api/summary", headers={"If-None-Match": etag})
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.get_data(), b"")
+        self.assertEqual(not_modified.headers["ETag"], etag)
+
+        # Any write, from any connection, changes the version
+        version = get_data_version(DB_NAME)
+        write_expense({"name": "Coffee", "category": "Food", "amount": "3", "date_added": "2025-01-08"}, DB_NAME)
+        self.assertEqual(get_data_version(DB_NAME), version + 1)
+        changed = self.client.get("/api/summary", headers={"If-None-Match": etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers["ETag"], etag)
+
+    def test_304_skips_the_query(self):
+        etag = self.client.get("/api/expenses").headers["ETag"]
+        with patch("api.iter_expenses") as iter_expenses:
+            response = self.client.get("/api/expenses", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        iter_expenses.assert_not_called()
+
+    def test_large_responses_are_compressed(self):
+        gzipped = self.client.get("/api/analytics?start=2025-01-01&end=2025-01-31",
+                                  headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(gzipped.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", gzipped.headers["Vary"])
+        self.assertIn(b'"total_cents":2800', gzip.decompress(gzipped.get_data()).replace(b" ", b""))
+
+        deflated = self.client.get("/api/analytics?start=2025-01-01&end=2025-01-31",
+                                   headers={"Accept-Encoding": "deflate"})
+        self.assertEqual(deflated.headers["Content-Encoding"], "deflate")
+        self.assertEqual(zlib.decompress(deflated.get_data()), gzip.decompress(gzipped.get_data()))
+        self.assertNotEqual(deflated.headers["ETag"], gzipped.headers["ETag"])
+
+        small = self.client.get("/api/expenses/1", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", small.headers)
+
+    def test_changes_and_sync(self):
+        everything = self.client.get("/api/changes").get_json()
+        self.assertEqual(len(everything["changes"]), 7)
+        cursor = everything["cursor"]
+        seqs = {change["id"]: change["seq"] for change in everything["changes"]}
+        response = self.client.get(f"/api/changes?since={cursor}")
+        self.assertEqual(response.get_json(), {"changes": [], "cursor": cursor, "has_more": False})
+        self.assertEqual(self.client.get(f"/api/changes?since={cursor}",
+                                         headers={"If-None-Match": response.headers["ETag"]}).status_code, 304)
+
+        expense = {"name": "Offline", "category": "Food", "amount": "2", "date_added": "2025-01-20"}
+        results = self.client.post("/api/sync", json={"changes": [
+            {"expense": expense},
+            {"id": 1, "base": seqs[1], "expense": expense},
+            {"id": 1, "base": seqs[1], "deleted": True},
+            {"id": 2, "base": seqs[2], "deleted": True},
+        ]}).get_json()["results"]
+        self.assertEqual([result["status"] for result in results], ["applied", "applied", "conflict", "applied"])
+        self.assertEqual(results[2]["expense"]["name"], "Offline")
+
+        changes = self.client.get(f"/api/changes?since={cursor}").get_json()["changes"]
+        self.assertEqual([(change["id"], change.get("name")) for change in changes],
+                         [(results[0]["id"], "Offline"), (1, "Offline"), (2, None)])
+        self.assertTrue(changes[2]["deleted"])
+
+        self.assertEqual(self.client.get("/api/changes?since=nope").status_code, 400)
+        self.assertEqual(self.client.post("/api/sync", json={"changes": [{"id": 1}]}).status_code, 400)
+        self.assertEqual(self.client.post("/api/sync", json={"changes": {}}).status_code, 400)
+
+    def test_archived_expenses_are_read_only(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        archive.archive_expenses(DB_NAME, 2026, directory)
+        expense = self.client.get("/api/expenses/1").get_json()
+        self.assertEqual(expense["name"], "Expense 1")
+        response = self.client.put("/api/expenses/1", json={**expense, "amount": "9"})
+        self.assertEqual(response.status_code, 409)
+        self.assertIn("archived", response.get_json()["error"])
+        self.assertEqual(self.client.delete("/api/expenses/1").status_code, 409)
+
+    def test_analytics(self):
+        trends = self.client.get("/api/analytics?start=2025-01-01&end=2025-01-31").get_json()
+        self.assertEqual(trends["total_cents"], 2800)
+        self.assertEqual([c["category"] for c in trends["categories"]], ["Food", "Transport"])
+        self.assertEqual(len(trends["days"]), 31)
+        self.assertEqual(self.client.get("/api/analytics?start=2025-02-01&end=2025-01-01").status_code, 400)
+        self.assertEqual(self.client.get("/api/analytics?start=soon").status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
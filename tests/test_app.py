@@ -0,0 +1,197 @@
+import concurrent.futures
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import unittest
+from unittest.mock import Mock, patch
+from datetime import date
+
+os.environ["EXPENSES_DB"] = "test_app_expenses.db"
+os.environ["EXPENSES_SCHEDULER"] = "0"
+
+from app import app, DB_NAME
+from db_connection import close_connections
+from db_storage import initialize_db, write_expense, read_expenses
+from write_queue import WriteQueue
+
+
+class TestViewExpenses(unittest.TestCase):
+
+    def setUp(self):
+        initialize_db(DB_NAME)
+        for day in range(1, 8):
+            write_expense({
+                "name": f"Expense {day}",
+                "category": "Food" if day % 2 else "Transport",
+                "amount": str(day),
+                "date_added": f"2025-01-{day:02d}",
+            }, DB_NAME)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        close_connections()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(DB_NAME + suffix):
+                os.remove(DB_NAME + suffix)
+        shutil.rmtree(f"{DB_NAME}.metrics", ignore_errors=True)
+
+    def _names(self, response):
+        return re.findall(r"<td>(Expense \d)</td>", response.get_data(as_text=True))
+
+    def _link(self, response, label):
+        match = re.search(r'href="([^"]+)">' + label, response.get_data(as_text=True))
+        return match.group(1).replace("&amp;", "&") if match else None
+
+    def test_pages_follow_next_and_previous_links(self):
+        first = self.client.get("/view-expenses?limit=3")
+        self.assertEqual(self._names(first), ["Expense 7", "Expense 6", "Expense 5"])
+
+        second = self.client.get(self._link(first, "Next"))
+        self.assertEqual(self._names(second), ["Expense 4", "Expense 3", "Expense 2"])
+
+        third = self.client.get(self._link(second, "Next"))
+        self.assertEqual(self._names(third), ["Expense 1"])
+        self.assertEqual(self._link(third, "Next"), "#")
+
+        back = self.client.get(self._link(third, "Previous"))
+        self.assertEqual(self._names(back), ["Expense 4", "Expense 3", "Expense 2"])
+
+    def test_page_is_streamed(self):
+        response = self.client.get("/view-expenses")
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(len(self._names(response)), 7)
+
+    def test_dashboard_shows_totals_and_categories(self):
+        write_expense({"name": "Coffee", "category": "Food", "amount": "4.20",
+                       "date_added": date.today().isoformat()}, DB_NAME)
+        response = self.client.get("/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("<td>Food</td>", response.get_data(as_text=True))
+        self.assertIn("$4.20", response.get_data(as_text=True))
+
+    def test_filters_and_sort(self):
+        response = self.client.get("/view-expenses?category=Food&sort=amount_asc&start=2025-01-02")
+        self.assertEqual(self._names(response), ["Expense 3", "Expense 5", "Expense 7"])
+
+    def test_export_csv_applies_filters(self):
+        response = self.client.get("/export.csv?category=Food&sort=date_asc")
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(lines[0], "id,name,category,amount,date_added,recurring,recurring_schedule")
+        self.assertEqual([line.split(",")[1] for line in lines[1:]],
+                         ["Expense 1", "Expense 3", "Expense 5", "Expense 7"])
+        self.assertEqual(lines[1].split(",")[3], "1.00")
+
+    def test_export_ndjson_is_gzipped_when_accepted(self):
+        response = self.client.get("/export.ndjson", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        records = [json.loads(line) for line in gzip.decompress(response.get_data()).splitlines()]
+        self.assertEqual(len(records), 7)
+        self.assertEqual(records[0]["name"], "Expense 7")
+
+    def test_metrics_report_route_latency(self):
+        self.client.get("/view-expenses")
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith("text/plain"))
+        text = response.get_data(as_text=True)
+        self.assertRegex(text, r'http_request_duration_seconds_count\{method="GET",route="/view-expenses",'
+                               r'status="200"\} [1-9]')
+        self.assertRegex(text, r'storage_call_seconds_count\{function="read_expenses"\} [1-9]')
+
+    def test_search_page(self):
+        response = self.client.get("/search?q=expense&limit=5")
+        self.assertEqual(self._names(response), ["Expense 7", "Expense 6", "Expense 5", "Expense 4", "Expense 3"])
+        more = re.search(r'href="([^"]*after=[^"]*)"', response.get_data(as_text=True)).group(1)
+        self.assertEqual(self._names(self.client.get(more.replace("&amp;", "&"))), ["Expense 2", "Expense 1"])
+
+        # The list page filters by the same search, in its own sort order
+        response = self.client.get("/view-expenses?q=expense&category=Transport&sort=amount_asc")
+        self.assertEqual(self._names(response), ["Expense 2", "Expense 4", "Expense 6"])
+
+    def test_add_expense_through_the_write_queue(self):
+        write_queue = WriteQueue(DB_NAME)
+        with patch("app.write_queue", write_queue):
+            response = self.client.post("/add_expense", data={
+                "name": "Queued", "category": "Food", "amount": "4", "date_added": "2025-01-08"})
+        write_queue.stop()
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(read_expenses(DB_NAME, sort="date_desc", limit=1)[0].name, "Queued")
+
+    def test_add_expense_errors_are_the_same_with_and_without_the_queue(self):
+        invalid = {"name": "Bad", "category": "Food", "amount": "abc", "date_added": "2025-01-08"}
+        self.assertEqual(self.client.post("/add_expense", data=invalid).status_code, 400)
+        write_queue = WriteQueue(DB_NAME)
+        with patch("app.write_queue", write_queue):
+            self.assertEqual(self.client.post("/add_expense", data=invalid).status_code, 400)
+        write_queue.stop()
+
+        slow = Mock(**{"write.side_effect": concurrent.futures.TimeoutError})
+        with patch("app.write_queue", slow), self.assertLogs(app.logger, "WARNING"):
+            response = self.client.post("/add_expense", data={**invalid, "amount": "4"})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(read_expenses(DB_NAME)), 7)
+
+    def test_invalid_cursor_is_rejected(self):
+        self.assertEqual(self.client.get("/view-expenses?after=garbage").status_code, 400)
+
+
+class TestImport(unittest.TestCase):
+
+    def setUp(self):
+        initialize_db(DB_NAME)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        close_connections()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(DB_NAME + suffix):
+                os.remove(DB_NAME + suffix)
+        shutil.rmtree(f"{DB_NAME}.metrics", ignore_errors=True)
+
+    def test_import_csv_in_legacy_layout(self):
+        data = "name,category,amount\nLunch,Food,12.50\nBus,Transport,oops\nGym,Health,50\n"
+        response = self.client.post("/import", data={"file": (io.BytesIO(data.encode()), "expenses.csv")})
+
+        self.assertEqual(response.get_json()["inserted"], 2)
+        self.assertEqual(response.get_json()["errors"][0]["row"], 2)
+        self.assertEqual([(e.name, e.amount_cents) for e in read_expenses(DB_NAME)],
+                         [("Lunch", 1250), ("Gym", 5000)])
+
+    def test_import_ndjson_body(self):
+        lines = [
+            json.dumps({"name": "Lunch", "category": "Food", "amount": 12.5, "date_added": "2025-01-15"}),
+            "not json",
+            json.dumps({"name": "Netflix", "category": "Entertainment", "amount": "15.99",
+                        "date_added": "2025-01-01", "recurring": 1, "recurring_schedule": "monthly"}),
+        ]
+        response = self.client.post("/import", data="\n".join(lines), content_type="application/x-ndjson")
+
+        self.assertEqual(response.get_json()["inserted"], 2)
+        self.assertEqual(response.get_json()["error_count"], 1)
+        self.assertEqual(read_expenses(DB_NAME)[1].recurring_schedule, "monthly")
+
+    def test_import_rejects_non_scalar_fields_per_row(self):
+        good = {"name": "Lunch", "category": "Food", "amount": "12.50", "date_added": "2025-01-15"}
+        lines = [json.dumps(good), json.dumps({**good, "name": {"first": "x"}}),
+                 json.dumps({**good, "recurring": [1]}), json.dumps({**good, "recurring": 2}), json.dumps(good)]
+        response = self.client.post("/import", data="\n".join(lines), content_type="application/x-ndjson")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["inserted"], 2)
+        self.assertEqual([error["row"] for error in response.get_json()["errors"]], [2, 3, 4])
+        self.assertEqual(len(read_expenses(DB_NAME)), 2)
+
+    def test_import_of_text_that_is_not_utf8(self):
+        data = "name,category,amount\nLunch,Food,12.50\n".encode() + "Caf\xe9,Food,3\n".encode("latin-1")
+        response = self.client.post("/import", data={"file": (io.BytesIO(data), "expenses.csv")})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()["inserted"], 0)  # The bad byte is in the first block read
+        self.assertIn("not UTF-8", response.get_json()["errors"][0]["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+import datetime
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+import archive
+from analytics import spending_trends
+from db_connection import close_connections, get_connection
+from db_migrations import migrate
+from db_storage import (
+    initialize_db, write_expense, read_expenses, iter_expenses_by_page, make_cursor, get_changes,
+    rebuild_daily_totals, get_dashboard_summary, process_recurring_expenses, get_expense, update_expense,
+    delete_expense, sync_expenses, EXPENSE_SORTS,
+)
+from shards import ShardRouter
+
+
+class TestArchive(unittest.TestCase):
+    TEST_DB = "test_archive.db"
+
+    def setUp(self):
+        initialize_db(self.TEST_DB)
+        self.directory = tempfile.mkdtemp()
+        categories = ["Food", "Transport", "Café"]
+        for i in range(60):
+            write_expense({
+                "name": f"Expense {i}" if i % 5 else f"Crème brûlée {i}",
+                "category": categories[i % 3],
+                "amount": str((i * 37) % 50 + 1),
+                "date_added": f"{2022 + i % 4}-{i % 12 + 1:02d}-{i % 28 + 1:02d}",
+            }, self.TEST_DB)
+        write_expense({"name": "Rent", "category": "Housing", "amount": "900", "date_added": "2022-03-01",
+                       "recurring": True, "recurring_schedule": "monthly"}, self.TEST_DB)
+
+    def tearDown(self):
+        close_connections()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.TEST_DB + suffix):
+                os.remove(self.TEST_DB + suffix)
+        shutil.rmtree(self.directory)
+
+    def _archive(self, before_year=2024):
+        return archive.archive_expenses(self.TEST_DB, before_year, self.directory)
+
+    def _hot_count(self):
+        return get_connection(self.TEST_DB).execute("SELECT COUNT(*) FROM expenses").fetchone()[0]
+
+    def _pages(self, sort, page_size=7, **filters):
+        pages, after = [], None
+        while True:
+            page = read_expenses(self.TEST_DB, sort=sort, after=after, limit=page_size, **filters)
+            pages.append(page)
+            if len(page) < page_size:
+                return pages
+            after = make_cursor(page[-1], sort)
+
+    def test_archived_years_leave_the_table(self):
+        before = read_expenses(self.TEST_DB)
+        archived = self._archive()
+        self.assertEqual(archived, {2022: 15, 2023: 15})
+        self.assertEqual(self._hot_count(), 31)  # The recurring template stays
+        self.assertEqual(read_expenses(self.TEST_DB), before)
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+    def test_reads_are_unchanged_across_sorts_cursors_and_filters(self):
+        filter_sets = [
+            {},
+            {"category": "Café"},
+            {"start_date": "2023-06-01", "end_date": "2024-03-01"},
+            {"min_amount_cents": 1000, "max_amount_cents": 3000},
+            {"recurring": 0},
+            {"search": "creme"},
+        ]
+        expected = {(sort, i): self._pages(sort, **filters)
+                    for sort in EXPENSE_SORTS for i, filters in enumerate(filter_sets)}
+        self._archive()
+        for sort in EXPENSE_SORTS:
+            for i, filters in enumerate(filter_sets):
+                with self.subTest(sort=sort, filters=filters):
+                    pages = self._pages(sort, **filters)
+                    self.assertEqual(pages, expected[sort, i])
+                    if len(pages) > 1:
+                        # Going back a page from the second one
+                        cursor = make_cursor(pages[1][0], sort)
+                        self.assertEqual(read_expenses(self.TEST_DB, sort=sort, before=cursor, limit=7, **filters),
+                                         pages[0])
+
+    def test_exports_include_archived_expenses(self):
+        before = list(iter_expenses_by_page(self.TEST_DB, page_size=4, sort="date_asc"))
+        self._archive()
+        self.assertEqual(list(iter_expenses_by_page(self.TEST_DB, page_size=4, sort="date_asc")), before)
+
+    def test_totals_and_analytics_are_unchanged(self):
+        start, end = datetime.date(2022, 1, 1), datetime.date(2025, 12, 31)
+        trends = spending_trends(self.TEST_DB, start_date=start, end_date=end, today=end)
+        summary = get_dashboard_summary(self.TEST_DB, today=datetime.date(2023, 5, 6))
+        self._archive()
+        self.assertEqual(spending_trends(self.TEST_DB, start_date=start, end_date=end, today=end), trends)
+        self.assertEqual(get_dashboard_summary(self.TEST_DB, today=datetime.date(2023, 5, 6)), summary)
+
+        rollup = get_connection(self.TEST_DB).execute("SELECT * FROM daily_totals ORDER BY 1, 2").fetchall()
+        rebuild_daily_totals(self.TEST_DB)
+        self.assertEqual(get_connection(self.TEST_DB).execute("SELECT * FROM daily_totals ORDER BY 1, 2").fetchall(),
+                         rollup)
+
+    def test_archived_expenses_stay_in_the_change_log(self):
+        before = get_changes(self.TEST_DB)
+        self._archive()
+        # Synced clients see nothing new; a first sync still gets every expense
+        self.assertEqual(get_changes(self.TEST_DB, since=before.cursor).changes, [])
+        self.assertEqual(get_changes(self.TEST_DB), before)
+
+    def test_archived_expenses_are_read_only(self):
+        expense = read_expenses(self.TEST_DB, sort="date_asc", limit=1)[0]
+        self._archive()
+        self.assertEqual(get_expense(expense.id, self.TEST_DB), expense)
+        with self.assertRaises(archive.ArchivedExpenseError):
+            update_expense(expense.id, expense, self.TEST_DB)
+        with self.assertRaises(archive.ArchivedExpenseError):
+            delete_expense(expense.id, self.TEST_DB)
+        self.assertFalse(delete_expense(10 ** 6, self.TEST_DB))
+
+        seq = get_changes(self.TEST_DB).changes[0].seq
+        [result] = sync_expenses([(expense.id, seq, None)], self.TEST_DB)
+        self.assertEqual(result.status, "invalid")
+        self.assertEqual(get_expense(expense.id, self.TEST_DB), expense)
+
+    def test_cli_continues_after_a_failing_shard(self):
+        shard_dir = os.path.join(self.directory, "shards")
+        router = ShardRouter(shard_dir)
+        for user in ("alice", "bob"):
+            write_expense({"name": "Old", "category": "Food", "amount": "1", "date_added": "2020-05-01"},
+                          router.db_name(user))
+        broken = router.path("alice")
+        with open(archive.archive_directory(broken), "w"):
+            pass  # A file where its archive directory should go
+        with redirect_stdout(io.StringIO()) as output:
+            status = archive.main(["--before", "2021", "--shard-dir", shard_dir])
+        self.assertEqual(status, 1)
+        self.assertIn(f"Error archiving {broken}", output.getvalue())
+        self.assertIn(f"{router.path('bob')}: archived 1 expenses of 2020", output.getvalue())
+
+    def test_archiving_again_merges_into_the_year(self):
+        self._archive()
+        write_expense({"name": "Late receipt", "category": "Food", "amount": "2", "date_added": "2023-12-31"},
+                      self.TEST_DB)
+        self.assertEqual(self._archive(), {2023: 1})
+        self.assertEqual(len(os.listdir(self.directory)), 3)  # The replaced file waits out the grace period
+        late = read_expenses(self.TEST_DB, start_date="2023-12-31", end_date="2024-01-01")
+        self.assertEqual([expense.name for expense in late], ["Late receipt"])
+        self.assertEqual(len(read_expenses(self.TEST_DB, start_date="2023-01-01", end_date="2024-01-01")), 16)
+
+    def test_archived_recurring_charges_are_not_charged_again(self):
+        self.assertEqual(process_recurring_expenses(self.TEST_DB, today=datetime.date(2023, 12, 31)), 21)
+        self._archive()
+        conn = get_connection(self.TEST_DB)
+        # Years archived before the occurrence keys were kept get them on migrating
+        conn.execute("DROP TABLE archived_occurrences")
+        conn.execute("PRAGMA user_version = 10")
+        migrate(conn)
+        rollup = conn.execute("SELECT * FROM daily_totals ORDER BY 1, 2").fetchall()
+        with conn:
+            conn.execute("UPDATE expenses SET next_due = '2022-04-01' WHERE recurring = 1")
+        self.assertEqual(process_recurring_expenses(self.TEST_DB, today=datetime.date(2023, 12, 31)), 0)
+        self.assertEqual(conn.execute("SELECT * FROM daily_totals ORDER BY 1, 2").fetchall(), rollup)
+
+    def test_future_years_cannot_be_archived(self):
+        with self.assertRaises(ValueError):
+            self._archive(datetime.date.today().year + 1)
+
+    def test_unreadable_partition_raises(self):
+        self._archive()
+        path = get_connection(self.TEST_DB).execute(
+            "SELECT path FROM archive_partitions WHERE year = 2022").fetchone()[0]
+        with open(path, "r+b") as file:
+            file.write(b"garbage")
+        archive._load_partition.cache_clear()
+        with self.assertRaises(archive.ArchiveError):
+            read_expenses(self.TEST_DB, sort="date_asc")
+
+
+if __name__ == "__main__":
+    unittest.main()
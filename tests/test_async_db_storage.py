@@ -0,0 +1,76 @@
+import asyncio
+import inspect
+import os
+import threading
+import unittest
+
+import async_db_storage
+import db_storage
+from db_connection import close_connections
+
+
+class TestAsyncDBStorage(unittest.TestCase):
+    TEST_DB = "test_async_expenses.db"
+
+    def setUp(self):
+        asyncio.run(async_db_storage.initialize_db(self.TEST_DB))
+
+    def tearDown(self):
+        async_db_storage.shutdown()
+        close_connections()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.TEST_DB + suffix):
+                os.remove(self.TEST_DB + suffix)
+
+    def test_concurrent_writes_and_reads(self):
+        async def scenario():
+            ids = await asyncio.gather(*(
+                async_db_storage.insert_expense({"name": f"Item {i}", "category": "Food", "amount": "2",
+                                                 "date_added": "2025-01-15"}, self.TEST_DB)
+                for i in range(20)
+            ))
+            expenses, _ = await asyncio.gather(
+                async_db_storage.read_expenses(self.TEST_DB),
+                async_db_storage.get_dashboard_summary(self.TEST_DB),
+            )
+            return ids, expenses
+
+        ids, expenses = asyncio.run(scenario())
+        self.assertEqual(sorted(ids), [e.id for e in expenses])
+        self.assertEqual(len(expenses), 20)
+
+    def test_writes_share_one_thread_and_reads_are_bounded(self):
+        def thread_name():
+            return threading.current_thread().name
+
+        async def scenario():
+            writers = await asyncio.gather(*(async_db_storage._run_on("writer", thread_name)() for _ in range(10)))
+            readers = await asyncio.gather(*(async_db_storage._run_on("reader", thread_name)() for _ in range(50)))
+            return set(writers), set(readers)
+
+        writers, readers = asyncio.run(scenario())
+        self.assertEqual(len(writers), 1)
+        self.assertLessEqual(len(readers), async_db_storage.READER_THREADS)
+        self.assertTrue(all(name.startswith("db-reader") for name in readers))
+
+    def test_iter_expenses_by_page(self):
+        async def scenario():
+            await async_db_storage.write_expenses(
+                ({"name": f"Item {i}", "category": "Food", "amount": "1", "date_added": "2025-01-15"}
+                 for i in range(7)), self.TEST_DB)
+            return [e.name async for e in async_db_storage.iter_expenses_by_page(self.TEST_DB, page_size=3)]
+
+        self.assertEqual(asyncio.run(scenario()), [f"Item {i}" for i in range(7)])
+
+    def test_every_storage_function_is_offered(self):
+        public = {name for name, value in vars(db_storage).items()
+                  if inspect.isfunction(value) and value.__module__ == "db_storage" and not name.startswith("_")}
+        self.assertEqual(sorted(public - set(vars(async_db_storage)) - {"iter_expenses"}), [])
+
+    def test_validation_errors_propagate(self):
+        with self.assertRaises(ValueError):
+            asyncio.run(async_db_storage.insert_expense({"name": "No date"}, self.TEST_DB))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import collections
+import contextlib
+import io
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from benchmarks.datagen import CATEGORIES, dataset, generate_expenses
+from benchmarks.run import Case, _sqlite_memory, measure, storage_cases
+from db_connection import close_connections
+from db_storage import read_expenses
+
+
+class TestDataGenerator(unittest.TestCase):
+
+    def test_generation_is_reproducible_and_skewed(self):
+        expenses = list(generate_expenses(5000, seed=3, recurring_share=0.1))
+        self.assertEqual(expenses, list(generate_expenses(5000, seed=3, recurring_share=0.1)))
+
+        counts = collections.Counter(e["category"] for e in expenses)
+        self.assertEqual(counts.most_common(1)[0][0], CATEGORIES[0][0])
+        recurring = sum(1 for e in expenses if e.get("recurring"))
+        self.assertTrue(300 < recurring < 700)
+
+    def test_dataset_is_built_once(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = dataset(directory, 200, seed=1)
+            self.assertEqual(len(read_expenses(path)), 200)
+            close_connections()
+            modified = os.path.getmtime(path)
+            self.assertEqual(dataset(directory, 200, seed=1), path)
+            self.assertEqual(os.path.getmtime(path), modified)
+        finally:
+            close_connections()
+            shutil.rmtree(directory)
+
+    def test_measure_reports_percentiles(self):
+        calls = []
+        result = measure(Case("storage", "noop", lambda: calls.append(1), rows=10), repeat=4, warmup=2)
+        self.assertEqual(len(calls), 7)  # Warmup, timed and tracemalloc calls
+        self.assertEqual(result["calls"], 4)
+        self.assertLessEqual(result["p50_ms"], result["p95_ms"])
+        self.assertIsNotNone(result["rows_per_sec"])
+
+    @unittest.skipIf(_sqlite_memory() is None, "SQLite's memory statistics are not exported")
+    def test_measure_counts_sqlite_memory(self):
+        def fill():
+            # Allocated by SQLite's page cache, which tracemalloc does not see
+            with contextlib.closing(sqlite3.connect(":memory:")) as conn:
+                conn.execute("CREATE TABLE t (x)")
+                conn.executemany("INSERT INTO t VALUES (?)", ((b"x" * 1000,) for _ in range(4000)))
+
+        result = measure(Case("storage", "fill", fill), repeat=1, warmup=0)
+        self.assertGreater(result["sqlite_peak_kib"], 3000)
+        self.assertGreaterEqual(result["peak_kib"], result["sqlite_peak_kib"])
+
+    def test_storage_cases_stop_their_threads(self):
+        directory = tempfile.mkdtemp()
+        try:
+            db_name = os.path.join(directory, "expenses.db")
+            shutil.copyfile(dataset(directory, 50, seed=1), db_name)
+            before = set(threading.enumerate())
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.ExitStack() as cleanup:
+                cases = storage_cases(db_name, 50, cleanup)
+                next(case for case in cases if case.name.startswith("write queue")).func()
+                self.assertTrue(set(threading.enumerate()) - before)
+            self.assertEqual([t.name for t in set(threading.enumerate()) - before if t.daemon], [])
+        finally:
+            close_connections()
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import datetime
+import os
+import sqlite3
+import threading
+import unittest
+
+from db_cache import QueryCache, query_cache
+from db_connection import close_connections, get_connection
+from db_storage import initialize_db, write_expense, delete_expense, get_dashboard_summary
+
+
+class TestQueryCache(unittest.TestCase):
+    TEST_DB = "test_expenses.db"
+    TODAY = datetime.date(2025, 1, 15)
+
+    def setUp(self):
+        initialize_db(self.TEST_DB)
+        query_cache.clear()
+        write_expense({"name": "Lunch", "category": "Food", "amount": "12.50", "date_added": "2025-01-15"},
+                      self.TEST_DB)
+
+    def tearDown(self):
+        close_connections()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.TEST_DB + suffix):
+                os.remove(self.TEST_DB + suffix)
+
+    def _selects(self, func):
+        """
+        Run `func` and return the SELECT statements it sent to SQLite.
+        """
+        conn = get_connection(self.TEST_DB)
+        statements = []
+        conn.set_trace_callback(statements.append)
+        try:
+            result = func()
+        finally:
+            conn.set_trace_callback(None)
+        return result, [sql for sql in statements if "SELECT" in sql.upper()]
+
+    def test_repeated_summary_is_served_from_cache(self):
+        first = get_dashboard_summary(self.TEST_DB, today=self.TODAY)
+        hits = query_cache.stats()["hits"]
+
+        second, selects = self._selects(lambda: get_dashboard_summary(self.TEST_DB, today=self.TODAY))
+
+        self.assertEqual(second, first)
+        self.assertEqual(selects, [])
+        self.assertEqual(query_cache.stats()["hits"], hits + 1)
+
+    def test_writes_invalidate_cached_results(self):
+        self.assertEqual(get_dashboard_summary(self.TEST_DB, today=self.TODAY).daily_cents, 1250)
+        write_expense({"name": "Coffee", "category": "Food", "amount": "3", "date_added": "2025-01-15"},
+                      self.TEST_DB)
+        self.assertEqual(get_dashboard_summary(self.TEST_DB, today=self.TODAY).daily_cents, 1550)
+        delete_expense(1, self.TEST_DB)
+        self.assertEqual(get_dashboard_summary(self.TEST_DB, today=self.TODAY).daily_cents, 300)
+
+    def test_commits_from_other_connections_invalidate(self):
+        self.assertEqual(get_dashboard_summary(self.TEST_DB, today=self.TODAY).daily_cents, 1250)
+
+        # Another process would write through its own connection
+        other = sqlite3.connect(self.TEST_DB)
+        with other:
+            other.execute("UPDATE expenses SET amount_cents = 100")
+        other.close()
+
+        self.assertEqual(get_dashboard_summary(self.TEST_DB, today=self.TODAY).daily_cents, 100)
+
+    def _summary_in_new_thread(self):
+        results = []
+        thread = threading.Thread(target=lambda: results.append(
+            get_dashboard_summary(self.TEST_DB, today=self.TODAY).daily_cents))
+        thread.start()
+        thread.join()
+        return results[0]
+
+    def test_new_threads_use_the_cache(self):
+        self.assertEqual(get_dashboard_summary(self.TEST_DB, today=self.TODAY).daily_cents, 1250)
+        stats = query_cache.stats()
+        self.assertEqual(self._summary_in_new_thread(), 1250)
+        self.assertEqual(self._summary_in_new_thread(), 1250)
+        self.assertEqual(query_cache.stats()["hits"], stats["hits"] + 2)
+        self.assertEqual(query_cache.stats()["invalidations"], stats["invalidations"])
+
+    def test_new_threads_see_commits_made_before_they_looked(self):
+        self.assertEqual(get_dashboard_summary(self.TEST_DB, today=self.TODAY).daily_cents, 1250)
+        with sqlite3.connect(self.TEST_DB) as other:
+            other.execute("UPDATE expenses SET amount_cents = 100")
+        other.close()
+        self.assertEqual(self._summary_in_new_thread(), 100)
+
+    def test_lru_bound_and_ttl(self):
+        now = [0.0]
+        cache = QueryCache(max_entries=2, ttl=10, clock=lambda: now[0])
+        calls = []
+
+        def lookup(key):
+            return cache.get_or_compute(self.TEST_DB, key, lambda: calls.append(key) or key)
+
+        lookup("a"), lookup("b"), lookup("a"), lookup("c")  # "b" is least recently used
+        self.assertEqual(cache.stats()["entries"], 2)
+        lookup("a"), lookup("b")
+        self.assertEqual(calls, ["a", "b", "c", "b"])
+
+        now[0] = 11
+        lookup("a")
+        self.assertEqual(calls[-1], "a")
+
+
+if __name__ == "__main__":
+    unittest.main()
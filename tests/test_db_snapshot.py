@@ -0,0 +1,196 @@
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+os.environ["EXPENSES_DB"] = "test_app_expenses.db"
+os.environ["EXPENSES_SCHEDULER"] = "0"
+
+from app import app, DB_NAME
+from db_connection import close_connections, get_connection
+from db_snapshot import SnapshotManager
+from db_storage import initialize_db, write_expense, read_expenses, get_dashboard_summary
+
+
+def _expense(name, day="2025-01-15"):
+    return {"name": name, "category": "Food", "amount": "4.00", "date_added": day}
+
+
+class TestSnapshotManager(unittest.TestCase):
+    TEST_DB = "test_snapshot.db"
+
+    def setUp(self):
+        initialize_db(self.TEST_DB)
+        write_expense(_expense("Coffee"), self.TEST_DB)
+        # The background thread does not get to run: the tests refresh by hand
+        self.snapshots = SnapshotManager(max_staleness=60, min_refresh_interval=0)
+
+    def tearDown(self):
+        self.snapshots.stop()
+        close_connections()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.TEST_DB + suffix):
+                os.remove(self.TEST_DB + suffix)
+
+    def _write_elsewhere(self, name):
+        # Another worker's commit: it bypasses this process's query cache
+        with sqlite3.connect(self.TEST_DB) as other:
+            other.execute("INSERT INTO expenses (name, category, amount, amount_cents, date_added) "
+                          "VALUES (?, 'Food', 1.0, 100, '2025-01-16')", (name,))
+
+    def test_reads_come_from_the_snapshot_once_copied(self):
+        self.assertEqual(self.snapshots.acquire(self.TEST_DB), self.TEST_DB)
+        self.snapshots.refresh()
+        name = self.snapshots.acquire(self.TEST_DB)
+        self.assertTrue(name.startswith("file:/expenses-snapshot-"))
+        self.assertEqual([expense.name for expense in read_expenses(name)], ["Coffee"])
+        with self.assertRaises(sqlite3.OperationalError):
+            get_connection(name).execute("DELETE FROM expenses")
+        self.snapshots.release(name)
+
+    def test_refresh_copies_commits_of_other_connections(self):
+        self.snapshots.acquire(self.TEST_DB)
+        self.snapshots.refresh()
+        first = self.snapshots.acquire(self.TEST_DB)
+        self.snapshots.release(first)
+
+        self._write_elsewhere("Tea")
+        self.assertEqual(self.snapshots.acquire(self.TEST_DB), first)  # Stale, but within the bound
+        self.snapshots.release(first)
+        self.snapshots.refresh()
+        second = self.snapshots.acquire(self.TEST_DB)
+        self.assertNotEqual(second, first)
+        self.assertEqual(sorted(expense.name for expense in read_expenses(second)), ["Coffee", "Tea"])
+        self.snapshots.release(second)
+
+    def test_unchanged_database_is_not_copied_again(self):
+        self.snapshots.acquire(self.TEST_DB)
+        self.snapshots.refresh()
+        first = self.snapshots.acquire(self.TEST_DB)
+        self.snapshots.release(first)
+        self.snapshots.refresh()
+        self.assertEqual(self.snapshots.acquire(self.TEST_DB), first)
+        self.snapshots.release(first)
+
+    def test_own_writes_and_stale_snapshots_fall_back_to_the_database(self):
+        self.snapshots.acquire(self.TEST_DB)
+        self.snapshots.refresh()
+        write_expense(_expense("Tea"), self.TEST_DB)
+        self.assertEqual(self.snapshots.acquire(self.TEST_DB), self.TEST_DB)
+
+        self.snapshots.refresh()
+        self.assertNotEqual(self.snapshots.acquire(self.TEST_DB), self.TEST_DB)
+        self.snapshots.max_staleness = 0.01
+        time.sleep(0.02)
+        self.assertEqual(self.snapshots.acquire(self.TEST_DB), self.TEST_DB)
+
+    def test_replaced_snapshot_stays_readable_until_released(self):
+        self.snapshots.acquire(self.TEST_DB)
+        self.snapshots.refresh()
+        pinned = self.snapshots.acquire(self.TEST_DB)
+        self._write_elsewhere("Tea")
+        self.snapshots.refresh()
+
+        self.assertEqual([expense.name for expense in read_expenses(pinned)], ["Coffee"])
+        self.snapshots.release(pinned)
+        close_connections(pinned)
+        # The copy is gone: a new connection finds an empty database
+        with sqlite3.connect(pinned, uri=True) as conn:
+            self.assertEqual(conn.execute("SELECT count(*) FROM sqlite_master").fetchone(), (0,))
+
+    def test_refresh_waits_out_the_minimum_interval(self):
+        self.snapshots.min_refresh_interval = 60
+        self.snapshots.acquire(self.TEST_DB)
+        self.snapshots.refresh()
+        first = self.snapshots.acquire(self.TEST_DB)
+        self.snapshots.release(first)
+
+        self._write_elsewhere("Tea")
+        self.snapshots.refresh()
+        self.assertEqual(self.snapshots.acquire(self.TEST_DB), first)  # Not copied again yet
+        self.snapshots.release(first)
+        self.snapshots.max_staleness = 0
+        self.assertEqual(self.snapshots.acquire(self.TEST_DB), self.TEST_DB)
+
+    def test_connections_of_idle_threads_are_closed_with_the_snapshot(self):
+        self.snapshots.acquire(self.TEST_DB)
+        self.snapshots.refresh()
+        name = self.snapshots.acquire(self.TEST_DB)
+        connections = []
+        reader = threading.Thread(target=lambda: connections.append(get_connection(name)))
+        reader.start()
+        reader.join()
+        self.snapshots.release(name)
+
+        self._write_elsewhere("Tea")
+        self.snapshots.refresh()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            connections[0].execute("SELECT 1")
+        with sqlite3.connect(name, uri=True) as conn:
+            self.assertEqual(conn.execute("SELECT count(*) FROM sqlite_master").fetchone(), (0,))
+
+    def test_background_thread_keeps_the_snapshot_fresh(self):
+        snapshots = SnapshotManager(max_staleness=0.05)
+        try:
+            snapshots.acquire(self.TEST_DB)
+            deadline = time.monotonic() + 5
+            while snapshots.acquire(self.TEST_DB) == self.TEST_DB and time.monotonic() < deadline:
+                time.sleep(0.01)
+            name = snapshots.acquire(self.TEST_DB)
+            self.assertNotEqual(name, self.TEST_DB)
+            self.assertEqual(get_dashboard_summary(name).today, get_dashboard_summary(self.TEST_DB).today)
+        finally:
+            snapshots.stop()
+
+
+class TestSnapshotRoutes(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app.test_client()
+        initialize_db(DB_NAME)
+        write_expense(_expense("Snapshot lunch", "2025-02-01"), DB_NAME)
+        self.snapshots = SnapshotManager(max_staleness=60, min_refresh_interval=0)
+        self.snapshots.acquire(DB_NAME)
+        self.snapshots.refresh()
+
+    def tearDown(self):
+        self.snapshots.stop()
+        close_connections()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(DB_NAME + suffix):
+                os.remove(DB_NAME + suffix)
+        shutil.rmtree(f"{DB_NAME}.metrics", ignore_errors=True)
+
+    def test_pages_and_api_are_served_from_the_snapshot(self):
+        with patch.dict(app.config, {"SNAPSHOTS": self.snapshots}):
+            response = self.client.get("/view-expenses?category=Food")
+            self.assertIn(b"Snapshot lunch", response.data)
+            response = self.client.get("/api/summary")
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers["ETag"]
+            self.assertEqual(self.client.get("/api/summary", headers={"If-None-Match": etag}).status_code, 304)
+        self.assertEqual(self.snapshots.acquire(DB_NAME), self.snapshots.acquire(DB_NAME))
+        # Every request released what it read
+        self.assertTrue(all(snapshot.readers == 2 for snapshot in self.snapshots._current.values()))
+
+    def test_views_reading_the_database_are_validated_against_it(self):
+        with patch.dict(app.config, {"SNAPSHOTS": self.snapshots}):
+            response = self.client.get("/api/expenses/1")
+            etag = response.headers["ETag"]
+            # Another worker's edit; the snapshot stays within its staleness bound
+            with sqlite3.connect(DB_NAME) as other:
+                other.execute("UPDATE expenses SET name = 'Snapshot dinner' WHERE id = 1")
+            other.close()
+            response = self.client.get("/api/expenses/1", headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get_json()["name"], "Snapshot dinner")
+            # The list is read from the snapshot, so its validator is still the snapshot's
+            etag = self.client.get("/api/expenses").headers["ETag"]
+            self.assertEqual(self.client.get("/api/expenses", headers={"If-None-Match": etag}).status_code, 304)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,19 @@
 import os
 import sqlite3
+import threading
 import unittest
 from unittest.mock import patch
 import datetime
 
-from db_storage import initialize_db, write_expense, read_expenses, process_recurring_expenses
+from db_connection import close_connections, get_connection
+from db_migrations import MIGRATIONS, get_schema_version, migrate
+from db_storage import (
+    initialize_db, write_expense, write_expenses, read_expenses, process_recurring_expenses,
+    get_recent_and_future_expenses, get_weekly_expenses_amount, get_monthly_expenses_amount,
+    make_cursor, iter_expenses, iter_expenses_by_page, get_dashboard_summary, delete_expense,
+    rebuild_daily_totals, search_expenses, update_expense, get_changes, sync_expenses,
+)
+from expense import Expense, to_cents
 
 
 class TestDBStorage(unittest.TestCase):
@@ -20,8 +29,10 @@ class TestDBStorage(unittest.TestCase):
         """
         Runs after each test. Removes the test database.
         """
-        if os.path.exists(self.TEST_DB):
-            os.remove(self.TEST_DB)
+        close_connections()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.TEST_DB + suffix):
+                os.remove(self.TEST_DB + suffix)
 
     def test_initialize_db(self):
         """
@@ -95,9 +106,55 @@ class TestDBStorage(unittest.TestCase):
         # Verify the expenses match
         self.assertEqual(len(result), len(expenses))
         for i, expense in enumerate(expenses):
-            self.assertEqual(result[i]["name"], expense["name"])
-            self.assertEqual(result[i]["category"], expense["category"])
-            self.assertEqual(result[i]["amount"], expense["amount"])
+            self.assertEqual(result[i].name, expense["name"])
+            self.assertEqual(result[i].category, expense["category"])
+            self.assertEqual(result[i].amount_cents, to_cents(expense["amount"]))
+
+    def test_expense_objects_round_trip(self):
+        """
+        Test that Expense objects can be written and come back equal, with parsed dates.
+        """
+        expense = Expense("Lunch", "Food", 1250, datetime.date(2025, 1, 15))
+        write_expense(expense, self.TEST_DB)
+
+        (stored,) = read_expenses(self.TEST_DB)
+        self.assertEqual(stored.date_added, datetime.date(2025, 1, 15))
+        self.assertEqual(stored.amount, "12.50")
+        self.assertEqual(stored.to_dict(), expense.to_dict())
+        self.assertFalse(hasattr(stored, "__dict__"))
+
+    def test_write_expenses_inserts_in_batches_and_collects_errors(self):
+        """
+        Test bulk inserting expenses, skipping and reporting invalid ones.
+        """
+        expenses = (
+            {"name": f"Item {i}", "category": "Food", "amount": "1.10", "date_added": "2025-01-15"}
+            for i in range(5)
+        )
+        rows = list(expenses)
+        rows.insert(2, {"name": "Bad amount", "category": "Food", "amount": "abc", "date_added": "2025-01-15"})
+        rows.insert(4, {"name": "No date", "category": "Food", "amount": "1"})
+
+        inserted, errors = write_expenses(iter(rows), self.TEST_DB, batch_size=2)
+
+        self.assertEqual(inserted, 5)
+        self.assertEqual([position for position, _ in errors], [3, 5])
+        self.assertEqual([e.name for e in read_expenses(self.TEST_DB)], [f"Item {i}" for i in range(5)])
+
+    def test_connection_is_reused_and_uses_wal(self):
+        """
+        Test that storage calls share one configured connection per thread.
+        """
+        conn = get_connection(self.TEST_DB)
+        self.assertIs(conn, get_connection(self.TEST_DB))
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1)  # NORMAL
+
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(get_connection(self.TEST_DB)))
+        thread.start()
+        thread.join()
+        self.assertIsNot(seen[0], conn)
 
 
 class TestRecurringExpenses(unittest.TestCase):
@@ -120,8 +177,10 @@ class TestRecurringExpenses(unittest.TestCase):
 
     def tearDown(self):
         # Remove the test database file
-        if os.path.exists(self.TEST_DB):
-            os.remove(self.TEST_DB)
+        close_connections()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.TEST_DB + suffix):
+                os.remove(self.TEST_DB + suffix)
 
     def test_process_recurring_expenses(self):
         # Mock only the `today` method of `datetime.date`
@@ -137,8 +196,458 @@ class TestRecurringExpenses(unittest.TestCase):
         # Verify that the recurring expense was processed
         expenses = read_expenses(self.TEST_DB)
         self.assertEqual(len(expenses), 2)  # Original + new recurring expense
-        self.assertEqual(expenses[-1]["date_added"], "2025-01-02")  # Date of the new recurring expense
-        self.assertEqual(expenses[-1]["name"], "Gym Membership")  # Check if it's the same expense
+        self.assertEqual(expenses[-1].date_added, datetime.date(2025, 1, 2))  # Date of the new recurring expense
+        self.assertEqual(expenses[-1].name, "Gym Membership")  # Check if it's the same expense
+
+
+    def _occurrences(self):
+        conn = get_connection(self.TEST_DB)
+        return [row[0] for row in conn.execute(
+            "SELECT date_added FROM expenses WHERE template_id IS NOT NULL ORDER BY date_added")]
+
+    def test_missed_occurrences_are_caught_up_with_month_end_handling(self):
+        write_expense({"name": "Rent", "category": "Utilities", "amount": "900", "date_added": "2025-01-31",
+                       "recurring": 1, "recurring_schedule": "monthly"}, self.TEST_DB)
+        conn = get_connection(self.TEST_DB)
+        with conn:
+            conn.execute("DELETE FROM expenses WHERE name = 'Gym Membership'")
+
+        added = process_recurring_expenses(self.TEST_DB, today=datetime.date(2025, 4, 30))
+
+        self.assertEqual(added, 3)
+        self.assertEqual(self._occurrences(), ["2025-02-28", "2025-03-31", "2025-04-30"])
+        next_due = conn.execute("SELECT next_due FROM expenses WHERE name = 'Rent' AND recurring = 1").fetchone()
+        self.assertEqual(next_due[0], "2025-05-31")
+
+    def test_processing_is_idempotent(self):
+        process_recurring_expenses(self.TEST_DB, today=datetime.date(2025, 1, 5))
+        self.assertEqual(process_recurring_expenses(self.TEST_DB, today=datetime.date(2025, 1, 5)), 0)
+
+        # Even a template whose next_due was never advanced cannot charge twice
+        conn = get_connection(self.TEST_DB)
+        with conn:
+            conn.execute("UPDATE expenses SET next_due = '2025-01-02' WHERE recurring = 1")
+        process_recurring_expenses(self.TEST_DB, today=datetime.date(2025, 1, 5))
+        self.assertEqual(self._occurrences(), ["2025-01-02", "2025-01-03", "2025-01-04", "2025-01-05"])
+
+    def test_concurrent_runs_do_not_double_charge(self):
+        threads = [
+            threading.Thread(target=process_recurring_expenses,
+                             args=(self.TEST_DB, datetime.date(2025, 1, 10)))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self._occurrences()), 9)
+
+    def test_editing_a_template_does_not_recharge_deleted_occurrences(self):
+        conn = get_connection(self.TEST_DB)
+        with conn:
+            conn.execute("DELETE FROM expenses")
+        rent = {"name": "Rent", "category": "Housing", "amount": "900", "date_added": "2025-01-01",
+                "recurring": 1, "recurring_schedule": "monthly"}
+        template_id = write_expense(rent, self.TEST_DB)
+        self.assertEqual(process_recurring_expenses(self.TEST_DB, today=datetime.date(2025, 4, 1)), 3)
+        with conn:
+            conn.execute("DELETE FROM expenses WHERE date_added = '2025-02-01' AND template_id IS NOT NULL")
+
+        self.assertTrue(update_expense(template_id, {**rent, "name": "Flat rent"}, self.TEST_DB))
+        self.assertEqual(process_recurring_expenses(self.TEST_DB, today=datetime.date(2025, 4, 1)), 0)
+        self.assertEqual(self._occurrences(), ["2025-03-01", "2025-04-01"])
+
+        # A new schedule resumes where the old one stopped, not from date_added
+        self.assertTrue(update_expense(template_id, {**rent, "recurring_schedule": "weekly"}, self.TEST_DB))
+        next_due = conn.execute("SELECT next_due FROM expenses WHERE id = ?", (template_id,)).fetchone()[0]
+        self.assertEqual(next_due, "2025-05-01")
+        self.assertEqual(process_recurring_expenses(self.TEST_DB, today=datetime.date(2025, 4, 30)), 0)
+
+        # Turning it off clears the schedule
+        self.assertTrue(update_expense(template_id, {**rent, "recurring": 0}, self.TEST_DB))
+        self.assertIsNone(conn.execute("SELECT next_due FROM expenses WHERE id = ?", (template_id,)).fetchone()[0])
+
+    def test_only_due_templates_are_read(self):
+        conn = get_connection(self.TEST_DB)
+        statements = []
+        conn.set_trace_callback(statements.append)
+        process_recurring_expenses(self.TEST_DB, today=datetime.date(2025, 1, 2))
+        conn.set_trace_callback(None)
+
+        select = next(sql for sql in statements if sql.lstrip().startswith("SELECT"))
+        plan = conn.execute("EXPLAIN QUERY PLAN " + select).fetchall()
+        self.assertIn("idx_expenses_next_due", plan[0][3])
+
+    def test_migration_folds_legacy_copies_into_one_template(self):
+        conn = get_connection(self.TEST_DB)
+        with conn:
+            conn.execute("DELETE FROM expenses")
+            # Rows left behind by the previous engine: all flagged recurring
+            conn.executemany("""
+                INSERT INTO expenses (name, category, amount, amount_cents, date_added, recurring, recurring_schedule)
+                VALUES ('Gym', 'Health', '50.00', 5000, ?, 1, 'weekly')
+            """, [("2025-01-08",), ("2025-01-08",), ("2025-01-08",)])
+            conn.execute("UPDATE expenses SET next_due = NULL, template_id = NULL")
+            conn.execute("DROP INDEX idx_expenses_occurrence")
+        conn.execute("PRAGMA user_version = 3")
+
+        migrate(conn)
+
+        rows = conn.execute("SELECT recurring, template_id, next_due FROM expenses ORDER BY id").fetchall()
+        template_id = conn.execute("SELECT MIN(id) FROM expenses").fetchone()[0]
+        self.assertEqual(rows, [(1, None, "2025-01-15"), (0, template_id, None), (0, None, None)])
+
+
+class TestSummaryQueries(unittest.TestCase):
+    TEST_DB = "test_expenses.db"
+    TODAY = datetime.date(2025, 1, 15)  # A Wednesday
+
+    def setUp(self):
+        initialize_db(self.TEST_DB)
+        for name, amount, date_added in [
+            ("Old", "100", "2024-12-31"),
+            ("Monday", "10", "2025-01-13"),
+            ("Lunch", "12.50", "2025-01-15"),
+            ("Sunday", "5", "2025-01-19"),
+            ("Next Week", "20", "2025-01-20"),
+            ("Month End", "7", "2025-01-31"),
+            ("Next Month", "30", "2025-02-01"),
+        ]:
+            write_expense({"name": name, "category": "Food", "amount": amount, "date_added": date_added},
+                          self.TEST_DB)
+
+    def tearDown(self):
+        close_connections()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.TEST_DB + suffix):
+                os.remove(self.TEST_DB + suffix)
+
+    def _query_plans(self, func):
+        """
+        Run `func` and return the query plan of every SELECT it executed.
+        """
+        conn = get_connection(self.TEST_DB)
+        statements = []
+        conn.set_trace_callback(statements.append)
+        try:
+            func()
+        finally:
+            conn.set_trace_callback(None)
+        return [
+            " | ".join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql))
+            for sql in statements if sql.lstrip().upper().startswith("SELECT")
+        ]
+
+    def test_weekly_total_uses_monday_to_sunday_range(self):
+        self.assertEqual(get_weekly_expenses_amount(self.TEST_DB, today=self.TODAY), 2750)
+
+    def test_monthly_total_uses_calendar_month_range(self):
+        self.assertEqual(get_monthly_expenses_amount(self.TEST_DB, today=self.TODAY), 5450)
+
+    def test_recent_expenses_are_newest_first(self):
+        names = [e.name for e in get_recent_and_future_expenses(self.TEST_DB, today=self.TODAY)]
+        self.assertEqual(names, ["Next Month", "Month End", "Next Week", "Sunday", "Lunch", "Monday"])
+
+    def test_dashboard_summary_matches_individual_queries(self):
+        write_expense({"name": "Bus", "category": "Transport", "amount": "3", "date_added": "2025-01-15"},
+                      self.TEST_DB)
+        summary = get_dashboard_summary(self.TEST_DB, today=self.TODAY)
+
+        self.assertEqual(summary.daily_cents, 1550)
+        self.assertEqual(summary.weekly_cents, get_weekly_expenses_amount(self.TEST_DB, today=self.TODAY))
+        self.assertEqual(summary.monthly_cents, get_monthly_expenses_amount(self.TEST_DB, today=self.TODAY))
+        self.assertEqual([(t.category, t.daily_cents, t.weekly_cents, t.monthly_cents) for t in summary.categories],
+                         [("Food", 1250, 2750, 5450), ("Transport", 300, 300, 300)])
+        self.assertEqual(summary.recent_expenses,
+                         get_recent_and_future_expenses(self.TEST_DB, today=self.TODAY))
+
+    def _assert_daily_totals_consistent(self):
+        conn = get_connection(self.TEST_DB)
+        expected = conn.execute("""
+            SELECT date_added, category, SUM(amount_cents), COUNT(*)
+            FROM expenses GROUP BY date_added, category ORDER BY 1, 2
+        """).fetchall()
+        actual = conn.execute("SELECT date, category, total_cents, count FROM daily_totals ORDER BY 1, 2").fetchall()
+        self.assertEqual(actual, expected)
+
+    def test_daily_totals_follow_inserts_updates_and_deletes(self):
+        self._assert_daily_totals_consistent()
+        conn = get_connection(self.TEST_DB)
+        with conn:
+            conn.execute("UPDATE expenses SET amount_cents = 999, category = 'Treats' WHERE name = 'Lunch'")
+            conn.execute("UPDATE expenses SET date_added = '2025-01-14' WHERE name = 'Monday'")
+        delete_expense(1, self.TEST_DB)
+        self._assert_daily_totals_consistent()
+        self.assertEqual(get_weekly_expenses_amount(self.TEST_DB, today=self.TODAY), 2499)
+
+    def test_rebuild_daily_totals(self):
+        conn = get_connection(self.TEST_DB)
+        with conn:
+            conn.execute("DELETE FROM daily_totals")
+        rebuild_daily_totals(self.TEST_DB)
+        self._assert_daily_totals_consistent()
+
+    def test_summary_queries_do_not_scan_the_table(self):
+        for func in (
+            lambda: get_weekly_expenses_amount(self.TEST_DB, today=self.TODAY),
+            lambda: get_monthly_expenses_amount(self.TEST_DB, today=self.TODAY),
+            lambda: get_recent_and_future_expenses(self.TEST_DB, today=self.TODAY),
+            lambda: get_dashboard_summary(self.TEST_DB, today=self.TODAY),
+        ):
+            plans = self._query_plans(func)
+            self.assertTrue(plans)
+            for plan in plans:
+                self.assertNotIn("SCAN", plan)
+                self.assertNotIn("TEMP B-TREE FOR ORDER BY", plan)
+
+    def test_paginated_read_uses_indexes(self):
+        cursor = make_cursor(Expense("Lunch", "Food", 1250, datetime.date(2025, 1, 15), id=3), "date_desc")
+        for kwargs in (
+            {"sort": "date_desc", "after": cursor},
+            {"sort": "date_desc", "before": cursor},
+            {"sort": "date_asc", "category": "Food", "start_date": "2025-01-01"},
+            {"sort": "amount_desc", "min_amount_cents": 500},
+        ):
+            for plan in self._query_plans(lambda: read_expenses(self.TEST_DB, limit=2, **kwargs)):
+                self.assertNotIn("SCAN", plan)
+                self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_keyset_pages_cover_every_row_once(self):
+        pages, after = [], None
+        while True:
+            page = read_expenses(self.TEST_DB, sort="amount_desc", after=after, limit=3)
+            if not page:
+                break
+            pages.append([e.name for e in page])
+            after = make_cursor(page[-1], "amount_desc")
+        self.assertEqual(pages, [
+            ["Old", "Next Month", "Next Week"],
+            ["Lunch", "Monday", "Month End"],
+            ["Sunday"],
+        ])
+
+        previous = read_expenses(self.TEST_DB, sort="amount_desc", before=make_cursor(
+            Expense("Lunch", "Food", 1250, datetime.date(2025, 1, 15), id=3), "amount_desc"), limit=2)
+        self.assertEqual([e.name for e in previous], ["Next Month", "Next Week"])
+
+    def test_iter_expenses_streams_in_batches(self):
+        expenses = iter_expenses(self.TEST_DB, sort="date_asc", batch_size=2)
+        self.assertEqual(next(expenses).name, "Old")
+        self.assertEqual([e.name for e in expenses],
+                         ["Monday", "Lunch", "Sunday", "Next Week", "Month End", "Next Month"])
+
+    def test_iter_expenses_by_page_walks_every_row(self):
+        names = [e.name for e in iter_expenses_by_page(self.TEST_DB, page_size=2, sort="date_desc")]
+        self.assertEqual(names, ["Next Month", "Month End", "Next Week", "Sunday", "Lunch", "Monday", "Old"])
+
+    def test_iter_expenses_validates_arguments_eagerly(self):
+        with self.assertRaises(ValueError):
+            iter_expenses(self.TEST_DB, sort="name")
+
+    def test_initialize_db_creates_indexes(self):
+        conn = get_connection(self.TEST_DB)
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        self.assertTrue({
+            "idx_expenses_date_added",
+            "idx_expenses_category_date_added",
+            "idx_expenses_recurring",
+        } <= indexes)
+
+
+class TestSearch(unittest.TestCase):
+    TEST_DB = "test_expenses.db"
+
+    def setUp(self):
+        initialize_db(self.TEST_DB)
+        write_expenses([
+            {"name": "Netflix family plan", "category": "Entertainment", "amount": "20", "date_added": "2025-01-01"},
+            {"name": "Cinema", "category": "Netflix", "amount": "5", "date_added": "2025-01-02"},
+            {"name": "Netflix", "category": "Entertainment", "amount": "15", "date_added": "2025-01-03"},
+            {"name": "Lunch", "category": "Food", "amount": "12.50", "date_added": "2025-01-04"},
+            {"name": "Café Crème", "category": "Food", "amount": "3", "date_added": "2025-01-05"},
+        ], self.TEST_DB)
+
+    def tearDown(self):
+        close_connections()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.TEST_DB + suffix):
+                os.remove(self.TEST_DB + suffix)
+
+    def _names(self, query, **kwargs):
+        return [expense.name for expense in search_expenses(query, self.TEST_DB, **kwargs).expenses]
+
+    def test_prefix_matches_ranked_by_relevance(self):
+        # Short names beat long ones, and name matches beat category matches
+        self.assertEqual(self._names("net"), ["Netflix", "Netflix family plan", "Cinema"])
+        self.assertEqual(self._names("NETFLIX fam"), ["Netflix family plan"])
+        self.assertEqual(self._names("cafe creme"), ["Café Crème"])
+        self.assertEqual(self._names("netflix", min_amount_cents=1000, end_date="2025-01-03"),
+                         ["Netflix family plan"])
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(self._names('lunch" OR *'), [])
+        self.assertEqual(self._names("-lunch:"), ["Lunch"])
+        self.assertEqual(self._names("?! "), [])
+
+    def test_index_follows_updates_and_deletes(self):
+        lunch = read_expenses(self.TEST_DB, search="lunch")[0]
+        update_expense(lunch.id, {"name": "Brunch", "category": "Food", "amount": "12.50",
+                                  "date_added": "2025-01-04"}, self.TEST_DB)
+        self.assertEqual(self._names("lunch"), [])
+        self.assertEqual(self._names("brunch"), ["Brunch"])
+        delete_expense(lunch.id, self.TEST_DB)
+        self.assertEqual(self._names("brunch"), [])
+
+    def test_pages_cover_every_match_across_rank_windows(self):
+        write_expenses([{"name": f"Taxi {i}", "category": "Transport", "amount": str(i),
+                         "date_added": "2025-02-01"} for i in range(1, 11)], self.TEST_DB)
+        with patch("db_storage.SEARCH_RANK_WINDOW", 3):
+            names, after = [], None
+            while True:
+                results = search_expenses("taxi", self.TEST_DB, limit=4, after=after)
+                names += [expense.name for expense in results.expenses]
+                after = results.next
+                if after is None:
+                    break
+        self.assertEqual(sorted(names, key=lambda name: int(name.split()[1])),
+                         [f"Taxi {i}" for i in range(1, 11)])
+        self.assertEqual(names[:3], ["Taxi 10", "Taxi 9", "Taxi 8"])  # Ties: newest first
+        with self.assertRaises(ValueError):
+            search_expenses("taxi", self.TEST_DB, after="nope")
+
+    def test_search_filter_keeps_list_sorting(self):
+        names = [expense.name for expense in read_expenses(self.TEST_DB, search="netflix", sort="amount_asc")]
+        self.assertEqual(names, ["Cinema", "Netflix", "Netflix family plan"])
+
+
+class TestChanges(unittest.TestCase):
+    TEST_DB = "test_expenses.db"
+
+    def setUp(self):
+        initialize_db(self.TEST_DB)
+        write_expenses([{"name": f"Expense {i}", "category": "Food", "amount": str(i),
+                         "date_added": "2025-01-15"} for i in range(1, 6)], self.TEST_DB)
+        self.cursor = get_changes(self.TEST_DB).cursor
+
+    def tearDown(self):
+        close_connections()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.TEST_DB + suffix):
+                os.remove(self.TEST_DB + suffix)
+
+    def _expense(self, name):
+        return {"name": name, "category": "Food", "amount": "9", "date_added": "2025-01-16"}
+
+    def test_changes_page_through_the_latest_state_of_each_expense(self):
+        first = get_changes(self.TEST_DB, limit=3)
+        self.assertEqual([change.expense.name for change in first.changes], ["Expense 1", "Expense 2", "Expense 3"])
+        self.assertTrue(first.has_more)
+        rest = get_changes(self.TEST_DB, since=first.cursor)
+        self.assertEqual([change.id for change in rest.changes], [4, 5])
+        self.assertFalse(rest.has_more)
+
+        update_expense(2, self._expense("Renamed"), self.TEST_DB)
+        update_expense(2, self._expense("Renamed again"), self.TEST_DB)
+        delete_expense(3, self.TEST_DB)
+        process_recurring_expenses(self.TEST_DB)  # Touches no synced field
+        changes = get_changes(self.TEST_DB, since=self.cursor)
+        self.assertEqual([(change.id, change.expense and change.expense.name) for change in changes.changes],
+                         [(2, "Renamed again"), (3, None)])
+        self.assertEqual(get_changes(self.TEST_DB, since=changes.cursor), ([], changes.cursor, False))
+
+    def test_sync_applies_changes_and_reports_conflicts(self):
+        seqs = {change.id: change.seq for change in get_changes(self.TEST_DB).changes}
+        update_expense(2, self._expense("Changed on the server"), self.TEST_DB)
+
+        results = sync_expenses([
+            (None, None, self._expense("Created offline")),
+            (1, seqs[1], self._expense("Edited offline")),
+            (2, seqs[2], self._expense("Edited offline too")),
+            (3, seqs[3], None),
+            (4, seqs[4], {"name": "No date"}),
+            (99, 1, None),
+        ], self.TEST_DB)
+
+        self.assertEqual([result.status for result in results],
+                         ["applied", "applied", "conflict", "applied", "invalid", "invalid"])
+        self.assertEqual(results[2].expense.name, "Changed on the server")
+        changes = get_changes(self.TEST_DB, since=self.cursor).changes
+        self.assertEqual([(change.id, change.seq) for change in changes[1:]],
+                         [(result.id, result.seq) for result in results[:4] if result.status == "applied"])
+        self.assertEqual({expense.name for expense in read_expenses(self.TEST_DB)},
+                         {"Expense 4", "Expense 5", "Edited offline", "Changed on the server", "Created offline"})
+
+        # Editing a deleted expense conflicts with its tombstone
+        result, = sync_expenses([(3, results[3].seq, self._expense("Revived"))], self.TEST_DB)
+        self.assertEqual((result.status, result.expense), ("conflict", None))
+
+
+class TestMigrations(unittest.TestCase):
+    TEST_DB = "test_expenses.db"
+
+    def setUp(self):
+        # A database created by the original schema, before any migration
+        conn = get_connection(self.TEST_DB)
+        with conn:
+            conn.execute("""
+                CREATE TABLE expenses (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    amount TEXT NOT NULL,
+                    date_added TEXT DEFAULT (DATE('now')),
+                    recurring INTEGER DEFAULT 0,
+                    recurring_schedule TEXT
+                )
+            """)
+            conn.executemany(
+                "INSERT INTO expenses (name, category, amount, date_added) VALUES (?, ?, ?, ?)",
+                [(f"Expense {i}", "Food", f"{i}.25", "2025-01-15") for i in range(1, 8)],
+            )
+
+    def tearDown(self):
+        close_connections()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.TEST_DB + suffix):
+                os.remove(self.TEST_DB + suffix)
+
+    def _amounts(self):
+        conn = get_connection(self.TEST_DB)
+        return [row[0] for row in conn.execute("SELECT amount_cents FROM expenses ORDER BY id")]
+
+    def test_migrate_converts_amounts_to_cents_in_batches(self):
+        conn = get_connection(self.TEST_DB)
+        self.assertEqual(migrate(conn, batch_size=3), len(MIGRATIONS))
+        self.assertEqual(self._amounts(), [125, 225, 325, 425, 525, 625, 725])
+
+    def test_migrate_resumes_an_interrupted_backfill(self):
+        conn = get_connection(self.TEST_DB)
+        # Simulate a run that added the column and converted two rows before stopping
+        with conn:
+            conn.execute("ALTER TABLE expenses ADD COLUMN amount_cents INTEGER")
+            conn.execute("UPDATE expenses SET amount_cents = -1 WHERE id <= 2")
+        self.assertEqual(get_schema_version(conn), 0)
+
+        migrate(conn, batch_size=2)
+
+        self.assertEqual(self._amounts(), [-1, -1, 325, 425, 525, 625, 725])
+        self.assertEqual(get_schema_version(conn), len(MIGRATIONS))
+
+    def test_initialize_db_migrates_existing_database(self):
+        initialize_db(self.TEST_DB)
+        write_expense({"name": "Lunch", "category": "Food", "amount": "12.5", "date_added": "2025-01-15"},
+                      self.TEST_DB)
+        self.assertEqual(self._amounts()[-2:], [725, 1250])
+
+    def test_existing_expenses_are_indexed_for_search(self):
+        initialize_db(self.TEST_DB)
+        self.assertEqual([expense.name for expense in search_expenses("expense", self.TEST_DB, limit=3).expenses],
+                         ["Expense 7", "Expense 6", "Expense 5"])
+
+    def test_existing_expenses_are_logged_for_sync(self):
+        conn = get_connection(self.TEST_DB)
+        migrate(conn, batch_size=3)
+        self.assertEqual([change.id for change in get_changes(self.TEST_DB).changes], list(range(1, 8)))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,142 @@
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+import metrics
+from db_connection import close_connections, get_connection
+from db_storage import initialize_db, write_expense, read_expenses
+
+
+class TestMetrics(unittest.TestCase):
+    TEST_DB = "test_metrics.db"
+
+    def setUp(self):
+        initialize_db(self.TEST_DB)
+        metrics.registry.reset()
+        self.directory = tempfile.mkdtemp()
+        # Another test module may have imported the app, which shares its metrics through a directory
+        directory = patch.object(metrics, "_directory", None)
+        directory.start()
+        self.addCleanup(directory.stop)
+
+    def tearDown(self):
+        close_connections()
+        shutil.rmtree(self.directory)
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.TEST_DB + suffix):
+                os.remove(self.TEST_DB + suffix)
+
+    def _values(self, name):
+        return metrics.registry.values()[name]
+
+    def test_statements_and_storage_calls_are_timed(self):
+        write_expense({"name": "Lunch", "category": "Food", "amount": "12.50", "date_added": "2025-01-15"},
+                      self.TEST_DB)
+        read_expenses(self.TEST_DB)
+
+        calls = self._values("storage_call_seconds")
+        self.assertEqual(calls[(("function", "write_expense"),)][-1], 1)
+        self.assertEqual(calls[(("function", "read_expenses"),)][-1], 1)
+
+        statements = {dict(labels)["statement"]: counts
+                      for labels, counts in self._values("sqlite_statement_seconds").items()}
+        insert = next(s for s in statements if s.startswith("INSERT INTO expenses"))
+        select = next(s for s in statements if s.startswith("SELECT id, name"))
+        self.assertEqual(statements[insert][-1], 1)
+        rows = {dict(labels)["statement"]: count for labels, count in self._values("sqlite_rows_total").items()}
+        self.assertEqual(rows[insert], 1)
+        self.assertEqual(rows[select], 1)
+
+    def test_statement_labels_do_not_depend_on_values(self):
+        conn = get_connection(self.TEST_DB)
+        conn.execute("SELECT COUNT(*) FROM expenses WHERE id IN (1, 2) AND name = 'a'")
+        conn.execute("SELECT COUNT(*) FROM expenses WHERE id IN (3, 4, 5) AND name = 'it''s'")
+        statements = [dict(labels)["statement"] for labels in self._values("sqlite_statement_seconds")]
+        self.assertEqual(statements, ["SELECT COUNT(*) FROM expenses WHERE id IN (?) AND name = ?"])
+
+        with patch.object(metrics, "MAX_STATEMENT_LABELS", 0):
+            conn.execute("SELECT COUNT(*) FROM expenses WHERE amount_cents > 7")
+        self.assertIn((("statement", "other"),), self._values("sqlite_statement_seconds"))
+
+    def test_threads_are_summed_including_exited_ones(self):
+        def record():
+            for _ in range(1000):
+                metrics.registry.inc("storage_errors_total", (("function", "f"),))
+
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        record()
+        self.assertEqual(self._values("storage_errors_total"), {(("function", "f"),): 5000})
+        self.assertEqual(self._values("storage_errors_total"), {(("function", "f"),): 5000})  # Folded in once
+        self.assertEqual(len(metrics.registry._threads), 1)  # The exited threads were folded in
+
+    def test_busy_errors_and_lock_waits_are_counted(self):
+        conn = get_connection(self.TEST_DB)
+        conn.execute("PRAGMA busy_timeout = 0")
+        with sqlite3.connect(self.TEST_DB) as other:
+            other.execute("BEGIN IMMEDIATE")
+            with self.assertRaises(sqlite3.OperationalError):
+                conn.execute("BEGIN IMMEDIATE")
+            other.rollback()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.rollback()
+
+        self.assertEqual(sum(self._values("sqlite_busy_total").values()), 1)
+        self.assertEqual(self._values("sqlite_errors_total"), {(("error", "SQLITE_BUSY"),): 1})
+        self.assertEqual(self._values("sqlite_lock_wait_seconds")[()][-1], 2)
+
+    def test_slow_statements_are_logged(self):
+        with patch.object(metrics, "SLOW_QUERY_SECONDS", 0), self.assertLogs("metrics", "WARNING") as logs:
+            get_connection(self.TEST_DB).execute("SELECT   COUNT(*)\n FROM expenses")
+        self.assertIn("SELECT COUNT(*) FROM expenses", logs.output[0])
+        self.assertEqual(sum(self._values("sqlite_slow_statements_total").values()), 1)
+
+    def test_render_merges_processes(self):
+        read_expenses(self.TEST_DB)
+        other = {
+            "storage_call_seconds": [[[["function", "read_expenses"]], [0] * 14 + [1, 0.5, 1]]],
+            "storage_errors_total": [[[["function", "read_expenses"]], 2]],
+        }
+        with open(os.path.join(self.directory, f"{os.getppid()}.json"), "w") as file:
+            json.dump(other, file)
+
+        text = metrics.render(self.directory)
+        self.assertIn('storage_call_seconds_count{function="read_expenses"} 2', text)
+        self.assertIn('storage_call_seconds_bucket{function="read_expenses",le="+Inf"} 2', text)
+        self.assertIn('storage_errors_total{function="read_expenses"} 2', text)
+        self.assertIn("# TYPE sqlite_statement_seconds histogram", text)
+        self.assertTrue(os.path.exists(os.path.join(self.directory, f"{os.getpid()}.json")))
+
+    def test_snapshots_of_exited_processes_are_removed(self):
+        exited = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"],
+                                capture_output=True, text=True, check=True).stdout.strip()
+        with open(os.path.join(self.directory, f"{exited}.json"), "w") as file:
+            json.dump({"storage_errors_total": [[[["function", "read_expenses"]], 2]]}, file)
+
+        self.assertNotIn("storage_errors_total{", metrics.render(self.directory))
+        self.assertEqual(os.listdir(self.directory), [f"{os.getpid()}.json"])
+
+    def test_overflow_bucket(self):
+        metrics.registry.observe("storage_call_seconds", (), 60.0)
+        text = metrics.render()
+        self.assertIn('storage_call_seconds_bucket{le="10.0"} 0', text)
+        self.assertIn('storage_call_seconds_bucket{le="+Inf"} 1', text)
+        self.assertIn("storage_call_seconds_sum 60.0", text)
+
+    def test_label_values_are_escaped(self):
+        metrics.registry.inc("sqlite_errors_total", (("error", 'say "hi"\n'),))
+        self.assertIn('sqlite_errors_total{error="say \\"hi\\"\\n"} 1', metrics.render())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import csv
+import datetime
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stderr
+
+import reports
+from db_connection import close_connections
+from db_storage import initialize_db, write_expense
+
+
+class TestReports(unittest.TestCase):
+    START, END = datetime.date(2025, 1, 1), datetime.date(2025, 2, 28)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.databases = []
+        for tenant in range(3):
+            db_name = os.path.join(self.directory, f"tenant{tenant}.db")
+            initialize_db(db_name)
+            for day, category, amount in (("2025-01-10", "Food", "10"), ("2025-02-03", "Transport", "5"),
+                                          ("2025-03-01", "Food", "100")):
+                write_expense({"name": "Expense", "category": category, "amount": str(int(amount) * (tenant + 1)),
+                               "date_added": day}, db_name)
+            self.databases.append(db_name)
+        write_expense({"name": "Gym", "category": "Health", "amount": "30", "date_added": "2025-01-05",
+                       "recurring": True, "recurring_schedule": "monthly"}, self.databases[0])
+        close_connections()
+
+    def tearDown(self):
+        close_connections()
+        shutil.rmtree(self.directory)
+
+    def test_report_of_one_database(self):
+        report = reports.report_database(self.databases[0], self.START, self.END)
+        self.assertEqual(report["total_cents"], 4500)
+        self.assertEqual(report["months"], {"2025-01": {"total_cents": 4000, "count": 2},
+                                            "2025-02": {"total_cents": 500, "count": 1}})
+        self.assertEqual(list(report["categories"]), ["Health", "Food", "Transport"])
+        self.assertEqual([template["name"] for template in report["recurring"]["templates"]], ["Gym"])
+
+    def test_parallel_reports_match_serial_ones(self):
+        serial = reports.generate_reports(self.databases, self.START, self.END, workers=1)
+        parallel = reports.generate_reports(self.databases, self.START, self.END, workers=2, chunksize=1)
+        self.assertEqual(parallel, serial)
+        self.assertEqual([report["database"] for report in parallel["databases"]], self.databases)
+        totals = parallel["totals"]
+        self.assertEqual((totals["databases"], totals["total_cents"], totals["count"]), (3, 12000, 7))
+        self.assertEqual(totals["categories"]["Food"], {"total_cents": 6000, "count": 3})
+        self.assertEqual(totals["recurring"]["templates"], 1)
+
+    def test_cli_writes_consolidated_output_and_reports_errors(self):
+        missing = os.path.join(self.directory, "missing.db")
+        output = os.path.join(self.directory, "report.json")
+        with redirect_stderr(io.StringIO()) as stderr:
+            status = reports.main([*self.databases, missing, "--start", "2025-01-01", "--end", "2025-02-28",
+                                   "--workers", "2", "--output", output])
+        self.assertEqual(status, 1)
+        self.assertIn("missing.db", stderr.getvalue())
+        with open(output) as file:
+            document = json.load(file)
+        self.assertEqual(document["totals"]["total_cents"], 12000)
+        self.assertEqual([error["database"] for error in document["errors"]], [missing])
+        self.assertFalse(os.path.exists(missing))  # Read-only: never created
+
+        output = os.path.join(self.directory, "report.csv")
+        self.assertEqual(reports.main([*self.databases, "--start", "2025-01-01", "--end", "2025-02-28",
+                                       "--format", "csv", "--output", output]), 0)
+        with open(output, newline="") as file:
+            rows = list(csv.DictReader(file))
+        self.assertIn({"database": "TOTAL", "section": "month", "key": "2025-01", "total_cents": "9000",
+                       "count": "4"}, rows)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import datetime
+import os
+import time
+import unittest
+
+from db_connection import close_connections
+from db_storage import initialize_db, write_expense, read_expenses
+from scheduler import RecurringScheduler, JOB_NAME
+
+
+class TestRecurringScheduler(unittest.TestCase):
+    TEST_DB = "test_expenses.db"
+
+    def setUp(self):
+        initialize_db(self.TEST_DB)
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        write_expense({"name": "Gym Membership", "category": "Health", "amount": "50",
+                       "date_added": yesterday.isoformat(), "recurring": 1, "recurring_schedule": "daily"},
+                      self.TEST_DB)
+        self.schedulers = []
+
+    def tearDown(self):
+        for scheduler in self.schedulers:
+            scheduler.stop(timeout=5)
+        close_connections()
+        for path in (self.TEST_DB, f"{self.TEST_DB}-wal", f"{self.TEST_DB}-shm", f"{self.TEST_DB}.scheduler.lock"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _scheduler(self):
+        scheduler = RecurringScheduler(self.TEST_DB, interval=60)
+        self.schedulers.append(scheduler)
+        return scheduler
+
+    def _wait_for_run(self, scheduler):
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            if scheduler.status()["last_run"]:
+                return scheduler.status()["last_run"]
+            time.sleep(0.01)
+        self.fail("The scheduler did not run")
+
+    def test_runs_at_startup_and_records_the_run(self):
+        scheduler = self._scheduler().start()
+        last_run = self._wait_for_run(scheduler)
+
+        self.assertTrue(scheduler.status()["leader"])
+        self.assertEqual(last_run["last_result"], "1 added")
+        self.assertEqual(last_run["run_count"], 1)
+        self.assertEqual(len(read_expenses(self.TEST_DB)), 2)
+
+    def test_only_one_scheduler_holds_the_lock(self):
+        leader = self._scheduler()
+        follower = self._scheduler()
+        self.assertTrue(leader._acquire_leadership())
+        self.assertFalse(follower._acquire_leadership())
+
+    def test_run_now_runs_without_the_lock(self):
+        leader = self._scheduler()
+        leader._acquire_leadership()
+        follower = self._scheduler().start()
+        follower.run_now()
+        self.assertEqual(self._wait_for_run(follower)["last_result"], "1 added")
+        self.assertFalse(follower.status()["leader"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import db_connection
+from db_connection import close_connections, get_connection
+from db_storage import write_expense, read_expenses
+from scheduler import RecurringScheduler
+from shards import ShardRouter
+
+
+class TestShardRouter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.router = ShardRouter(self.directory)
+
+    def tearDown(self):
+        close_connections()
+        shutil.rmtree(self.directory)
+
+    def test_each_user_gets_their_own_database(self):
+        alice, bob = self.router.db_name("alice"), self.router.db_name("bob")
+        self.assertNotEqual(alice, bob)
+        self.assertEqual(self.router.db_name("alice"), alice)
+        self.assertNotEqual(self.router.path("Alice"), alice)
+        self.assertTrue(self.router.path("../../etc/passwd").startswith(self.directory))
+        with self.assertRaises(ValueError):
+            self.router.db_name("")
+
+        write_expense({"name": "Lunch", "category": "Food", "amount": "12", "date_added": "2025-01-15"}, alice)
+        self.assertEqual([expense.name for expense in read_expenses(alice)], ["Lunch"])
+        self.assertEqual(read_expenses(bob), [])
+        self.assertEqual(self.router.db_names(), sorted([alice, bob]))
+
+    def test_databases_are_initialised_once_per_process(self):
+        with patch("shards.initialize_db") as initialize_db:
+            for _ in range(3):
+                self.router.db_name("carol")
+        self.assertEqual(initialize_db.call_count, 1)
+
+    def test_scheduler_processes_every_shard(self):
+        for user in ("alice", "bob"):
+            write_expense({"name": "Rent", "category": "Housing", "amount": "900", "date_added": "2025-01-01",
+                           "recurring": 1, "recurring_schedule": "monthly"}, self.router.db_name(user))
+        # Any initialised database can hold the run bookkeeping
+        scheduler = RecurringScheduler(self.router.db_name("bookkeeping"), databases=self.router.db_names)
+        self.assertGreater(scheduler.run_once(), 0)
+        for user in ("alice", "bob"):
+            self.assertGreater(len(read_expenses(self.router.db_name(user))), 1)
+
+
+class TestConnectionLimit(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.names = [os.path.join(self.directory, f"{i}.db") for i in range(3)]
+
+    def tearDown(self):
+        close_connections()
+        shutil.rmtree(self.directory)
+
+    def test_least_recently_used_connection_is_closed(self):
+        with patch.object(db_connection, "MAX_CONNECTIONS_PER_THREAD", 2):
+            first, second = get_connection(self.names[0]), get_connection(self.names[1])
+            self.assertIs(get_connection(self.names[0]), first)  # Now the most recently used
+            get_connection(self.names[2])
+
+            with self.assertRaises(sqlite3.ProgrammingError):
+                second.execute("SELECT 1")
+            self.assertEqual(first.execute("SELECT 1").fetchone(), (1,))
+            self.assertIsNot(get_connection(self.names[1]), second)
+
+    def test_connection_in_a_transaction_is_kept(self):
+        with patch.object(db_connection, "MAX_CONNECTIONS_PER_THREAD", 1):
+            busy = get_connection(self.names[0])
+            busy.execute("CREATE TABLE t (x)")
+            busy.execute("INSERT INTO t VALUES (1)")  # Opens a transaction
+            get_connection(self.names[1])
+            busy.commit()
+            self.assertEqual(busy.execute("SELECT x FROM t").fetchone(), (1,))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import sqlite3
+import threading
+import unittest
+from unittest.mock import patch
+
+import db_storage
+from db_connection import close_connections
+from db_storage import initialize_db, read_expenses, prepare_expense, insert_prepared_expenses
+from write_queue import WriteQueue
+
+
+def _expense(name):
+    return {"name": name, "category": "Food", "amount": "3.50", "date_added": "2025-01-15"}
+
+
+class TestWriteQueue(unittest.TestCase):
+    TEST_DB = "test_write_queue.db"
+
+    def setUp(self):
+        initialize_db(self.TEST_DB)
+        self.queue = WriteQueue(self.TEST_DB, max_delay=0.05)
+
+    def tearDown(self):
+        self.queue.stop()
+        close_connections()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.TEST_DB + suffix):
+                os.remove(self.TEST_DB + suffix)
+
+    def test_write_returns_once_committed(self):
+        expense_id = self.queue.write(_expense("Coffee"))
+        with sqlite3.connect(self.TEST_DB) as other:
+            self.assertEqual(other.execute("SELECT name FROM expenses WHERE id = ?", (expense_id,)).fetchone(),
+                             ("Coffee",))
+
+    def test_concurrent_writes_are_committed_in_groups(self):
+        groups = []
+
+        def insert(rows, db_name):
+            groups.append(len(rows))
+            return insert_prepared_expenses(rows, db_name)
+
+        with patch("write_queue.insert_prepared_expenses", insert):
+            # Hold the write lock, so expenses pile up behind the first group
+            with sqlite3.connect(self.TEST_DB) as blocker:
+                blocker.execute("BEGIN IMMEDIATE")
+                first = self.queue.submit(_expense("Item 0"))
+                futures = [self.queue.submit(_expense(f"Item {i}")) for i in range(1, 20)]
+                blocker.rollback()
+            ids = [first.result(5)] + [future.result(5) for future in futures]
+
+        self.assertEqual(ids, [expense.id for expense in read_expenses(self.TEST_DB)])
+        self.assertEqual(sum(groups), 20)
+        self.assertLess(len(groups), 20)
+
+    def test_invalid_expense_is_rejected_before_queueing(self):
+        with self.assertRaises(ValueError):
+            self.queue.submit({"name": "Coffee", "category": "Food", "amount": "abc", "date_added": "2025-01-15"})
+
+    def test_rejected_row_does_not_fail_its_group(self):
+        db_storage.get_connection(self.TEST_DB).execute("""
+            CREATE TRIGGER reject_bad BEFORE INSERT ON expenses WHEN new.name = 'Bad'
+            BEGIN SELECT RAISE(ABORT, 'rejected'); END
+        """)
+        results = insert_prepared_expenses([prepare_expense(_expense(name)) for name in ("A", "Bad", "B")],
+                                           self.TEST_DB)
+        self.assertIsInstance(results[1][1], sqlite3.IntegrityError)
+        self.assertEqual([expense.name for expense in read_expenses(self.TEST_DB)], ["A", "B"])
+        self.assertEqual([expense_id for expense_id, _ in results], [1, None, 2])
+
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.queue.write(_expense("Bad"))
+        self.assertIsNotNone(self.queue.write(_expense("C")))
+
+    def test_stop_commits_queued_expenses(self):
+        futures = [self.queue.submit(_expense(f"Item {i}")) for i in range(5)]
+        self.queue.stop()
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertEqual(len(read_expenses(self.TEST_DB)), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
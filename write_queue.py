@@ -0,0 +1,173 @@
+"""
+Group commit for expense inserts.
+
+Committing each expense on its own makes concurrent writers queue on
+SQLite's write lock and pay for one WAL sync per expense. A `WriteQueue`
+instead hands validated expenses to a single writer thread, which inserts
+everything that has accumulated in one transaction: a group starts with
+the oldest waiting expense and takes more for up to `max_delay` seconds or
+until it holds `max_batch` expenses. Under a burst, one commit (and one
+sync) acknowledges a whole group. A writer on its own does not wait: the
+queue only lingers for more expenses when the previous group had company.
+
+The writer's connection commits with `synchronous=FULL`, so when `write`
+returns, the expense is on disk, not just in the operating system's
+cache. Enable the queue for `/add_expense` and `POST /api/expenses` with
+`EXPENSES_WRITE_QUEUE=1`.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from db_connection import get_connection
+from db_storage import prepare_expense, insert_prepared_expenses
+from metrics import registry
+
+
+# Most expenses committed together, and the longest an expense waits for company
+MAX_BATCH = 256
+MAX_DELAY_SECONDS = 0.002
+
+# How long `write` waits for the commit before giving up
+WRITE_TIMEOUT_SECONDS = 30
+
+_STOP = object()
+
+
+class WriteQueue:
+    """
+    Inserts expenses on a background thread, committing them in groups.
+
+    Expenses go to `db_name` unless `submit` names another database; each
+    database in a group gets its own transaction. The thread starts on the
+    first `submit` (or `start`), and again in a forked worker, which does
+    not inherit it.
+    """
+
+    def __init__(self, db_name="expenses.db", max_batch=MAX_BATCH, max_delay=MAX_DELAY_SECONDS,
+                 synchronous="FULL"):
+        self.db_name = db_name
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.synchronous = synchronous
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._last_group_size = 0
+
+    def start(self):
+        """
+        Start the writer thread unless this process already runs one.
+        """
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()  # Expenses queued in the parent are the parent's
+                self._thread = threading.Thread(target=self._run, name="write-queue", daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """
+        Commit what is queued, then stop the writer thread.
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and self._pid == os.getpid():
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+    def submit(self, expense, db_name=None):
+        """
+        Validate `expense` and queue it for the next group commit.
+
+        Args:
+            expense (dict | Expense): An expense as accepted by `write_expense`.
+            db_name (str): The database to add it to (default is the queue's).
+
+        Returns:
+            concurrent.futures.Future: Resolves to the new expense ID once the
+            group is committed, or raises the `sqlite3.Error` that rejected it.
+
+        Raises:
+            ValueError: If a required field is missing or malformed.
+        """
+        row = prepare_expense(expense)
+        future = Future()
+        self.start()
+        self._queue.put((db_name or self.db_name, row, future, time.perf_counter()))
+        return future
+
+    def write(self, expense, db_name=None, timeout=WRITE_TIMEOUT_SECONDS):
+        """
+        Add an expense and wait until it is committed.
+
+        Returns:
+            int: The ID of the new expense.
+
+        Raises:
+            ValueError: If a required field is missing or malformed.
+            sqlite3.Error: If the insert failed.
+            concurrent.futures.TimeoutError: If the commit took longer than `timeout`.
+        """
+        return self.submit(expense, db_name).result(timeout)
+
+    def _next_group(self):
+        """
+        Block for the next expense, then gather a group around it.
+
+        Returns None once `stop` was called and the queue is drained.
+        """
+        item = self._queue.get()
+        if item is _STOP:
+            return None
+        group = [item]
+        # Without recent concurrency, only take what is already waiting
+        delay = self.max_delay if self._last_group_size > 1 else 0
+        deadline = time.monotonic() + delay
+        while len(group) < self.max_batch:
+            try:
+                remaining = deadline - time.monotonic()
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._queue.put(_STOP)  # Stop after committing this group
+                break
+            group.append(item)
+        self._last_group_size = len(group)
+        return group
+
+    def _run(self):
+        while True:
+            group = self._next_group()
+            if group is None:
+                break
+            # One transaction per database, e.g. per user with sharding
+            by_database = {}
+            for item in group:
+                by_database.setdefault(item[0], []).append(item)
+            for db_name, items in by_database.items():
+                self._commit(db_name, items)
+
+    def _commit(self, db_name, group):
+        try:
+            # Connections may be recycled, so the setting is applied every time
+            get_connection(db_name).execute(f"PRAGMA synchronous={self.synchronous}")
+            results = insert_prepared_expenses([row for _, row, _, _ in group], db_name)
+        except sqlite3.Error as e:
+            results = [(None, e)] * len(group)
+        registry.observe("write_queue_group_size", (), len(group))
+        done = time.perf_counter()
+        for (_, _, future, queued), (expense_id, error) in zip(group, results):
+            registry.observe("write_queue_wait_seconds", (), done - queued)
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(expense_id)